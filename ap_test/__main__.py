@@ -3,47 +3,193 @@
 # SPDX-License-Identifier: MIT
 
 import argparse as ap
+import contextlib
 import logging
 import sys
 
+from ap_test import trace, transport
 from ap_test.helper import TestContext
-from ap_test.tests import BaseTest, COMMON_TESTS
+from ap_test.history import History
+from ap_test.load import run_load
+from ap_test.metrics import format_summary
+from ap_test.perf import PERF_TESTS
+from ap_test.profiling import Profiler
+from ap_test.report import RunReport
+from ap_test.runner import run_suites
+from ap_test.tests import COMMON_TESTS
 from ap_test.federation import FEDERATION_TESTS
 
 
-def run_tests(tests: list[BaseTest], failfast: bool = False):
-    def _log(msg, barrier="#"):
-        print(f"{barrier * 4} {msg} {barrier * 4}")
+def _print_transport_stats(ctx: TestContext):
+    counts = transport.stats.as_dict()
+    print()
+    print("=== TRANSPORT ===")
+    print(
+        f"{counts['requests']} requests over {counts['connections']} connections "
+        f"({counts['reused']} reused)"
+    )
+    if counts["tls_handshakes"]:
+        print(f"{counts['tls_handshakes']} TLS handshakes ({counts['tls_resumed']} resumed)")
+    throttle = transport.throttle_stats()
+    if throttle["throttled_seconds"] or throttle["retries"]:
+        print(
+            f"Throttled for {throttle['throttled_seconds']:.1f}s, "
+            f"{throttle['retries']} retries"
+        )
+    cache = transport.cache_stats()
+    if cache is not None:
+        print(
+            f"HTTP cache: {cache['hits']} hits, {cache['misses']} misses, "
+            f"{cache['revalidated']} revalidated (304)"
+        )
+    store = ctx.db.stats
+    print(
+        f"Object store: {store['hits']} hits, {store['misses']} fetches, "
+        f"{store['shared']} shared in-flight, {store['evictions']} evictions"
+    )
+    if ctx.local_server is not None and ctx.local_server.verifier is not None:
+        sigs = ctx.local_server.verifier.as_dict()
+        print(
+            f"Inbound signatures: {sigs['verified']} verified, {sigs['rejected']} rejected, "
+            f"{sigs['keys']['fetches']} key fetches; {format_summary(sigs['duration'], 'ms')}"
+        )
+    index = ctx.collections.stats
+    if index["lookups"]:
+        print(
+            f"Collection index: {index['lookups']} lookups from {index['crawls']} crawls "
+            f"({index['pages']} pages), {index['confirmations']} Bloom confirmations"
+        )
+
 
-    for test in tests:
-        test_name = test.__class__.__name__
-        if test.skip():
-            _log(f"Skipping {test_name}", barrier="*")
-            continue
+def _open_history(ctx: TestContext, opt) -> History | None:
+    settings = dict(ctx.history_settings)
+    if opt.history:
+        settings["path"] = opt.history
+    if "path" not in settings:
+        return None
+    return History(**settings)
 
-        _log(f"Running {test_name}")
-        passed = test.run()
-        status = "passed" if passed else "failed"
-        _log(f"Test {test_name} {status}")
-        if failfast and not passed:
-            return False
 
-    return True
+def _check_history(ctx: TestContext, history: History, report: RunReport) -> bool:
+    """Compare the run with earlier ones and add it to the history; returns
+    whether no timing regressed."""
+    server = ctx.server_key or "unknown"
+    regressions = history.regressions(server, report)
+    history.record(server, report)
+    history.close()
+    if regressions:
+        print()
+        print("=== REGRESSIONS ===")
+        for regression in regressions:
+            print(regression)
+    return not regressions
+
+
+def _run_tests(ctx: TestContext, opt) -> bool:
+    suites = [
+        ("BASE", [tc(ctx) for tc in COMMON_TESTS]),
+        ("FEDERATION", [tc(ctx) for tc in FEDERATION_TESTS]),
+    ]
+    if opt.perf:
+        suites.append(("PERF", [tc(ctx) for tc in PERF_TESTS]))
+    history = _open_history(ctx, opt)
+    report = RunReport() if opt.report or opt.junit or history else None
+    if report is not None:
+        trace.add_sink(report)
+    profiler = None
+    if opt.profile:
+        profiler = Profiler(opt.profile, top=opt.profile_top, memory=opt.profile_memory)
+        profiler.start()
+    with ctx.local_server or contextlib.nullcontext():
+        passed = run_suites(
+            suites,
+            failfast=opt.failfast,
+            concurrency=opt.concurrency,
+            report=report,
+            profiler=profiler,
+        )
+    if profiler is not None:
+        profiler.finish()
+    if report is not None:
+        trace.remove_sink(report)
+        if opt.report:
+            report.write_json(opt.report)
+        if opt.junit:
+            report.write_junit(opt.junit)
+    if history is not None:
+        unchanged = _check_history(ctx, history, report)
+        passed &= unchanged or not opt.fail_on_regression
+    return passed
+
+
+def _load_opts(opt) -> dict:
+    """Load mode settings given on the command line."""
+    settings = {
+        "rate": opt.rate,
+        "duration": opt.duration,
+        "activities": opt.activities,
+        "output": opt.load_output,
+        "concurrency": opt.concurrency if opt.concurrency != 1 else None,
+    }
+    return {key: value for key, value in settings.items() if value is not None}
+
+
+def _add_profile_args(parser: ap.ArgumentParser) -> None:
+    profile = parser.add_argument_group("profiling")
+    profile.add_argument(
+        "--profile", metavar="DIR",
+        help="profile each test with cProfile and write .pstats files to DIR",
+    )
+    profile.add_argument(
+        "--profile-memory", action="store_true",
+        help="also trace allocations with tracemalloc",
+    )
+    profile.add_argument(
+        "--profile-top", type=int, default=20,
+        help="number of functions and allocation sites to print (default: 20)",
+    )
 
 
-def _run_federation(ctx: TestContext, failfast: bool) -> bool:
-    tests = [tc(ctx) for tc in FEDERATION_TESTS]
-    if ctx.has_local_server:
-        with ctx.local_server:
-            return run_tests(tests, failfast=failfast)
-    return run_tests(tests, failfast=failfast)
+def _add_load_args(parser: ap.ArgumentParser) -> None:
+    load = parser.add_argument_group("load mode")
+    load.add_argument("--rate", type=float, help="requests per second (default: closed loop)")
+    load.add_argument("--duration", type=float, help="seconds to generate load for")
+    load.add_argument(
+        "--activity", dest="activities", action="append",
+        help="activity type to send, e.g. create (repeatable)",
+    )
+    load.add_argument("--load-output", help="write a per-second time series (JSON lines)")
 
 
 def main():
     parser = ap.ArgumentParser("ap-test")
+    parser.add_argument(
+        "mode", nargs="?", choices=("run", "load"), default="run",
+        help="run the test suite (default) or generate outbox load",
+    )
     parser.add_argument("--config-file", "-c")
     parser.add_argument("-v", dest="verbosity", action="count")
     parser.add_argument("--failfast", "-x", action="store_true")
+    parser.add_argument(
+        "--concurrency", "-j", type=int, default=1, help="number of tests to run at once"
+    )
+    parser.add_argument("--cache-dir", help="cache GET responses on disk in this directory")
+    parser.add_argument("--perf", action="store_true", help="also run the performance tests")
+    parser.add_argument("--report", help="write per-test results and latencies as JSON")
+    parser.add_argument("--junit", help="write per-test results as JUnit XML")
+    parser.add_argument(
+        "--history", help="compare timings with earlier runs kept in this SQLite file"
+    )
+    parser.add_argument(
+        "--fail-on-regression", action="store_true",
+        help="exit non-zero when a timing regressed against the history",
+    )
+    parser.add_argument("--trace", help="write a JSON-lines record of every HTTP exchange")
+    parser.add_argument(
+        "--trace-chrome", help="write HTTP exchanges as Chrome trace events (chrome://tracing)"
+    )
+    _add_profile_args(parser)
+    _add_load_args(parser)
     for arg in TestContext.ARGS:
         if arg.endswith("_id"):
             action = "store"
@@ -60,6 +206,11 @@ def main():
             format="%(name)-24s: %(levelname)-8s %(message)s",
         )
 
+    if opt.cache_dir:
+        transport.enable_cache(opt.cache_dir)
+    if opt.trace or opt.trace_chrome:
+        trace.enable(opt.trace, opt.trace_chrome)
+
     ctx = TestContext()
     loaded = False
     if opt.config_file:
@@ -72,17 +223,16 @@ def main():
         print("Either pass config using arguments or via a TOML config file.")
         return
 
-    print("=== RUNNING BASE TESTS ===")
-    base_passed = run_tests(
-        [tc(ctx) for tc in COMMON_TESTS],
-        failfast=opt.failfast,
-    )
+    if opt.mode == "load":
+        passed = run_load(ctx, ctx.load_settings | _load_opts(opt))
+    else:
+        passed = _run_tests(ctx, opt)
 
-    print()
-    print("=== RUNNING FEDERATION TESTS ===")
-    fed_passed = _run_federation(ctx, opt.failfast)
+    transport.close()
+    trace.disable()
+    _print_transport_stats(ctx)
 
-    sys.exit(0 if (base_passed and fed_passed) else 1)
+    sys.exit(0 if passed else 1)
 
 
 if __name__ == "__main__":
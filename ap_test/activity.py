@@ -0,0 +1,89 @@
+# Copyright (c) 2023 Pat Long
+# SPDX-License-Identifier: MIT
+
+import re
+import uuid
+
+AS_CONTEXT = "https://www.w3.org/ns/activitystreams"
+AS_PUBLIC = "https://www.w3.org/ns/activitystreams#Public"
+
+# Correlation markers put into outbound activities by new_marker()
+MARKER_RE = re.compile(r"ap-test-[0-9a-f]{32}")
+
+# Reserved domain (RFC 2606) for the filler tags and recipients of large objects
+FILLER_HOST = "https://example.invalid"
+_FILLER_TEXT = "<p>ap-testsuite payload filler, repeated to reach the requested size.</p>"
+
+
+def new_marker() -> str:
+    """Correlation marker that lets the local server recognise a delivery."""
+    return f"ap-test-{uuid.uuid4().hex}"
+
+
+def make_note(actor_id: str, marker: str | None = None) -> dict:
+    return {
+        "@context": AS_CONTEXT,
+        "type": "Note",
+        "attributedTo": actor_id,
+        "content": f"ap-testsuite test note {marker or new_marker()}",
+        "to": [AS_PUBLIC],
+    }
+
+
+def make_create(actor_id: str, obj: dict) -> dict:
+    return {
+        "@context": AS_CONTEXT,
+        "type": "Create",
+        "actor": actor_id,
+        "object": obj,
+        "to": [AS_PUBLIC],
+    }
+
+
+def make_follow(actor_id: str, target: str) -> dict:
+    return {
+        "@context": AS_CONTEXT,
+        "type": "Follow",
+        "actor": actor_id,
+        "object": target,
+        "to": [target],
+    }
+
+
+def make_large_object(
+    actor_id: str, size: int, marker: str | None = None, kind: str = "Note"
+) -> dict:
+    """Note or Article of roughly ``size`` bytes of JSON.
+
+    About a tenth of the size goes to Hashtags, a tenth to image
+    attachments and another tenth to a long ``cc`` list (at most 200
+    recipients); every link points at a host that never resolves. The
+    content fills the rest.
+    """
+    obj = make_note(actor_id, marker)
+    obj["type"] = kind
+    if kind == "Article":
+        obj["name"] = f"ap-testsuite article of {size} bytes"
+    obj["tag"] = [
+        {"type": "Hashtag", "href": f"{FILLER_HOST}/tags/t{i}", "name": f"#t{i}"}
+        for i in range(size // 10 // 80)
+    ]
+    obj["attachment"] = [
+        {
+            "type": "Image",
+            "mediaType": "image/png",
+            "url": f"{FILLER_HOST}/media/m{i}.png",
+            "name": f"attachment {i}",
+        }
+        for i in range(size // 10 // 120)
+    ]
+    obj["cc"] = [f"{FILLER_HOST}/users/u{i}" for i in range(min(size // 10 // 40, 200))]
+    used = (
+        len(obj["content"])
+        + 80 * len(obj["tag"])
+        + 120 * len(obj["attachment"])
+        + 40 * len(obj["cc"])
+    )
+    repeats = max(size - used, 0) // len(_FILLER_TEXT) + 1
+    obj["content"] += (_FILLER_TEXT * repeats)[: max(size - used, 0)]
+    return obj
@@ -3,18 +3,132 @@
 
 import base64
 import hashlib
+import hmac
 import logging
+import re
+import time
 from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
 from urllib.parse import urlparse
 
+from cryptography.exceptions import InvalidSignature
 from cryptography.hazmat.primitives import hashes, serialization
-from cryptography.hazmat.primitives.asymmetric import padding
+from cryptography.hazmat.primitives.asymmetric import ed25519, padding, rsa
 
 log = logging.getLogger(__name__)
 
+# How far a signed Date may be from our clock
+MAX_CLOCK_SKEW = 12 * 60 * 60
+
+_DIGEST_ALGORITHMS = {"sha-256": hashlib.sha256, "sha-512": hashlib.sha512}
+_SIGNATURE_PARAM_RE = re.compile(r'\s*([a-zA-Z]+)\s*=\s*(?:"([^"]*)"|([^,]*))\s*,?')
+
+
+class SignatureError(Exception):
+    """An inbound request's Signature or Digest does not verify."""
+
+
+class SignatureMismatch(SignatureError):
+    """A well-formed signature that the signer's key does not verify."""
+
+
+def _fingerprint(secret: str) -> str:
+    return hashlib.sha256(secret.encode()).hexdigest()[:16]
+
+
+def body_digest(body: bytes) -> str:
+    return "SHA-256=" + base64.b64encode(hashlib.sha256(body).digest()).decode()
+
+
+def verify_digest(headers, body: bytes) -> None:
+    """Check a ``Digest`` header against ``body``; raises SignatureError."""
+    value = headers.get("Digest")
+    if not value:
+        raise SignatureError("missing Digest header")
+    for part in value.split(","):
+        algorithm, _, encoded = part.strip().partition("=")
+        hasher = _DIGEST_ALGORITHMS.get(algorithm.lower())
+        if hasher is None:
+            continue
+        expected = base64.b64encode(hasher(body).digest()).decode()
+        if not hmac.compare_digest(encoded, expected):
+            raise SignatureError(f"{algorithm} digest does not match body")
+        return
+    raise SignatureError(f"no supported algorithm in Digest: {value}")
+
+
+def parse_signature(value: str | None) -> dict[str, str]:
+    """Parameters of a draft-cavage ``Signature`` header."""
+    if not value:
+        raise SignatureError("missing Signature header")
+    params = {
+        m.group(1).lower(): m.group(2) if m.group(2) is not None else m.group(3).strip()
+        for m in _SIGNATURE_PARAM_RE.finditer(value)
+    }
+    for required in ("keyid", "signature"):
+        if required not in params:
+            raise SignatureError(f"Signature has no {required}")
+    return params
+
+
+def signing_string(method: str, path: str, headers, params: dict[str, str]) -> str:
+    lines = []
+    for name in params.get("headers", "date").lower().split():
+        if name == "(request-target)":
+            lines.append(f"{name}: {method.lower()} {path}")
+        elif name in ("(created)", "(expires)") and name.strip("()") in params:
+            lines.append(f"{name}: {params[name.strip('()')]}")
+        elif headers.get(name) is not None:
+            lines.append(f"{name}: {headers.get(name)}")
+        else:
+            raise SignatureError(f"signed header {name} is missing")
+    return "\n".join(lines)
+
+
+def _check_date(headers, params: dict[str, str]) -> None:
+    try:
+        if "created" in params:
+            signed_at = float(params["created"])
+        else:
+            signed_at = parsedate_to_datetime(headers.get("Date")).timestamp()
+    except (TypeError, ValueError) as exc:
+        raise SignatureError("missing or invalid signature date") from exc
+    if abs(time.time() - signed_at) > MAX_CLOCK_SKEW:
+        raise SignatureError("signature date is too far from the current time")
+
+
+def verify_signature(method: str, path: str, headers, params: dict[str, str], public_key):
+    """Verify parsed Signature ``params`` with ``public_key``; raises SignatureError."""
+    signed = params.get("headers", "date").lower().split()
+    if "(request-target)" not in signed:
+        raise SignatureError("(request-target) is not signed")
+    if headers.get("Digest") is not None and "digest" not in signed:
+        raise SignatureError("Digest is not signed")
+    _check_date(headers, params)
+    message = signing_string(method, path, headers, params).encode("utf-8")
+    try:
+        signature = base64.b64decode(params["signature"])
+    except ValueError as exc:
+        raise SignatureError("signature is not base64") from exc
+    try:
+        if isinstance(public_key, rsa.RSAPublicKey):
+            public_key.verify(signature, message, padding.PKCS1v15(), hashes.SHA256())
+        elif isinstance(public_key, ed25519.Ed25519PublicKey):
+            public_key.verify(signature, message)
+        else:
+            raise SignatureError(f"unsupported key type {type(public_key).__name__}")
+    except (InvalidSignature, ValueError) as exc:
+        raise SignatureMismatch("signature does not verify") from exc
+
 
 class BaseAuth:  # pylint: disable=too-few-public-methods
-    def sign_request(self, method: str, url: str, headers: dict, body: bytes | None) -> dict:
+    @property
+    def identity(self) -> str:
+        """Stable, non-secret name for the credentials (used as a cache key)."""
+        raise NotImplementedError
+
+    def sign_request(self, method: str, url: str, headers: dict, body) -> dict:
+        """Headers that authenticate a request; ``body`` is bytes, a file or None."""
         raise NotImplementedError
 
 
@@ -22,6 +136,10 @@ class BearerTokenAuth(BaseAuth):  # pylint: disable=too-few-public-methods
     def __init__(self, token: str) -> None:
         self._token = token
 
+    @property
+    def identity(self) -> str:
+        return f"bearer:{_fingerprint(self._token)}"
+
     def sign_request(self, method, url, headers, body) -> dict:
         return {"Authorization": f"Bearer {self._token}"}
 
@@ -30,21 +148,30 @@ class CookieAuth(BaseAuth):  # pylint: disable=too-few-public-methods
     def __init__(self, cookie: str) -> None:
         self._cookie = cookie
 
+    @property
+    def identity(self) -> str:
+        return f"cookie:{_fingerprint(self._cookie)}"
+
     def sign_request(self, method, url, headers, body) -> dict:
         return {"Cookie": self._cookie}
 
 
 class HttpSignatureAuth(BaseAuth):  # pylint: disable=too-few-public-methods
-    def __init__(self, actor_id: str, private_key_pem: str | bytes) -> None:
+    def __init__(self, actor_id: str, private_key_pem) -> None:
+        """``private_key_pem`` is a PEM string or bytes, or an already loaded key."""
         self._key_id = f"{actor_id}#main-key"
         if isinstance(private_key_pem, str):
             private_key_pem = private_key_pem.encode()
-        self._private_key = serialization.load_pem_private_key(private_key_pem, password=None)
+        if isinstance(private_key_pem, bytes):
+            self._private_key = serialization.load_pem_private_key(private_key_pem, password=None)
+        else:
+            self._private_key = private_key_pem
 
-    def _digest_header(self, body: bytes) -> str:
-        return "SHA-256=" + base64.b64encode(hashlib.sha256(body).digest()).decode()
+    @property
+    def identity(self) -> str:
+        return f"signature:{self._key_id}"
 
-    def sign_request(self, method: str, url: str, headers: dict, body: bytes | None) -> dict:
+    def sign_request(self, method: str, url: str, headers: dict, body) -> dict:
         date = datetime.now(timezone.utc).strftime("%a, %d %b %Y %H:%M:%S GMT")
         parsed = urlparse(url)
         path = (parsed.path or "/") + (f"?{parsed.query}" if parsed.query else "")
@@ -57,8 +184,9 @@ class HttpSignatureAuth(BaseAuth):  # pylint: disable=too-few-public-methods
         ]
         extra = {"Date": date}
 
-        if body:
-            digest = self._digest_header(body)
+        # transport.encode_body() hashes streamed bodies as they are written
+        digest = headers.get("Digest") or (body_digest(body) if body else None)
+        if digest:
             signed.append("digest")
             parts.append(f"digest: {digest}")
             extra["Digest"] = digest
@@ -0,0 +1,145 @@
+# Copyright (c) 2023 Pat Long
+# SPDX-License-Identifier: MIT
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+log = logging.getLogger(__name__)
+
+
+def parse_cache_control(value: str | None) -> dict[str, str | None]:
+    directives: dict[str, str | None] = {}
+    for part in (value or "").split(","):
+        name, _, arg = part.strip().partition("=")
+        if name:
+            directives[name.lower()] = arg.strip('"') if arg else None
+    return directives
+
+
+def _http_date(value: str | None) -> float | None:
+    if not value:
+        return None
+    try:
+        return parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+
+def freshness_lifetime(headers) -> float:
+    """Seconds a response may be served from cache without revalidation."""
+    cc = parse_cache_control(headers.get("Cache-Control"))
+    if "no-cache" in cc:
+        return 0.0
+    lifetime = 0.0
+    if cc.get("max-age") is not None:
+        try:
+            lifetime = float(cc["max-age"])
+        except ValueError:
+            lifetime = 0.0
+    else:
+        expires = _http_date(headers.get("Expires"))
+        date = _http_date(headers.get("Date")) or time.time()
+        if expires is not None:
+            lifetime = expires - date
+    try:
+        lifetime -= float(headers.get("Age", 0))
+    except ValueError:
+        pass
+    return max(lifetime, 0.0)
+
+
+class HttpCache:
+    """On-disk cache of JSON responses, revalidated with conditional GETs.
+
+    Entries are keyed on URL, Accept header and auth identity, so documents
+    fetched with different credentials or media types never mix.
+    """
+
+    def __init__(self, directory: str) -> None:
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.revalidated = 0
+
+    @staticmethod
+    def key(iri: str, accept: str, identity: str) -> str:
+        return hashlib.sha256("\n".join((iri, accept, identity)).encode()).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.json")
+
+    def incr(self, counter: str) -> None:
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def lookup(self, key: str) -> dict | None:
+        try:
+            with open(self._path(key), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as exc:
+            log.warning("Ignoring unreadable cache entry %s: %s", key, exc)
+            return None
+
+    @staticmethod
+    def is_fresh(entry: dict) -> bool:
+        return time.time() < entry["stored_at"] + entry["lifetime"]
+
+    @staticmethod
+    def conditional_headers(entry: dict) -> dict[str, str]:
+        headers = {}
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def store(self, key: str, iri: str, headers, body) -> None:
+        """Store ``body`` unless the response forbids caching or can't be reused."""
+        cc = parse_cache_control(headers.get("Cache-Control"))
+        if "no-store" in cc or headers.get("Vary", "").strip() == "*":
+            self.evict(key)
+            return
+        entry = {
+            "url": iri,
+            "stored_at": time.time(),
+            "lifetime": freshness_lifetime(headers),
+            "etag": headers.get("ETag"),
+            "last_modified": headers.get("Last-Modified"),
+            "body": body,
+        }
+        if not (entry["lifetime"] or entry["etag"] or entry["last_modified"]):
+            return
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(entry, f)
+        os.replace(tmp, self._path(key))
+
+    def refresh(self, key: str, entry: dict, headers) -> None:
+        """Restart the freshness clock of ``entry`` after a 304 response."""
+        merged = {
+            "Cache-Control": headers.get("Cache-Control"),
+            "Expires": headers.get("Expires"),
+            "Date": headers.get("Date"),
+            "ETag": headers.get("ETag") or entry.get("etag"),
+            "Last-Modified": headers.get("Last-Modified") or entry.get("last_modified"),
+        }
+        self.store(key, entry["url"], {k: v for k, v in merged.items() if v}, entry["body"])
+
+    def evict(self, key: str) -> None:
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def as_dict(self) -> dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "revalidated": self.revalidated}
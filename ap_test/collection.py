@@ -0,0 +1,335 @@
+# Copyright (c) 2023 Pat Long
+# SPDX-License-Identifier: MIT
+
+import hashlib
+import logging
+import math
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeout
+from typing import Callable, Iterator
+
+import requests
+
+from . import trace, transport
+
+log = logging.getLogger(__name__)
+
+
+def _fetch_fresh(iri: str) -> dict:
+    return transport.get(iri, fresh=True)
+
+
+def item_id(item) -> str | None:
+    return item.get("id") if isinstance(item, dict) else item
+
+
+def _link(value) -> str | dict | None:
+    """Resolve a first/next value to a URL, or an embedded page."""
+    if isinstance(value, dict):
+        if "orderedItems" in value or "items" in value:
+            return value
+        return value.get("id") or value.get("href")
+    return value
+
+
+class CrawlLimits:  # pylint: disable=too-few-public-methods
+    """Bounds on a single collection crawl; ``None`` means unbounded."""
+
+    def __init__(
+        self,
+        max_pages: int | None = 1000,
+        max_items: int | None = None,
+        timeout: float | None = 300.0,
+    ) -> None:
+        self.max_pages = max_pages
+        self.max_items = max_items
+        self.timeout = timeout
+
+
+class CollectionCrawler:
+    """Streams the items of a (possibly paginated) AP collection.
+
+    Iterating yields item IDs; items() yields the raw items. Only the page
+    being scanned and the next one are held in memory: the next page is
+    fetched in the background while the current one is scanned. Stopping
+    the iteration early abandons the crawl. ``truncated`` is set when a
+    limit ended the crawl before the last page.
+    """
+
+    def __init__(
+        self,
+        iri: str,
+        fetch: Callable[[str], dict] | None = None,
+        limits: CrawlLimits | None = None,
+    ) -> None:
+        self.iri = iri
+        self.fetch = fetch or _fetch_fresh
+        self.limits = limits or CrawlLimits()
+        self.pages = 0
+        self.items_seen = 0
+        self.total_items: int | None = None
+        self.truncated = False
+        # Seconds from starting the crawl until the last page fetched arrived
+        self.elapsed = 0.0
+
+    def __iter__(self) -> Iterator[str | None]:
+        return (item_id(item) for item in self.items())
+
+    def _page_limit_reached(self) -> bool:
+        return self.limits.max_pages is not None and self.pages >= self.limits.max_pages
+
+    def _follow(  # pylint: disable=too-many-arguments
+        self, page: dict, is_root: bool, pool: ThreadPoolExecutor, fetch, visited: set
+    ):
+        """Start fetching the page after ``page``; returns its future, if any."""
+        items = page.get("orderedItems") or page.get("items")
+        # Collection roots often only link to their first page
+        nxt = _link(page.get("first") if is_root and not items else page.get("next"))
+        if nxt is None:
+            return None
+        if self._page_limit_reached():
+            self.truncated = True
+            return None
+        if isinstance(nxt, dict):
+            done: Future = Future()
+            done.set_result(nxt)
+            return done
+        if nxt in visited:
+            return None
+        visited.add(nxt)
+        return pool.submit(fetch, nxt)
+
+    def items(self) -> Iterator:
+        deadline = None
+        if self.limits.timeout is not None:
+            deadline = time.monotonic() + self.limits.timeout
+        started = time.monotonic()
+        visited = {self.iri}
+        pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="crawl")
+        fetch = trace.bind(self.fetch)
+        try:
+            pending = pool.submit(fetch, self.iri)
+            while pending is not None:
+                remaining = None if deadline is None else max(deadline - time.monotonic(), 0)
+                try:
+                    page = pending.result(timeout=remaining)
+                except FutureTimeout:
+                    log.warning("Timed out crawling %s after %d pages", self.iri, self.pages)
+                    self.truncated = True
+                    return
+                self.elapsed = time.monotonic() - started
+                self.pages += 1
+                if self.pages == 1:
+                    self.total_items = page.get("totalItems")
+                pending = self._follow(page, self.pages == 1, pool, fetch, visited)
+                for item in page.get("orderedItems") or page.get("items") or []:
+                    if self.limits.max_items is not None and (
+                        self.items_seen >= self.limits.max_items
+                    ):
+                        log.warning("Stopped crawling %s after %d items", self.iri, self.items_seen)
+                        self.truncated = True
+                        return
+                    self.items_seen += 1
+                    yield item
+            if self.truncated:
+                log.warning("Stopped crawling %s after %d pages", self.iri, self.pages)
+        finally:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+
+def find_in_collection(
+    iri: str,
+    target_id: str,
+    fetch: Callable[[str], dict] | None = None,
+    limits: CrawlLimits | None = None,
+) -> bool:
+    """Return True if target_id appears anywhere in a (possibly paginated) AP collection."""
+    try:
+        return any(found == target_id for found in CollectionCrawler(iri, fetch, limits))
+    except requests.HTTPError:
+        return False
+
+
+class PollBackoff:  # pylint: disable=too-few-public-methods
+    """Delays between polls: ``initial`` seconds, growing by ``factor`` up to
+    ``maximum``, for at most ``timeout`` seconds in all."""
+
+    def __init__(
+        self,
+        timeout: float = 30.0,
+        initial: float = 0.1,
+        factor: float = 2.0,
+        maximum: float = 5.0,
+    ) -> None:
+        self.timeout = timeout
+        self.initial = initial
+        self.factor = factor
+        self.maximum = maximum
+
+    def delays(self) -> Iterator[float]:
+        delay = self.initial
+        while True:
+            yield delay
+            delay = min(delay * self.factor, self.maximum)
+
+
+def wait_until_visible(
+    iri: str,
+    target_id: str,
+    fetch: Callable[[str], dict] | None = None,
+    limits: CrawlLimits | None = None,
+    backoff: PollBackoff | None = None,
+) -> float | None:
+    """Poll a collection until ``target_id`` appears in it.
+
+    Each poll is an early-exit crawl. Returns the seconds waited, or None if
+    the item did not appear within the backoff's timeout.
+    """
+    backoff = backoff or PollBackoff()
+    start = time.monotonic()
+    deadline = start + backoff.timeout
+    for delay in backoff.delays():
+        if find_in_collection(iri, target_id, fetch, limits):
+            return time.monotonic() - start
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return None
+        time.sleep(min(delay, remaining))
+    return None
+
+
+def _hash64(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), "big")
+
+
+class BloomFilter:
+    """Bloom filter over 64-bit member hashes."""
+
+    def __init__(self, capacity: int, error_rate: float = 0.01) -> None:
+        self.size = max(int(-capacity * math.log(error_rate) / math.log(2) ** 2), 8)
+        self.hashes = max(round(self.size / capacity * math.log(2)), 1)
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, h: int) -> Iterator[int]:
+        # Kirsch-Mitzenmacher: derive every probe from the two hash halves
+        h1, h2 = h & 0xFFFFFFFF, (h >> 32) | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hashes))
+
+    def add(self, h: int) -> None:
+        for pos in self._positions(h):
+            self._bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, h: int) -> bool:
+        return all(self._bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(h))
+
+
+class _Members:  # pylint: disable=too-few-public-methods
+    def __init__(self) -> None:
+        self.hashes: set[int] | None = set()
+        self.bloom: BloomFilter | None = None
+        self.truncated = False
+
+    def add(self, h: int, exact_limit: int, expected: int | None) -> None:
+        if self.bloom is not None:
+            self.bloom.add(h)
+            return
+        self.hashes.add(h)
+        if len(self.hashes) > exact_limit:
+            self.bloom = BloomFilter(max(expected or 0, 4 * exact_limit))
+            for member in self.hashes:
+                self.bloom.add(member)
+            self.hashes = None
+
+
+class CollectionIndex:
+    """Per-run membership index over crawled collections.
+
+    Each collection is crawled once and its member IDs are kept as 64-bit
+    hashes. Collections with more than ``exact_limit`` members are kept in
+    a Bloom filter instead; a positive answer from the filter is confirmed
+    by an early-exit crawl. Tests that change follow state invalidate the
+    affected collections.
+    """
+
+    def __init__(
+        self,
+        limits: CrawlLimits | None = None,
+        fetch: Callable[[str], dict] | None = None,
+        exact_limit: int = 100_000,
+    ) -> None:
+        self.limits = limits or CrawlLimits()
+        self.fetch = fetch
+        self.exact_limit = exact_limit
+        self._lock = threading.Lock()
+        self._iri_locks: dict[str, threading.Lock] = {}
+        self._members: dict[str, _Members] = {}
+        self.stats = {"crawls": 0, "pages": 0, "lookups": 0, "confirmations": 0}
+
+    def _build(self, iri: str) -> _Members:
+        crawler = CollectionCrawler(iri, self.fetch, self.limits)
+        members = _Members()
+        for member in crawler:
+            if member is not None:
+                members.add(_hash64(member), self.exact_limit, crawler.total_items)
+        members.truncated = crawler.truncated
+        with self._lock:
+            self.stats["crawls"] += 1
+            self.stats["pages"] += crawler.pages
+        return members
+
+    def _get(self, iri: str) -> _Members:
+        with self._lock:
+            iri_lock = self._iri_locks.setdefault(iri, threading.Lock())
+        # One crawl per collection, however many tests ask at once
+        with iri_lock:
+            with self._lock:
+                members = self._members.get(iri)
+            if members is None:
+                members = self._build(iri)
+                with self._lock:
+                    self._members[iri] = members
+        return members
+
+    def contains(self, iri: str, member_id: str) -> bool | None:
+        """Return True if ``member_id`` is in the collection at ``iri``, or
+        None if the collection is too large to tell within the crawl limits.
+
+        Raises requests.HTTPError if the collection can't be crawled, including
+        when a Bloom filter match can't be confirmed.
+        """
+        members = self._get(iri)
+        h = _hash64(member_id)
+        with self._lock:
+            self.stats["lookups"] += 1
+        if members.hashes is not None:
+            if h in members.hashes:
+                return True
+        elif h in members.bloom:
+            with self._lock:
+                self.stats["confirmations"] += 1
+            if any(found == member_id for found in CollectionCrawler(iri, self.fetch, self.limits)):
+                return True
+        if not members.truncated:
+            return False
+        return self._search_past_limits(iri, member_id)
+
+    def _search_past_limits(self, iri: str, member_id: str) -> bool | None:
+        """Look for ``member_id`` beyond the page and item limits that cut
+        the index short, stopping at the first match or the timeout."""
+        log.warning(
+            "Index of %s is partial; crawling past the page limits for %s", iri, member_id
+        )
+        limits = CrawlLimits(max_pages=None, max_items=None, timeout=self.limits.timeout)
+        crawler = CollectionCrawler(iri, self.fetch, limits)
+        if any(found == member_id for found in crawler):
+            return True
+        if crawler.truncated:
+            log.warning("Could not tell whether %s is in %s before timing out", member_id, iri)
+            return None
+        return False
+
+    def invalidate(self, *iris: str | None) -> None:
+        with self._lock:
+            for iri in iris:
+                self._members.pop(iri, None)
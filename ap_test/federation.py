@@ -2,39 +2,17 @@
 # SPDX-License-Identifier: MIT
 
 import logging
+import time
 
 import requests
 
-from . import transport
-from .tests import AS_PUBLIC, BaseTest, FederationTest, ServerRequiredTest, find_in_collection
+from .activity import AS_CONTEXT, AS_PUBLIC, make_create, make_follow, make_note, new_marker
+from .tests import BaseTest, FederationTest, ServerRequiredTest
 
 log = logging.getLogger(__name__)
 
-AS_CONTEXT = "https://www.w3.org/ns/activitystreams"
-
-
-# ---------------------------------------------------------------------------
-# Activity construction helpers
-# ---------------------------------------------------------------------------
-
-def _make_note(actor_id: str) -> dict:
-    return {
-        "@context": AS_CONTEXT,
-        "type": "Note",
-        "attributedTo": actor_id,
-        "content": "ap-testsuite test note",
-        "to": [AS_PUBLIC],
-    }
-
-
-def _make_create(actor_id: str, obj: dict) -> dict:
-    return {
-        "@context": AS_CONTEXT,
-        "type": "Create",
-        "actor": actor_id,
-        "object": obj,
-        "to": [AS_PUBLIC],
-    }
+# Pages scanned for recently delivered items (collection root + first page)
+RECENT_PAGES = 2
 
 
 # ---------------------------------------------------------------------------
@@ -44,14 +22,13 @@ def _make_create(actor_id: str, obj: dict) -> dict:
 class GetOutboxTest(BaseTest):
     def skip(self) -> bool:
         if not self.ctx.actor_id:
-            log.info("Skipping; actor_id not configured")
-            return True
+            return self._skip("actor_id not configured")
         return False
 
     def run(self) -> bool:
         try:
-            actor = transport.get(self.ctx.actor_id)
-            outbox = transport.get(actor["outbox"])
+            actor = self._get(self.ctx.actor_id)
+            outbox = self._get(actor["outbox"])
         except (requests.HTTPError, KeyError) as exc:
             log.error("Failed to get outbox: %s", exc)
             return False
@@ -64,13 +41,12 @@ class GetOutboxTest(BaseTest):
 class GetFollowersTest(BaseTest):
     def skip(self) -> bool:
         if not self.ctx.followers_id:
-            log.info("Skipping; followers_id not configured")
-            return True
+            return self._skip("followers_id not configured")
         return False
 
     def run(self) -> bool:
         try:
-            followers = transport.get(self.ctx.followers_id)
+            followers = self._get(self.ctx.followers_id)
         except requests.HTTPError as exc:
             log.error("Failed to get followers: %s", exc)
             return False
@@ -83,13 +59,12 @@ class GetFollowersTest(BaseTest):
 class GetFollowingTest(BaseTest):
     def skip(self) -> bool:
         if not self.ctx.following_id:
-            log.info("Skipping; following_id not configured")
-            return True
+            return self._skip("following_id not configured")
         return False
 
     def run(self) -> bool:
         try:
-            following = transport.get(self.ctx.following_id)
+            following = self._get(self.ctx.following_id)
         except requests.HTTPError as exc:
             log.error("Failed to get following: %s", exc)
             return False
@@ -102,41 +77,37 @@ class GetFollowingTest(BaseTest):
 class FollowingHasAcceptedFollowTest(BaseTest):
     def skip(self) -> bool:
         if not self.ctx.following_id:
-            log.info("Skipping; following_id not configured")
-            return True
+            return self._skip("following_id not configured")
         if not self.ctx.accepted_follow_actor_id:
-            log.info("Skipping; accepted_follow_actor_id not configured")
-            return True
+            return self._skip("accepted_follow_actor_id not configured")
         return False
 
     def run(self) -> bool:
-        found = find_in_collection(self.ctx.following_id, self.ctx.accepted_follow_actor_id)
-        if not found:
+        found = self._in_collection(self.ctx.following_id, self.ctx.accepted_follow_actor_id)
+        if found is False:
             log.error(
                 "Accepted actor %s not found in following collection",
                 self.ctx.accepted_follow_actor_id,
             )
-        return found
+        return bool(found)
 
 
 class FollowingNotHasRejectedFollowTest(BaseTest):
     def skip(self) -> bool:
         if not self.ctx.following_id:
-            log.info("Skipping; following_id not configured")
-            return True
+            return self._skip("following_id not configured")
         if not self.ctx.rejected_follow_actor_id:
-            log.info("Skipping; rejected_follow_actor_id not configured")
-            return True
+            return self._skip("rejected_follow_actor_id not configured")
         return False
 
     def run(self) -> bool:
-        found = find_in_collection(self.ctx.following_id, self.ctx.rejected_follow_actor_id)
+        found = self._in_collection(self.ctx.following_id, self.ctx.rejected_follow_actor_id)
         if found:
             log.error(
                 "Rejected actor %s unexpectedly found in following collection",
                 self.ctx.rejected_follow_actor_id,
             )
-        return not found
+        return found is False
 
 
 # ---------------------------------------------------------------------------
@@ -148,7 +119,7 @@ class DeliversActivitiesTest(FederationTest):
         actor = self._get_actor()
         if actor is None:
             return False
-        activity = _make_create(self.ctx.local_actor_id, _make_note(self.ctx.local_actor_id))
+        activity = make_create(self.ctx.local_actor_id, make_note(self.ctx.local_actor_id))
         return self._post_activity(actor["outbox"], activity) is not None
 
 
@@ -157,7 +128,7 @@ class OutboxContainsActivitiesTest(FederationTest):
         actor = self._get_actor()
         if actor is None:
             return False
-        activity = _make_create(self.ctx.local_actor_id, _make_note(self.ctx.local_actor_id))
+        activity = make_create(self.ctx.local_actor_id, make_note(self.ctx.local_actor_id))
         result = self._post_activity(actor["outbox"], activity)
         if result is None:
             return False
@@ -165,16 +136,13 @@ class OutboxContainsActivitiesTest(FederationTest):
         if not activity_id:
             log.info("Server did not return activity ID; skipping outbox check")
             return True
-        try:
-            outbox = transport.get(actor["outbox"], auth=self.ctx.auth)
-        except requests.HTTPError as exc:
-            log.error("Failed to re-fetch outbox: %s", exc)
+        # Servers may publish to the outbox asynchronously
+        waited = self._wait_visible(actor["outbox"], activity_id, max_pages=RECENT_PAGES)
+        if waited is None:
+            log.error("Posted activity %s not found in outbox", activity_id)
             return False
-        items = outbox.get("orderedItems") or []
-        if any((i.get("id") if isinstance(i, dict) else i) == activity_id for i in items):
-            return True
-        log.error("Posted activity %s not found in outbox", activity_id)
-        return False
+        self.metrics["outbox_visibility"] = waited
+        return True
 
 
 class ActivityHasIdTest(FederationTest):
@@ -182,7 +150,7 @@ class ActivityHasIdTest(FederationTest):
         actor = self._get_actor()
         if actor is None:
             return False
-        activity = _make_create(self.ctx.local_actor_id, _make_note(self.ctx.local_actor_id))
+        activity = make_create(self.ctx.local_actor_id, make_note(self.ctx.local_actor_id))
         result = self._post_activity(actor["outbox"], activity)
         if result is None:
             return False
@@ -208,7 +176,7 @@ class _ActivityTypeTest(FederationTest):  # pylint: disable=abstract-method
 
 class DeliversCreateTest(_ActivityTypeTest):
     def _make_activity(self, actor_id: str) -> dict:
-        return _make_create(actor_id, _make_note(actor_id))
+        return make_create(actor_id, make_note(actor_id))
 
 
 class DeliversUpdateTest(_ActivityTypeTest):
@@ -238,8 +206,7 @@ class DeliversFollowTest(_ActivityTypeTest):
         if super().skip():
             return True
         if not self.ctx.actor_id:
-            log.info("Skipping; actor_id not configured")
-            return True
+            return self._skip("actor_id not configured")
         return False
 
     def _make_activity(self, actor_id: str) -> dict:
@@ -276,12 +243,13 @@ class DeliversRemoveTest(_ActivityTypeTest):
 
 
 class DeliversLikeTest(_ActivityTypeTest):
+    consumes = ("object_id",)
+
     def skip(self) -> bool:
         if super().skip():
             return True
         if not self.ctx.object_id:
-            log.info("Skipping; object_id not configured")
-            return True
+            return self._skip("object_id not configured")
         return False
 
     def _make_activity(self, actor_id: str) -> dict:
@@ -295,12 +263,15 @@ class DeliversLikeTest(_ActivityTypeTest):
 
 
 class DeliversBlockTest(_ActivityTypeTest):
+    # Tests that change or check the follow and block state between
+    # local_actor_id and actor_id run one at a time, in list order
+    depends_on = (DeliversFollowTest,)
+
     def skip(self) -> bool:
         if super().skip():
             return True
         if not self.ctx.actor_id:
-            log.info("Skipping; actor_id not configured")
-            return True
+            return self._skip("actor_id not configured")
         return False
 
     def _make_activity(self, actor_id: str) -> dict:
@@ -313,12 +284,13 @@ class DeliversBlockTest(_ActivityTypeTest):
 
 
 class DeliversUndoTest(_ActivityTypeTest):
+    depends_on = (DeliversBlockTest,)
+
     def skip(self) -> bool:
         if super().skip():
             return True
         if not self.ctx.actor_id:
-            log.info("Skipping; actor_id not configured")
-            return True
+            return self._skip("actor_id not configured")
         return False
 
     def _make_activity(self, actor_id: str) -> dict:
@@ -360,29 +332,23 @@ class NoDoubleDeliveryTest(FederationTest):
         if super().skip():
             return True
         if not self.ctx.inbox_id:
-            log.info("Skipping; inbox_id not configured")
-            return True
+            return self._skip("inbox_id not configured")
         return False
 
     def run(self) -> bool:
         actor = self._get_actor()
         if actor is None:
             return False
-        activity = _make_create(self.ctx.local_actor_id, _make_note(self.ctx.local_actor_id))
+        activity = make_create(self.ctx.local_actor_id, make_note(self.ctx.local_actor_id))
         activity["id"] = f"{self.ctx.local_actor_id}/activities/dedup-test"
         for _ in range(2):
             self._post_activity(actor["outbox"], activity)
+        inbox = self._crawl(self.ctx.inbox_id, auth=self.ctx.auth, max_pages=RECENT_PAGES)
         try:
-            inbox = transport.get(self.ctx.inbox_id, auth=self.ctx.auth)
+            count = sum(1 for found in inbox if found == activity["id"])
         except requests.HTTPError as exc:
             log.error("Failed to fetch inbox: %s", exc)
             return False
-        items = inbox.get("orderedItems") or inbox.get("items") or []
-        activity_id = activity["id"]
-        count = sum(
-            1 for i in items
-            if (i.get("id") if isinstance(i, dict) else i) == activity_id
-        )
         if count > 1:
             log.error("Activity delivered %d times; expected 1", count)
             return False
@@ -394,7 +360,7 @@ class NoSelfAddressTest(FederationTest):
         actor = self._get_actor()
         if actor is None:
             return False
-        activity = _make_create(self.ctx.local_actor_id, _make_note(self.ctx.local_actor_id))
+        activity = make_create(self.ctx.local_actor_id, make_note(self.ctx.local_actor_id))
         activity["to"] = [self.ctx.local_actor_id, AS_PUBLIC]
         result = self._post_activity(actor["outbox"], activity)
         if result is None:
@@ -404,12 +370,13 @@ class NoSelfAddressTest(FederationTest):
 
 
 class NoDeliverBlocksTest(FederationTest):
+    depends_on = (DeliversUndoTest,)
+
     def skip(self) -> bool:
         if super().skip():
             return True
         if not self.ctx.actor_id:
-            log.info("Skipping; actor_id not configured")
-            return True
+            return self._skip("actor_id not configured")
         return False
 
     def run(self) -> bool:
@@ -434,39 +401,32 @@ class DedupeInboxTest(FederationTest):
         if super().skip():
             return True
         if not self.ctx.actor_id:
-            log.info("Skipping; actor_id not configured")
-            return True
+            return self._skip("actor_id not configured")
         if not self.ctx.inbox_id:
-            log.info("Skipping; inbox_id not configured")
-            return True
+            return self._skip("inbox_id not configured")
         return False
 
     def run(self) -> bool:
-        activity = _make_create(self.ctx.local_actor_id, _make_note(self.ctx.local_actor_id))
+        activity = make_create(self.ctx.local_actor_id, make_note(self.ctx.local_actor_id))
         activity["id"] = f"{self.ctx.local_actor_id}/activities/inbox-dedup-test"
         try:
-            remote_actor = transport.get(self.ctx.actor_id)
+            remote_actor = self._get(self.ctx.actor_id)
             inbox_url = remote_actor.get("inbox")
         except (requests.HTTPError, KeyError) as exc:
             log.error("Failed to resolve remote inbox: %s", exc)
             return False
         for _ in range(2):
             try:
-                transport.post(inbox_url, activity, auth=self.ctx.auth)
+                self._post(inbox_url, activity, auth=self.ctx.auth)
             except requests.HTTPError as exc:
                 log.error("POST to remote inbox failed: %s", exc)
                 return False
+        inbox = self._crawl(self.ctx.inbox_id, auth=self.ctx.auth, max_pages=RECENT_PAGES)
         try:
-            inbox = transport.get(self.ctx.inbox_id, auth=self.ctx.auth)
+            count = sum(1 for found in inbox if found == activity["id"])
         except requests.HTTPError as exc:
             log.error("Failed to fetch local inbox: %s", exc)
             return False
-        items = inbox.get("orderedItems") or inbox.get("items") or []
-        activity_id = activity["id"]
-        count = sum(
-            1 for i in items
-            if (i.get("id") if isinstance(i, dict) else i) == activity_id
-        )
         if count > 1:
             log.error("Activity appeared %d times in inbox; expected 1", count)
             return False
@@ -474,25 +434,20 @@ class DedupeInboxTest(FederationTest):
 
 
 class SendFollowAcceptanceTest(FederationTest):
+    depends_on = (NoDeliverBlocksTest,)
+
     def skip(self) -> bool:
         if super().skip():
             return True
         if not self.ctx.actor_id:
-            log.info("Skipping; actor_id not configured")
-            return True
+            return self._skip("actor_id not configured")
         return False
 
     def run(self) -> bool:
         actor = self._get_actor()
         if actor is None:
             return False
-        follow = {
-            "@context": AS_CONTEXT,
-            "type": "Follow",
-            "actor": self.ctx.local_actor_id,
-            "object": self.ctx.actor_id,
-            "to": [self.ctx.actor_id],
-        }
+        follow = make_follow(self.ctx.local_actor_id, self.ctx.actor_id)
         return self._post_activity(actor["outbox"], follow) is not None
 
 
@@ -501,36 +456,30 @@ class SendFollowRejectionTest(FederationTest):
         if super().skip():
             return True
         if not self.ctx.rejected_follow_actor_id:
-            log.info("Skipping; rejected_follow_actor_id not configured")
-            return True
+            return self._skip("rejected_follow_actor_id not configured")
         return False
 
     def run(self) -> bool:
         actor = self._get_actor()
         if actor is None:
             return False
-        follow = {
-            "@context": AS_CONTEXT,
-            "type": "Follow",
-            "actor": self.ctx.local_actor_id,
-            "object": self.ctx.rejected_follow_actor_id,
-            "to": [self.ctx.rejected_follow_actor_id],
-        }
+        follow = make_follow(self.ctx.local_actor_id, self.ctx.rejected_follow_actor_id)
         return self._post_activity(actor["outbox"], follow) is not None
 
 
 class AcceptFollowTest(FederationTest):
+    depends_on = (SendFollowAcceptanceTest,)
+
     def skip(self) -> bool:
         if super().skip():
             return True
         if not self.ctx.actor_id:
-            log.info("Skipping; actor_id not configured")
-            return True
+            return self._skip("actor_id not configured")
         return False
 
     def run(self) -> bool:
         try:
-            remote_actor = transport.get(self.ctx.actor_id)
+            remote_actor = self._get(self.ctx.actor_id)
             inbox_url = remote_actor.get("inbox")
         except (requests.HTTPError, KeyError) as exc:
             log.error("Failed to resolve remote actor inbox: %s", exc)
@@ -548,7 +497,7 @@ class AcceptFollowTest(FederationTest):
             },
         }
         try:
-            transport.post(inbox_url, accept, auth=self.ctx.auth)
+            self._post(inbox_url, accept, auth=self.ctx.auth)
         except requests.HTTPError as exc:
             log.error("POST Accept to remote inbox failed: %s", exc)
             return False
@@ -556,17 +505,18 @@ class AcceptFollowTest(FederationTest):
 
 
 class RejectFollowTest(FederationTest):
+    depends_on = (AcceptFollowTest,)
+
     def skip(self) -> bool:
         if super().skip():
             return True
         if not self.ctx.actor_id:
-            log.info("Skipping; actor_id not configured")
-            return True
+            return self._skip("actor_id not configured")
         return False
 
     def run(self) -> bool:
         try:
-            remote_actor = transport.get(self.ctx.actor_id)
+            remote_actor = self._get(self.ctx.actor_id)
             inbox_url = remote_actor.get("inbox")
         except (requests.HTTPError, KeyError) as exc:
             log.error("Failed to resolve remote actor inbox: %s", exc)
@@ -584,7 +534,7 @@ class RejectFollowTest(FederationTest):
             },
         }
         try:
-            transport.post(inbox_url, reject, auth=self.ctx.auth)
+            self._post(inbox_url, reject, auth=self.ctx.auth)
         except requests.HTTPError as exc:
             log.error("POST Reject to remote inbox failed: %s", exc)
             return False
@@ -592,12 +542,13 @@ class RejectFollowTest(FederationTest):
 
 
 class NoUnauthorizedUpdateTest(FederationTest):
+    consumes = ("object_id",)
+
     def skip(self) -> bool:
         if super().skip():
             return True
         if not self.ctx.object_id:
-            log.info("Skipping; object_id not configured")
-            return True
+            return self._skip("object_id not configured")
         return False
 
     def run(self) -> bool:
@@ -616,7 +567,7 @@ class NoUnauthorizedUpdateTest(FederationTest):
             "to": [AS_PUBLIC],
         }
         try:
-            transport.post(actor["outbox"], update, auth=self.ctx.auth)
+            self._post(actor["outbox"], update, auth=self.ctx.auth)
         except requests.HTTPError as exc:
             resp = exc.response
             if resp is not None and resp.status_code in (401, 403, 422):
@@ -629,17 +580,19 @@ class NoUnauthorizedUpdateTest(FederationTest):
 
 
 class ConfirmUnauthorizedUpdateTest(FederationTest):
+    consumes = ("object_id",)
+    depends_on = (NoUnauthorizedUpdateTest,)
+
     def skip(self) -> bool:
         if super().skip():
             return True
         if not self.ctx.object_id:
-            log.info("Skipping; object_id not configured")
-            return True
+            return self._skip("object_id not configured")
         return False
 
     def run(self) -> bool:
         try:
-            obj = transport.get(self.ctx.object_id)
+            obj = self._get(self.ctx.object_id, fresh=True)
         except requests.HTTPError as exc:
             log.error("Failed to fetch object: %s", exc)
             return False
@@ -655,13 +608,12 @@ class DeliveryRecipientsTest(FederationTest):
         if super().skip():
             return True
         if not self.ctx.actor_id:
-            log.info("Skipping; actor_id not configured")
-            return True
+            return self._skip("actor_id not configured")
         return False
 
     def _post_addressed(self, outbox_url: str, field: str) -> bool:
         actor_id = self.ctx.local_actor_id
-        activity = _make_create(actor_id, _make_note(actor_id))
+        activity = make_create(actor_id, make_note(actor_id))
         activity[field] = [self.ctx.actor_id]
         result = self._post_activity(outbox_url, activity)
         if result is None:
@@ -682,15 +634,14 @@ class DeliveryToCollectionTest(FederationTest):
         if super().skip():
             return True
         if not self.ctx.followers_id:
-            log.info("Skipping; followers_id not configured")
-            return True
+            return self._skip("followers_id not configured")
         return False
 
     def run(self) -> bool:
         actor = self._get_actor()
         if actor is None:
             return False
-        activity = _make_create(self.ctx.local_actor_id, _make_note(self.ctx.local_actor_id))
+        activity = make_create(self.ctx.local_actor_id, make_note(self.ctx.local_actor_id))
         activity["to"] = [self.ctx.followers_id]
         return self._post_activity(actor["outbox"], activity) is not None
 
@@ -700,8 +651,7 @@ class DeliveryNestedCollectionTest(FederationTest):
         if super().skip():
             return True
         if not self.ctx.actor_id:
-            log.info("Skipping; actor_id not configured")
-            return True
+            return self._skip("actor_id not configured")
         return False
 
     def run(self) -> bool:
@@ -709,7 +659,7 @@ class DeliveryNestedCollectionTest(FederationTest):
         if actor is None:
             return False
         try:
-            remote_actor = transport.get(self.ctx.actor_id)
+            remote_actor = self._get(self.ctx.actor_id)
             followers = remote_actor.get("followers")
         except (requests.HTTPError, KeyError) as exc:
             log.error("Failed to resolve remote followers: %s", exc)
@@ -717,7 +667,7 @@ class DeliveryNestedCollectionTest(FederationTest):
         if not followers:
             log.info("Remote actor has no followers collection; skipping")
             return True
-        activity = _make_create(self.ctx.local_actor_id, _make_note(self.ctx.local_actor_id))
+        activity = make_create(self.ctx.local_actor_id, make_note(self.ctx.local_actor_id))
         activity["to"] = [followers]
         return self._post_activity(actor["outbox"], activity) is not None
 
@@ -727,15 +677,14 @@ class DerefDeliveryTargetsTest(FederationTest):
         if super().skip():
             return True
         if not self.ctx.actor_id:
-            log.info("Skipping; actor_id not configured")
-            return True
+            return self._skip("actor_id not configured")
         return False
 
     def run(self) -> bool:
         actor = self._get_actor()
         if actor is None:
             return False
-        activity = _make_create(self.ctx.local_actor_id, _make_note(self.ctx.local_actor_id))
+        activity = make_create(self.ctx.local_actor_id, make_note(self.ctx.local_actor_id))
         activity["to"] = [self.ctx.actor_id, AS_PUBLIC]
         result = self._post_activity(actor["outbox"], activity)
         if result is None:
@@ -748,92 +697,87 @@ class DerefDeliveryTargetsTest(FederationTest):
 # Group C: Bidirectional tests (require local server)
 # ---------------------------------------------------------------------------
 
-class ReceiveAcceptFollowTest(ServerRequiredTest):
-    def skip(self) -> bool:
-        if super().skip():
-            return True
-        if not self.ctx.actor_id:
-            log.info("Skipping; actor_id not configured")
-            return True
-        return False
+class _FollowReplyTest(ServerRequiredTest):  # pylint: disable=abstract-method
+    """Base for tests that Follow a remote actor and wait for its reply."""
+
+    expected = ""
+
+    def _target(self) -> str:
+        raise NotImplementedError
 
     def run(self) -> bool:
         actor = self._get_actor()
         if actor is None:
             return False
-        follow = {
-            "@context": AS_CONTEXT,
-            "type": "Follow",
-            "actor": self.ctx.local_actor_id,
-            "object": self.ctx.actor_id,
-            "to": [self.ctx.actor_id],
-        }
-        if self._post_activity(actor["outbox"], follow) is None:
+        target = self._target()
+        follow = make_follow(self.ctx.local_actor_id, target)
+        sent = time.monotonic()
+        result = self._post_activity(actor["outbox"], follow)
+        if result is None:
             return False
-        log.info("Waiting for Accept from remote server (timeout=30s)")
-        reply = self.ctx.local_server.wait_for_activity(timeout=30.0)
+        spec = {"type": ("Accept", "Reject"), "actor": target}
+        if isinstance(result, dict) and result.get("id"):
+            spec["object"] = result["id"]
+        log.info("Waiting for %s from remote server (timeout=30s)", self.expected)
+        reply = self.ctx.local_server.wait_for(spec, timeout=30.0, since=sent)
         if reply is None:
-            log.error("Timed out waiting for Accept activity")
+            log.error("Timed out waiting for %s activity", self.expected)
             return False
-        if reply.get("type") != "Accept":
-            log.error("Expected Accept, got %s", reply.get("type"))
+        if reply.activity.get("type") != self.expected:
+            log.error("Expected %s, got %s", self.expected, reply.activity.get("type"))
             return False
         return True
 
 
-class ReceiveRejectFollowTest(ServerRequiredTest):
+class ReceiveAcceptFollowTest(_FollowReplyTest):
+    depends_on = (RejectFollowTest,)
+    expected = "Accept"
+
     def skip(self) -> bool:
         if super().skip():
             return True
-        if not self.ctx.rejected_follow_actor_id:
-            log.info("Skipping; rejected_follow_actor_id not configured")
+        if not self.ctx.actor_id:
+            return self._skip("actor_id not configured")
+        return False
+
+    def _target(self) -> str:
+        return self.ctx.actor_id
+
+
+class ReceiveRejectFollowTest(_FollowReplyTest):
+    expected = "Reject"
+
+    def skip(self) -> bool:
+        if super().skip():
             return True
+        if not self.ctx.rejected_follow_actor_id:
+            return self._skip("rejected_follow_actor_id not configured")
         return False
 
-    def run(self) -> bool:
-        actor = self._get_actor()
-        if actor is None:
-            return False
-        follow = {
-            "@context": AS_CONTEXT,
-            "type": "Follow",
-            "actor": self.ctx.local_actor_id,
-            "object": self.ctx.rejected_follow_actor_id,
-            "to": [self.ctx.rejected_follow_actor_id],
-        }
-        if self._post_activity(actor["outbox"], follow) is None:
-            return False
-        log.info("Waiting for Reject from remote server (timeout=30s)")
-        reply = self.ctx.local_server.wait_for_activity(timeout=30.0)
-        if reply is None:
-            log.error("Timed out waiting for Reject activity")
-            return False
-        if reply.get("type") != "Reject":
-            log.error("Expected Reject, got %s", reply.get("type"))
-            return False
-        return True
+    def _target(self) -> str:
+        return self.ctx.rejected_follow_actor_id
 
 
 class GetFollowersAfterAcceptTest(ServerRequiredTest):
+    depends_on = (ReceiveAcceptFollowTest,)
+
     def skip(self) -> bool:
         if super().skip():
             return True
         if not self.ctx.followers_id:
-            log.info("Skipping; followers_id not configured")
-            return True
+            return self._skip("followers_id not configured")
         if not self.ctx.actor_id:
-            log.info("Skipping; actor_id not configured")
-            return True
+            return self._skip("actor_id not configured")
         return False
 
     def run(self) -> bool:
-        found = find_in_collection(self.ctx.followers_id, self.ctx.actor_id)
-        if not found:
+        found = self._in_collection(self.ctx.followers_id, self.ctx.actor_id)
+        if found is False:
             log.error(
                 "Expected actor %s in followers collection after accept",
                 self.ctx.actor_id,
             )
-        return found
+        return bool(found)
 
 
 class SendWithFollowersTest(ServerRequiredTest):
@@ -841,45 +785,53 @@ class SendWithFollowersTest(ServerRequiredTest):
         if super().skip():
             return True
         if not self.ctx.followers_id:
-            log.info("Skipping; followers_id not configured")
-            return True
+            return self._skip("followers_id not configured")
         return False
 
+    def _send_to_followers(self, outbox: str, marker: str) -> float | None:
+        """POST a Create addressed to followers; returns when it was sent."""
+        activity = make_create(self.ctx.local_actor_id, make_note(self.ctx.local_actor_id, marker))
+        activity["to"] = [AS_PUBLIC, self.ctx.followers_id]
+        sent = time.monotonic()
+        return sent if self._post_activity(outbox, activity) is not None else None
+
     def run(self) -> bool:
         actor = self._get_actor()
         if actor is None:
             return False
-        activity = _make_create(self.ctx.local_actor_id, _make_note(self.ctx.local_actor_id))
-        activity["to"] = [AS_PUBLIC, self.ctx.followers_id]
-        if self._post_activity(actor["outbox"], activity) is None:
+        marker = new_marker()
+        sent = self._send_to_followers(actor["outbox"], marker)
+        if sent is None:
             return False
         log.info("Waiting for activity delivery to local server (timeout=30s)")
-        received = self.ctx.local_server.wait_for_activity(timeout=30.0)
-        if received is None:
+        arrived = self.ctx.local_server.wait_for_marker(marker, timeout=30.0)
+        if arrived is None:
             log.error("Timed out waiting for activity delivery")
             return False
+        self.metrics["delivery_latency"] = arrived - sent
         return True
 
 
 class InboxForwardingTest(ServerRequiredTest):
+    consumes = ("object_id",)
+
     def skip(self) -> bool:
         if super().skip():
             return True
         if not self.ctx.actor_id:
-            log.info("Skipping; actor_id not configured")
-            return True
+            return self._skip("actor_id not configured")
         if not self.ctx.followers_id:
-            log.info("Skipping; followers_id not configured")
-            return True
+            return self._skip("followers_id not configured")
         return False
 
     def run(self) -> bool:
         try:
-            remote_actor = transport.get(self.ctx.actor_id)
+            remote_actor = self._get(self.ctx.actor_id)
             inbox_url = remote_actor.get("inbox")
         except (requests.HTTPError, KeyError) as exc:
             log.error("Failed to resolve remote actor inbox: %s", exc)
             return False
+        marker = new_marker()
         activity = {
             "@context": AS_CONTEXT,
             "type": "Create",
@@ -887,19 +839,22 @@ class InboxForwardingTest(ServerRequiredTest):
             "object": {
                 "type": "Note",
                 "attributedTo": self.ctx.local_actor_id,
-                "content": "ap-testsuite inbox forwarding test",
+                "content": f"ap-testsuite inbox forwarding test {marker}",
                 "to": [self.ctx.followers_id],
                 "inReplyTo": self.ctx.object_id,
             },
             "to": [self.ctx.followers_id],
         }
+        sent = time.monotonic()
         try:
-            transport.post(inbox_url, activity, auth=self.ctx.auth)
+            self._post(inbox_url, activity, auth=self.ctx.auth)
         except requests.HTTPError as exc:
             log.error("POST to remote inbox failed: %s", exc)
             return False
         log.info("Waiting for forwarded activity (timeout=30s)")
-        forwarded = self.ctx.local_server.wait_for_activity(timeout=30.0)
+        forwarded = self.ctx.local_server.wait_for(
+            {"inReplyTo": self.ctx.object_id, "marker": marker}, timeout=30.0, since=sent
+        )
         if forwarded is None:
             log.error("Timed out waiting for inbox forwarding")
             return False
@@ -907,28 +862,27 @@ class InboxForwardingTest(ServerRequiredTest):
 
 
 class AppliedInboxForwardingTest(ServerRequiredTest):
+    depends_on = (InboxForwardingTest,)
+
     def skip(self) -> bool:
         if super().skip():
             return True
         if not self.ctx.actor_id:
-            log.info("Skipping; actor_id not configured")
-            return True
+            return self._skip("actor_id not configured")
         if not self.ctx.inbox_id:
-            log.info("Skipping; inbox_id not configured")
-            return True
+            return self._skip("inbox_id not configured")
         return False
 
     def run(self) -> bool:
+        inbox = self._crawl(self.ctx.inbox_id, auth=self.ctx.auth, max_pages=RECENT_PAGES)
         try:
-            inbox = transport.get(self.ctx.inbox_id, auth=self.ctx.auth)
+            for item in inbox.items():
+                obj = item.get("object") if isinstance(item, dict) else None
+                if isinstance(obj, dict) and "inReplyTo" in obj:
+                    return True
         except requests.HTTPError as exc:
             log.error("Failed to fetch local inbox: %s", exc)
             return False
-        items = inbox.get("orderedItems") or inbox.get("items") or []
-        for item in items:
-            obj = item.get("object") if isinstance(item, dict) else None
-            if isinstance(obj, dict) and "inReplyTo" in obj:
-                return True
         log.info("No forwarded reply found in inbox yet (may need InboxForwardingTest first)")
         return False
 
@@ -2,6 +2,7 @@
 # SPDX-License-Identifier: MIT
 
 import logging
+import os
 import tomllib as toml
 from typing import Any
 from urllib.parse import urljoin, urlparse, urlencode
@@ -9,6 +10,8 @@ from urllib.parse import urljoin, urlparse, urlencode
 import requests
 
 from . import transport
+from .collection import CollectionIndex, CrawlLimits
+from .store import ObjectStore
 
 log = logging.getLogger(__name__)
 
@@ -34,7 +37,9 @@ class TestContext:
     ]
 
     def __init__(self) -> None:
-        self.db = {}
+        self.db = ObjectStore()
+        self.crawl_limits = CrawlLimits()
+        self.collections = CollectionIndex(self.crawl_limits)
         self.server = None
         # Entity IDs
         self.actor_id = None
@@ -55,11 +60,23 @@ class TestContext:
         # Auth + local server (populated by load_config, not CLI)
         self.auth = None
         self.local_server = None
+        # [test_config.load], [test_config.perf] and [test_config.history] settings
+        self.load_settings: dict = {}
+        self.perf_settings: dict = {}
+        self.history_settings: dict = {}
 
     @property
     def has_local_server(self) -> bool:
         return self.local_server is not None
 
+    @property
+    def server_key(self) -> str | None:
+        """Host of the server under test, for keying results across runs."""
+        if self.server:
+            return urlparse(self.server).netloc
+        actor_id = self.actor_id or self.local_actor_id
+        return urlparse(actor_id).netloc if actor_id else None
+
     def validate(self, arg: str, argv: Any):
         if argv is None:
             return
@@ -122,15 +139,33 @@ class TestContext:
             auth_cfg = auth_cfg | {"actor_id": self.local_actor_id}
         self.auth = load_auth(auth_cfg)
 
+    def _load_store_config(self, test_config: dict):
+        if "store" not in test_config:
+            return
+        self.db = ObjectStore(**test_config["store"])
+
+    def _load_crawl_config(self, test_config: dict):
+        if "crawl" not in test_config:
+            return
+        self.crawl_limits = CrawlLimits(**test_config["crawl"])
+        self.collections = CollectionIndex(self.crawl_limits)
+
     def _load_server_config(self, test_config: dict):
         if "local_server" not in test_config:
             return
-        from .server import InboxServer  # pylint: disable=import-outside-toplevel
-        srv = test_config["local_server"]
+        # pylint: disable-next=import-outside-toplevel
+        from .server import InboxServer, ServerLimits
+        from .peer import Peer  # pylint: disable=import-outside-toplevel
+        srv = dict(test_config["local_server"])
+        peer = Peer(**test_config["peer"]) if "peer" in test_config else None
         self.local_server = InboxServer(
-            port=srv.get("port", 0),
-            public_url=srv.get("public_url"),
+            port=srv.pop("port", 0),
+            public_url=srv.pop("public_url", None),
             auth=self.auth,
+            verify_signatures=srv.pop("verify_signatures", True),
+            key_ttl=srv.pop("key_ttl", 3600.0),
+            peer=peer,
+            limits=ServerLimits(**srv),
         )
 
     def load_config(self, config_file):
@@ -139,6 +174,7 @@ class TestContext:
 
         any_arg = False
         test_config = cfg.get("test_config", {})
+        transport.configure(test_config.get("transport", {}))
         if "user" in test_config:
             user = test_config["user"]
             if user.count("@") != 1:
@@ -161,6 +197,15 @@ class TestContext:
                 self.setarg(arg, argv)
 
         self._load_auth_config(test_config)
+        self._load_store_config(test_config)
+        self._load_crawl_config(test_config)
         self._load_server_config(test_config)
+        self.load_settings = test_config.get("load", {})
+        self.perf_settings = test_config.get("perf", {})
+        self.history_settings = dict(test_config.get("history", {}))
+        if "path" in self.history_settings:
+            self.history_settings["path"] = os.path.join(
+                os.path.dirname(config_file), self.history_settings["path"]
+            )
 
         return any_arg
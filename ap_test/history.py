@@ -0,0 +1,141 @@
+# Copyright (c) 2023 Pat Long
+# SPDX-License-Identifier: MIT
+
+import logging
+import sqlite3
+import statistics
+
+from .report import RunReport, TestResult
+
+log = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    server TEXT NOT NULL,
+    started REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS samples (
+    run_id INTEGER NOT NULL REFERENCES runs(id),
+    test TEXT NOT NULL,
+    metric TEXT NOT NULL,
+    value REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS samples_by_metric ON samples (test, metric, run_id);
+"""
+
+
+def samples(result: TestResult) -> dict[str, float]:
+    """Timings of a passed test worth comparing across runs, in seconds.
+
+    These are its duration, its collection crawl time, duration metrics and
+    the p50/p90 of latency summaries.
+    """
+    values = {"duration": result.duration}
+    if result.crawl_time:
+        values["crawl_time"] = result.crawl_time
+    for name, value in result.metrics.items():
+        if isinstance(value, float):
+            values[name] = value
+        elif isinstance(value, dict) and value.get("count"):
+            values[f"{name}.p50"] = value["p50"]
+            values[f"{name}.p90"] = value["p90"]
+    return values
+
+
+class Regression:  # pylint: disable=too-few-public-methods
+    """A timing that is significantly worse than its baseline."""
+
+    def __init__(self, test: str, metric: str, value: float, baseline: list[float]) -> None:
+        self.test = test
+        self.metric = metric
+        self.value = value
+        self.baseline = statistics.median(baseline)
+        self.runs = len(baseline)
+
+    @property
+    def ratio(self) -> float:
+        return self.value / self.baseline if self.baseline else float("inf")
+
+    def __str__(self) -> str:
+        return (
+            f"{self.test} {self.metric} got {self.ratio:.1f}x slower: {self.value:.3f}s "
+            f"against a median of {self.baseline:.3f}s over the last {self.runs} runs"
+        )
+
+
+class History:
+    """Timings of past runs, kept in SQLite and keyed by server and test.
+
+    A timing is a regression when it lies more than ``z`` standard
+    deviations above the mean of the last ``window`` runs against the same
+    server and is at least ``min_ratio`` times their median. Nothing is
+    flagged until there are ``min_runs`` earlier values to compare with.
+    """
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        path: str,
+        window: int = 10,
+        min_runs: int = 5,
+        z: float = 3.0,
+        min_ratio: float = 1.2,
+    ) -> None:
+        self.path = path
+        self.window = window
+        self.min_runs = min_runs
+        self.z = z
+        self.min_ratio = min_ratio
+        self._db = sqlite3.connect(path)
+        self._db.executescript(_SCHEMA)
+
+    def baseline(self, server: str, test: str, metric: str) -> list[float]:
+        """The metric's values in the latest ``window`` runs, newest first."""
+        rows = self._db.execute(
+            "SELECT value FROM samples JOIN runs ON runs.id = samples.run_id"
+            " WHERE runs.server = ? AND samples.test = ? AND samples.metric = ?"
+            " ORDER BY runs.id DESC LIMIT ?",
+            (server, test, metric, self.window),
+        )
+        return [value for (value,) in rows]
+
+    def _is_regression(self, value: float, baseline: list[float]) -> bool:
+        if len(baseline) < self.min_runs:
+            return False
+        median = statistics.median(baseline)
+        if median <= 0 or value < median * self.min_ratio:
+            return False
+        if len(baseline) < 2:
+            return True
+        return value > statistics.fmean(baseline) + self.z * statistics.stdev(baseline)
+
+    def regressions(self, server: str, report: RunReport) -> list[Regression]:
+        """Timings in ``report`` that are significantly worse than the baseline."""
+        found = []
+        for result in report.results:
+            if result.status != "passed":
+                continue
+            for metric, value in samples(result).items():
+                baseline = self.baseline(server, result.name, metric)
+                if self._is_regression(value, baseline):
+                    found.append(Regression(result.name, metric, value, baseline))
+        return found
+
+    def record(self, server: str, report: RunReport) -> None:
+        """Add the timings of the passed tests in ``report`` as a new run."""
+        with self._db:
+            run_id = self._db.execute(
+                "INSERT INTO runs (server, started) VALUES (?, ?)", (server, report.started)
+            ).lastrowid
+            self._db.executemany(
+                "INSERT INTO samples (run_id, test, metric, value) VALUES (?, ?, ?, ?)",
+                [
+                    (run_id, result.name, metric, value)
+                    for result in report.results
+                    if result.status == "passed"
+                    for metric, value in samples(result).items()
+                ],
+            )
+
+    def close(self) -> None:
+        self._db.close()
@@ -0,0 +1,165 @@
+# Copyright (c) 2023 Pat Long
+# SPDX-License-Identifier: MIT
+
+import logging
+import threading
+from typing import Callable
+
+from .activity import MARKER_RE
+
+log = logging.getLogger(__name__)
+
+# Fields a match spec may use; see _fields()
+INDEXED_FIELDS = ("id", "type", "actor", "object", "inReplyTo", "marker", "inbox")
+
+
+def _ref(value) -> str | None:
+    return value.get("id") if isinstance(value, dict) else value
+
+
+def _fields(activity: dict, body: str, inbox: str) -> dict[str, list]:
+    """Indexed values of a delivery: ``object`` is the object's id, ``inReplyTo``
+    is taken from the activity or its object, ``marker`` from the raw body and
+    ``inbox`` is the path it was delivered to."""
+    obj = activity.get("object")
+    in_reply_to = activity.get("inReplyTo")
+    if in_reply_to is None and isinstance(obj, dict):
+        in_reply_to = obj.get("inReplyTo")
+    fields = {
+        "id": [activity.get("id")],
+        "type": [activity.get("type")],
+        "actor": [_ref(activity.get("actor"))],
+        "object": [_ref(obj)],
+        "inReplyTo": [_ref(in_reply_to)],
+        "marker": list(dict.fromkeys(MARKER_RE.findall(body))),
+        "inbox": [inbox or None],
+    }
+    return {name: [v for v in values if isinstance(v, str)] for name, values in fields.items()}
+
+
+class Delivery:  # pylint: disable=too-few-public-methods
+    """An activity received by the local server."""
+
+    def __init__(self, seq: int, activity: dict, received: float, fields: dict) -> None:
+        self.seq = seq
+        self.activity = activity
+        # time.monotonic() when the request arrived
+        self.received = received
+        self.fields = fields
+        # Path of the inbox it was delivered to
+        self.inbox = ""
+
+
+def _spec_matches(spec: dict, delivery: Delivery) -> bool:
+    for name, wanted in spec.items():
+        options = wanted if isinstance(wanted, (tuple, list, set)) else (wanted,)
+        if not any(value in options for value in delivery.fields[name]):
+            return False
+    return True
+
+
+class _Waiter:  # pylint: disable=too-few-public-methods
+    def __init__(self, match: Callable[[Delivery], bool], lock: threading.Lock) -> None:
+        self.match = match
+        self.ready = threading.Condition(lock)
+        self.result: Delivery | None = None
+
+
+class ActivityIndex:
+    """Deliveries received by the local server, indexed for lookup.
+
+    Deliveries are indexed by id, type, actor, object id, inReplyTo,
+    correlation marker and inbox path. Waiting never consumes a delivery, so
+    any number of tests can wait at once; each waiter has its own condition
+    and is only woken by a delivery that matches it.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._deliveries: list[Delivery] = []
+        self._index: dict[str, dict[str, list[Delivery]]] = {
+            name: {} for name in INDEXED_FIELDS
+        }
+        self._waiters: list[_Waiter] = []
+
+    def add(self, activity: dict, received: float, body: str = "", inbox: str = "") -> Delivery:
+        with self._lock:
+            delivery = Delivery(
+                len(self._deliveries), activity, received, _fields(activity, body, inbox)
+            )
+            delivery.inbox = inbox
+            self._deliveries.append(delivery)
+            for name, values in delivery.fields.items():
+                for value in values:
+                    self._index[name].setdefault(value, []).append(delivery)
+            for waiter in self._waiters:
+                if waiter.result is None and waiter.match(delivery):
+                    waiter.result = delivery
+                    waiter.ready.notify()
+        return delivery
+
+    def _candidates(self, spec: dict) -> list[Delivery]:
+        """Deliveries that may match ``spec``, from its most selective field."""
+        best = None
+        for name, wanted in spec.items():
+            options = wanted if isinstance(wanted, (tuple, list, set)) else (wanted,)
+            found = [d for option in options for d in self._index[name].get(option, ())]
+            if best is None or len(found) < len(best):
+                best = found
+        return sorted(best, key=lambda d: d.seq) if best is not None else self._deliveries
+
+    @staticmethod
+    def _matcher(match: dict | Callable[[dict], bool], since: float):
+        if isinstance(match, dict):
+            unknown = set(match) - set(INDEXED_FIELDS)
+            if unknown:
+                raise ValueError(f"Cannot match on {', '.join(sorted(unknown))}")
+            return lambda d: d.received >= since and _spec_matches(match, d)
+        return lambda d: d.received >= since and match(d.activity)
+
+    def _wait(self, matcher: Callable[[Delivery], bool], timeout: float) -> Delivery | None:
+        """Wait for the next delivery accepted by ``matcher``; call with the lock held."""
+        waiter = _Waiter(matcher, self._lock)
+        self._waiters.append(waiter)
+        try:
+            waiter.ready.wait_for(lambda: waiter.result is not None, timeout)
+        finally:
+            self._waiters.remove(waiter)
+        return waiter.result
+
+    def wait_for(
+        self,
+        match: dict | Callable[[dict], bool],
+        timeout: float = 30.0,
+        since: float = 0.0,
+    ) -> Delivery | None:
+        """Return the first delivery that matches, waiting up to ``timeout`` seconds.
+
+        ``match`` is a spec mapping indexed field names to a value (or a
+        tuple of accepted values), or a predicate on the activity. Only
+        deliveries received at or after ``since`` (time.monotonic()) count.
+        """
+        matcher = self._matcher(match, since)
+        with self._lock:
+            candidates = self._candidates(match) if isinstance(match, dict) else self._deliveries
+            found = next((d for d in candidates if matcher(d)), None)
+            if found is not None or timeout <= 0:
+                return found
+            return self._wait(matcher, timeout)
+
+    def all_matching(self, match: dict, since: float = 0.0) -> list[Delivery]:
+        """Every delivery received at or after ``since`` that matches a spec."""
+        matcher = self._matcher(match, since)
+        with self._lock:
+            return [d for d in self._candidates(match) if matcher(d)]
+
+    def next_after(self, seq: int, timeout: float = 30.0) -> Delivery | None:
+        """The delivery following sequence number ``seq`` (-1 for the first)."""
+        with self._lock:
+            if seq + 1 < len(self._deliveries):
+                return self._deliveries[seq + 1]
+            return self._wait(lambda d: d.seq > seq, timeout)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._deliveries)
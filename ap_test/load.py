@@ -0,0 +1,220 @@
+# Copyright (c) 2023 Pat Long
+# SPDX-License-Identifier: MIT
+
+import json
+import logging
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Callable
+
+import requests
+
+from . import transport
+from .federation import _ActivityTypeTest
+from .helper import TestContext
+from .metrics import format_summary, summarize
+
+log = logging.getLogger(__name__)
+
+DEFAULTS = {
+    "duration": 30.0,
+    "rate": None,
+    "concurrency": 1,
+    "max_inflight": 64,
+    "activities": ["create"],
+    "output": None,
+}
+
+
+def activity_builders(ctx: TestContext) -> dict[str, Callable[[str], dict]]:
+    """Activity builders of the Group B type tests that can run with ``ctx``.
+
+    Keyed on the activity type, e.g. "create" for DeliversCreateTest.
+    """
+    builders = {}
+    for cls in _ActivityTypeTest.__subclasses__():
+        test = cls(ctx)
+        if test.skip():
+            continue
+        name = cls.__name__.removeprefix("Delivers").removesuffix("Test").lower()
+        builders[name] = test._make_activity  # pylint: disable=protected-access
+    return builders
+
+
+class LoadResult:
+    """Samples of one load run: (seconds since start, latency, error or None)."""
+
+    def __init__(self) -> None:
+        self.samples: list[tuple[float, float, str | None]] = []
+        self.elapsed = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, offset: float, latency: float, error: str | None = None) -> None:
+        with self._lock:
+            self.samples.append((offset, latency, error))
+
+    @property
+    def errors(self) -> Counter:
+        return Counter(error for _, _, error in self.samples if error is not None)
+
+    @property
+    def rps(self) -> float:
+        return len(self.samples) / self.elapsed if self.elapsed else 0.0
+
+    def latency(self) -> dict[str, float]:
+        return summarize([latency for _, latency, error in self.samples if error is None])
+
+    def series(self) -> list[dict]:
+        """Per-second buckets, keyed on when each request was due to be sent."""
+        buckets: dict[int, list] = {}
+        for offset, latency, error in self.samples:
+            buckets.setdefault(int(offset), []).append((latency, error))
+        series = []
+        for second in sorted(buckets):
+            bucket = buckets[second]
+            ok = [latency for latency, error in bucket if error is None]
+            series.append(
+                {
+                    "second": second,
+                    "sent": len(bucket),
+                    "errors": len(bucket) - len(ok),
+                    "latency": summarize(ok),
+                }
+            )
+        return series
+
+    def write_series(self, path: str) -> None:
+        with open(path, "w", encoding="utf-8") as f:
+            for point in self.series():
+                f.write(json.dumps(point) + "\n")
+
+
+class LoadGenerator:
+    """POSTs activities to an outbox for a fixed duration.
+
+    With ``rate`` set, requests are sent open-loop on a fixed schedule and
+    latency is measured from when each request was due, so a server that
+    falls behind is charged for the queueing it causes. Otherwise
+    ``concurrency`` workers each send their next request as soon as the
+    previous one completes. Requests are never retried or rate limited, so
+    throttling shows up as errors, and each run sends on its own session
+    pool with a session per worker, so latency never includes waiting for
+    a connection.
+    """
+
+    def __init__(self, ctx: TestContext, outbox: str, builders: list[Callable[[str], dict]]):
+        self.ctx = ctx
+        self.outbox = outbox
+        self.builders = builders
+        self._sent = 0
+        self._lock = threading.Lock()
+        self._pool: transport.SessionPool | None = None
+
+    def _next_activity(self) -> dict:
+        with self._lock:
+            builder = self.builders[self._sent % len(self.builders)]
+            self._sent += 1
+        return builder(self.ctx.local_actor_id)
+
+    def _send(self, result: LoadResult, start: float, due: float) -> None:
+        activity = self._next_activity()
+        error = None
+        try:
+            transport.post(self.outbox, activity, auth=self.ctx.auth, pool=self._pool)
+        except requests.HTTPError as exc:
+            error = str(exc.response.status_code)
+        except requests.RequestException as exc:
+            error = type(exc).__name__
+        result.record(due - start, time.monotonic() - due, error)
+
+    @contextmanager
+    def _sessions(self, workers: int):
+        self._pool = transport.session_pool(workers)
+        try:
+            yield
+        finally:
+            self._pool.close()
+            self._pool = None
+
+    def run_open(self, rate: float, duration: float, max_inflight: int) -> LoadResult:
+        result = LoadResult()
+        start = time.monotonic()
+        with self._sessions(max_inflight), ThreadPoolExecutor(
+            max_inflight, thread_name_prefix="load"
+        ) as pool:
+            for n in range(int(rate * duration)):
+                due = start + n / rate
+                time.sleep(max(due - time.monotonic(), 0))
+                pool.submit(self._send, result, start, due)
+        result.elapsed = time.monotonic() - start
+        return result
+
+    def run_closed(self, concurrency: int, duration: float) -> LoadResult:
+        result = LoadResult()
+        start = time.monotonic()
+        deadline = start + duration
+
+        def worker():
+            while time.monotonic() < deadline:
+                self._send(result, start, time.monotonic())
+
+        with self._sessions(concurrency), ThreadPoolExecutor(
+            concurrency, thread_name_prefix="load"
+        ) as pool:
+            for _ in range(concurrency):
+                pool.submit(worker)
+        result.elapsed = time.monotonic() - start
+        return result
+
+
+def _print_result(result: LoadResult) -> None:
+    print()
+    print("=== LOAD ===")
+    print(f"{len(result.samples)} requests in {result.elapsed:.1f}s ({result.rps:.1f} req/s)")
+    print(f"Latency: {format_summary(result.latency())}")
+    errors = result.errors
+    if errors:
+        print(f"Errors: {sum(errors.values())}")
+        for error, count in errors.most_common():
+            print(f"  {error}: {count}")
+
+
+def run_load(ctx: TestContext, settings: dict) -> bool:
+    """Run load mode with ``settings`` over DEFAULTS; False if nothing succeeded."""
+    settings = DEFAULTS | settings
+    builders = activity_builders(ctx)
+    unknown = [name for name in settings["activities"] if name not in builders]
+    if unknown or not builders:
+        print(f"Unavailable activity types: {', '.join(unknown or settings['activities'])}")
+        print(f"Available: {', '.join(builders) or 'none (check auth and local_actor_id)'}")
+        return False
+
+    try:
+        actor = ctx.db.get(ctx.local_actor_id, auth=ctx.auth)
+        outbox = actor["outbox"]
+    except (requests.HTTPError, KeyError) as exc:
+        print(f"Failed to find outbox of {ctx.local_actor_id}: {exc}")
+        return False
+
+    generator = LoadGenerator(ctx, outbox, [builders[name] for name in settings["activities"]])
+    if settings["rate"]:
+        log.info("Sending %s req/s to %s for %ss", settings["rate"], outbox, settings["duration"])
+        result = generator.run_open(
+            settings["rate"], settings["duration"], settings["max_inflight"]
+        )
+    else:
+        log.info(
+            "Sending from %d workers to %s for %ss",
+            settings["concurrency"],
+            outbox,
+            settings["duration"],
+        )
+        result = generator.run_closed(settings["concurrency"], settings["duration"])
+
+    _print_result(result)
+    if settings["output"]:
+        result.write_series(settings["output"])
+    return len(result.samples) > sum(result.errors.values())
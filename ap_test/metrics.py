@@ -0,0 +1,39 @@
+# Copyright (c) 2023 Pat Long
+# SPDX-License-Identifier: MIT
+
+import math
+
+
+def percentile(sorted_values: list[float], pct: float) -> float:
+    """Nearest-rank percentile of an already sorted, non-empty list."""
+    rank = max(math.ceil(pct / 100.0 * len(sorted_values)), 1)
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def summarize(values: list[float]) -> dict[str, float]:
+    """Count, mean and the usual latency percentiles of ``values``."""
+    if not values:
+        return {"count": 0}
+    ordered = sorted(values)
+    return {
+        "count": len(ordered),
+        "mean": sum(ordered) / len(ordered),
+        "min": ordered[0],
+        "p50": percentile(ordered, 50),
+        "p90": percentile(ordered, 90),
+        "p99": percentile(ordered, 99),
+        "max": ordered[-1],
+    }
+
+
+_SCALE = {"s": 1.0, "ms": 1e3, "us": 1e6}
+
+
+def format_summary(summary: dict[str, float], unit: str = "s") -> str:
+    """Percentiles of a summary of durations in seconds, shown in ``unit``."""
+    if not summary.get("count"):
+        return "no samples"
+    scale = _SCALE[unit]
+    return ", ".join(
+        f"{key} {summary[key] * scale:.3f}{unit}" for key in ("p50", "p90", "p99", "max")
+    ) + f" (n={summary['count']})"
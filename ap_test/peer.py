@@ -0,0 +1,237 @@
+# Copyright (c) 2023 Pat Long
+# SPDX-License-Identifier: MIT
+
+import logging
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, urlparse
+
+import requests
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+from . import transport
+from .activity import AS_CONTEXT
+from .auth import HttpSignatureAuth
+
+log = logging.getLogger(__name__)
+
+SECURITY_CONTEXT = "https://w3id.org/security/v1"
+
+# Path of the shared inbox the peer's actors advertise; distinct from the
+# local server's own /inbox
+SHARED_INBOX_PATH = "/peer/inbox"
+
+# What a synthetic actor does with a Follow addressed to it
+BEHAVIOURS = ("accept", "reject", "ignore")
+
+
+def _ref(value) -> str | None:
+    return value.get("id") if isinstance(value, dict) else value
+
+
+class SyntheticActor:  # pylint: disable=too-few-public-methods
+    """An actor hosted by the local server, kept in memory."""
+
+    def __init__(self, name: str, on_follow: str = "accept", stall: float = 0.0) -> None:
+        if on_follow not in BEHAVIOURS:
+            raise ValueError(f"Unknown behaviour {on_follow!r} for {name}")
+        self.name = name
+        self.on_follow = on_follow
+        # Seconds the actor's inbox takes to answer a delivery
+        self.stall = stall
+        self.followers: list[str] = []
+        self.outbox: list[dict] = []
+        self.lock = threading.Lock()
+
+
+class Peer:
+    """Synthetic fediverse instance served by the local server.
+
+    Hosts ``count`` generic actors (``peer0``, ``peer1``, ...) that accept
+    follows, plus ``accepter``, ``rejecter``, ``prober`` (which only sends),
+    ``slowpoke`` (whose inbox takes ``slow_inbox_stall`` seconds to answer)
+    and any actor named in ``behaviours``. Every actor has an actor document,
+    WebFinger, inbox, outbox and followers collection; they share one RSA
+    key. Replies to follows are sent in the background, signed as the
+    replying actor.
+    """
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        count: int = 0,
+        behaviours: dict[str, str] | None = None,
+        shared_inbox: bool = True,
+        key_size: int = 2048,
+        slow_inbox_stall: float = 30.0,
+    ) -> None:
+        self.base_url = ""
+        self.shared_inbox = shared_inbox
+        # The generic actors, in creation order
+        self.members = [f"peer{i}" for i in range(count)]
+        names = {"accepter": "accept", "rejecter": "reject", "prober": "ignore"}
+        names |= {"slowpoke": "ignore"}
+        names |= dict.fromkeys(self.members, "accept")
+        names |= behaviours or {}
+        self.actors = {name: SyntheticActor(name, on_follow) for name, on_follow in names.items()}
+        self.actors["slowpoke"].stall = slow_inbox_stall
+        self._key = rsa.generate_private_key(public_exponent=65537, key_size=key_size)
+        self._public_pem = self._key.public_key().public_bytes(
+            serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo
+        ).decode()
+        self._auth: dict[str, HttpSignatureAuth] = {}
+        self._auth_lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="peer")
+
+    def actor_id(self, name: str) -> str:
+        return f"{self.base_url}/users/{name}"
+
+    def auth(self, name: str) -> HttpSignatureAuth:
+        """Credentials that sign requests as actor ``name``."""
+        with self._auth_lock:
+            if name not in self._auth:
+                self._auth[name] = HttpSignatureAuth(self.actor_id(name), self._key)
+            return self._auth[name]
+
+    def _name_of(self, actor_id: str | None) -> str | None:
+        prefix = f"{self.base_url}/users/"
+        if actor_id and actor_id.startswith(prefix) and actor_id[len(prefix):] in self.actors:
+            return actor_id[len(prefix):]
+        return None
+
+    # -- documents ----------------------------------------------------------
+
+    def _actor_document(self, name: str) -> dict:
+        actor_id = self.actor_id(name)
+        doc = {
+            "@context": [AS_CONTEXT, SECURITY_CONTEXT],
+            "id": actor_id,
+            "type": "Person",
+            "preferredUsername": name,
+            "inbox": f"{actor_id}/inbox",
+            "outbox": f"{actor_id}/outbox",
+            "followers": f"{actor_id}/followers",
+            "following": f"{actor_id}/following",
+            "publicKey": {
+                "id": f"{actor_id}#main-key",
+                "owner": actor_id,
+                "publicKeyPem": self._public_pem,
+            },
+        }
+        # A stalling inbox can't hide behind the shared one
+        if self.shared_inbox and not self.actors[name].stall:
+            doc["endpoints"] = {"sharedInbox": f"{self.base_url}{SHARED_INBOX_PATH}"}
+        return doc
+
+    def _collection(self, iri: str, items: list) -> dict:
+        return {
+            "@context": AS_CONTEXT,
+            "id": iri,
+            "type": "OrderedCollection",
+            "totalItems": len(items),
+            "orderedItems": items,
+        }
+
+    def _webfinger(self, query: str) -> dict | None:
+        resource = parse_qs(query).get("resource", [""])[0]
+        name = resource.removeprefix("acct:").split("@", 1)[0]
+        if name not in self.actors:
+            return None
+        return {
+            "subject": resource,
+            "links": [
+                {
+                    "rel": "self",
+                    "type": "application/activity+json",
+                    "href": self.actor_id(name),
+                }
+            ],
+        }
+
+    def document(self, path: str) -> dict | None:
+        """The document served at ``path``, or None if there is none."""
+        parsed = urlparse(path)
+        if parsed.path == "/.well-known/webfinger":
+            return self._webfinger(parsed.query)
+        parts = parsed.path.strip("/").split("/")
+        if len(parts) < 2 or parts[0] != "users" or parts[1] not in self.actors:
+            return None
+        name, actor = parts[1], self.actors[parts[1]]
+        iri = f"{self.base_url}{parsed.path}"
+        collections = {"followers": actor.followers, "outbox": actor.outbox, "following": []}
+        with actor.lock:
+            if len(parts) == 2:
+                return self._actor_document(name)
+            if len(parts) == 3 and parts[2] in collections:
+                return self._collection(iri, list(collections[parts[2]]))
+        return None
+
+    # -- behaviour ----------------------------------------------------------
+
+    def _recipients(self, path: str, activity: dict) -> list[str]:
+        parts = urlparse(path).path.strip("/").split("/")
+        if len(parts) == 3 and parts[0] == "users" and parts[2] == "inbox":
+            return [parts[1]] if parts[1] in self.actors else []
+        if urlparse(path).path != SHARED_INBOX_PATH:
+            return []
+        # Shared inbox: whoever the activity is about or addressed to
+        targets = [_ref(activity.get("object"))]
+        for field in ("to", "cc"):
+            value = activity.get(field) or []
+            targets += value if isinstance(value, list) else [value]
+        return list(dict.fromkeys(n for n in map(self._name_of, targets) if n))
+
+    def is_inbox(self, path: str) -> bool:
+        """Whether ``path`` is a synthetic actor's inbox or the shared inbox."""
+        parsed = urlparse(path).path
+        parts = parsed.strip("/").split("/")
+        if len(parts) == 3 and parts[0] == "users" and parts[2] == "inbox":
+            return parts[1] in self.actors
+        return parsed == SHARED_INBOX_PATH
+
+    def stall(self, path: str) -> float:
+        """Seconds the inbox at ``path`` takes to answer a delivery."""
+        parts = urlparse(path).path.strip("/").split("/")
+        if len(parts) == 3 and parts[0] == "users" and parts[2] == "inbox":
+            actor = self.actors.get(parts[1])
+            return actor.stall if actor is not None else 0.0
+        return 0.0
+
+    def deliver(self, path: str, activity: dict) -> None:
+        """Apply a delivery to the actors it is for; replies are sent later."""
+        kind = activity.get("type")
+        for name in self._recipients(path, activity):
+            actor = self.actors[name]
+            if kind == "Follow" and _ref(activity.get("object")) == self.actor_id(name):
+                if actor.on_follow != "ignore":
+                    self._pool.submit(self._reply, name, activity, actor.on_follow == "accept")
+            elif kind == "Undo" and isinstance(activity.get("object"), dict):
+                follower = _ref(activity["object"].get("actor"))
+                with actor.lock:
+                    if follower in actor.followers:
+                        actor.followers.remove(follower)
+
+    def _reply(self, name: str, follow: dict, accept: bool) -> None:
+        actor = self.actors[name]
+        follower = _ref(follow.get("actor"))
+        reply = {
+            "@context": AS_CONTEXT,
+            "id": f"{self.actor_id(name)}/activities/{uuid.uuid4().hex}",
+            "type": "Accept" if accept else "Reject",
+            "actor": self.actor_id(name),
+            "object": follow,
+            "to": [follower],
+        }
+        with actor.lock:
+            actor.outbox.append(reply)
+            if accept and follower not in actor.followers:
+                actor.followers.append(follower)
+        try:
+            inbox = transport.get(follower, auth=self.auth(name))["inbox"]
+            transport.post(inbox, reply, auth=self.auth(name))
+        except (requests.RequestException, KeyError) as exc:
+            log.warning("%s could not send %s to %s: %s", name, reply["type"], follower, exc)
+
+    def close(self) -> None:
+        self._pool.shutdown(wait=False, cancel_futures=True)
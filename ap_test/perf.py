@@ -0,0 +1,658 @@
+# Copyright (c) 2023 Pat Long
+# SPDX-License-Identifier: MIT
+
+import logging
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from . import trace, transport
+from .activity import (
+    AS_CONTEXT,
+    AS_PUBLIC,
+    make_create,
+    make_follow,
+    make_large_object,
+    make_note,
+    new_marker,
+)
+from .collection import PollBackoff
+from .federation import RECENT_PAGES, SendWithFollowersTest
+from .helper import TestContext
+from .metrics import summarize
+from .peer import SHARED_INBOX_PATH
+from .server import FailureProfile
+from .tests import FederationTest, ServerRequiredTest
+
+log = logging.getLogger(__name__)
+
+DEFAULTS = {
+    "samples": 20,
+    "concurrency": 4,
+    "timeout": 30.0,
+    # Synthetic followers used by the fan-out test
+    "fanout_followers": 20,
+    # Seconds to keep counting deliveries after the first one arrives
+    "settle": 5.0,
+    # Signed activities sent by the key fetch test
+    "key_fetch_activities": 20,
+    # Failure profile (see server.FailureProfile) applied by BackpressureTest
+    "backpressure": {"mode": "status", "failures": 3, "status": 429, "retry_after": 10},
+    # How long BackpressureTest waits for the server to get its delivery through
+    "backpressure_timeout": 900.0,
+    # Fast synthetic recipients addressed next to the slow one by HeadOfLineBlockingTest
+    "hol_fast_recipients": 5,
+    # Approximate JSON sizes, in bytes, of the objects sent by the payload tests
+    "payload_sizes": [1024, 16 * 1024, 256 * 1024, 1024 * 1024, 4 * 1024 * 1024],
+    # "Note" or "Article"
+    "payload_type": "Note",
+    # Activities (and follows) whose time to show up in a collection is measured
+    "visibility_samples": 10,
+}
+
+# Slack allowed for a retry that is meant to wait out Retry-After
+RETRY_AFTER_TOLERANCE = 1.0
+# A fast delivery arriving later than this many seconds before the slow
+# inbox answered counts as blocked behind it
+HOL_TOLERANCE = 1.0
+
+
+def _sampled(sample, count: int, concurrency: int) -> tuple[list[float], int]:
+    """Run ``sample(i)`` for i in range(count); returns the latencies it
+    measured and how many samples measured nothing."""
+    with ThreadPoolExecutor(concurrency, thread_name_prefix="perf") as pool:
+        results = list(pool.map(trace.bind(sample), range(count)))
+    latencies = [latency for latency in results if latency is not None]
+    return latencies, len(results) - len(latencies)
+
+
+class DeliveryLatencyTest(SendWithFollowersTest):
+    """Outbox POST to local inbox arrival latency of follower deliveries.
+
+    Each sample is a Create addressed to followers that carries its own
+    correlation marker; latency runs from sending the POST to the local
+    server receiving the delivery.
+    """
+
+    def _sample(self, outbox: str, timeout: float) -> float | None:
+        marker = new_marker()
+        sent = self._send_to_followers(outbox, marker)
+        if sent is None:
+            return None
+        arrived = self.ctx.local_server.wait_for_marker(marker, timeout)
+        if arrived is None:
+            log.warning("Delivery of %s not received within %.0fs", marker, timeout)
+            return None
+        return arrived - sent
+
+    def run(self) -> bool:
+        settings = DEFAULTS | self.ctx.perf_settings
+        actor = self._get_actor()
+        if actor is None:
+            return False
+        log.info(
+            "Measuring delivery latency over %d samples, %d at a time",
+            settings["samples"],
+            settings["concurrency"],
+        )
+        latencies, lost = _sampled(
+            lambda _: self._sample(actor["outbox"], settings["timeout"]),
+            settings["samples"],
+            settings["concurrency"],
+        )
+        self.metrics["delivery_latency"] = summarize(latencies)
+        self.metrics["lost"] = lost
+        if not latencies:
+            log.error("No deliveries received")
+            return False
+        return True
+
+
+class _PeerFollowTest(ServerRequiredTest):  # pylint: disable=abstract-method
+    """Base for tests in which synthetic peer actors follow local_actor_id."""
+
+    def skip(self) -> bool:
+        if super().skip():
+            return True
+        peer = self.ctx.local_server.peer
+        if peer is None or not peer.members:
+            return self._skip("no synthetic peer actors configured")
+        return False
+
+    def _follow(self, name: str, inbox: str, undo: dict | None = None) -> dict | None:
+        """Follow local_actor_id as peer actor ``name`` (or undo ``undo``)."""
+        peer = self.ctx.local_server.peer
+        actor_id = peer.actor_id(name)
+        activity = {
+            "@context": AS_CONTEXT,
+            "id": f"{actor_id}/activities/{uuid.uuid4().hex}",
+            "type": "Undo" if undo else "Follow",
+            "actor": actor_id,
+            "object": undo or self.ctx.local_actor_id,
+        }
+        try:
+            transport.post(inbox, activity, auth=peer.auth(name))
+        except requests.RequestException as exc:
+            log.error("%s could not send %s: %s", name, activity["type"], exc)
+            return None
+        return activity
+
+
+class SharedInboxFanoutTest(_PeerFollowTest):
+    """Deliveries per activity when many followers share one host.
+
+    Synthetic actors that advertise a sharedInbox follow local_actor_id,
+    which then posts one activity to its followers. A server that uses the
+    shared inbox sends one POST for the whole host instead of one per
+    follower.
+    """
+
+    def skip(self) -> bool:
+        if super().skip():
+            return True
+        if not self.ctx.local_server.peer.shared_inbox:
+            return self._skip("synthetic peer does not advertise a shared inbox")
+        return False
+
+    def _gather_followers(self, inbox: str, names: list[str], timeout: float) -> dict:
+        """Follow as each of ``names``; returns the accepted Follows by name."""
+        with ThreadPoolExecutor(8, thread_name_prefix="perf") as pool:
+            follow = trace.bind(lambda name: self._follow(name, inbox))
+            follows = dict(zip(names, pool.map(follow, names)))
+        accepted = {}
+        deadline = time.monotonic() + timeout
+        for name, follow in follows.items():
+            if follow is None:
+                continue
+            reply = self.ctx.local_server.wait_for(
+                {"type": "Accept", "object": follow["id"]},
+                timeout=max(deadline - time.monotonic(), 0),
+            )
+            if reply is not None:
+                accepted[name] = follow
+        return accepted
+
+    def _count_deliveries(self, marker: str, timeout: float, settle: float) -> list:
+        server = self.ctx.local_server
+        if server.wait_for_marker(marker, timeout) is None:
+            return []
+        time.sleep(settle)
+        return server.received.all_matching({"marker": marker})
+
+    def run(self) -> bool:
+        settings = DEFAULTS | self.ctx.perf_settings
+        peer = self.ctx.local_server.peer
+        actor = self._get_actor()
+        if actor is None:
+            return False
+        names = peer.members[: settings["fanout_followers"]]
+        log.info("Following %s with %d synthetic actors", self.ctx.local_actor_id, len(names))
+        follows = self._gather_followers(actor["inbox"], names, settings["timeout"])
+        if not follows:
+            log.error("No follow was accepted")
+            return False
+        try:
+            marker = new_marker()
+            activity = make_create(
+                self.ctx.local_actor_id, make_note(self.ctx.local_actor_id, marker)
+            )
+            activity["to"] = [AS_PUBLIC, actor.get("followers", self.ctx.followers_id)]
+            if self._post_activity(actor["outbox"], activity) is None:
+                return False
+            deliveries = self._count_deliveries(marker, settings["timeout"], settings["settle"])
+        finally:
+            for name, follow in follows.items():
+                self._follow(name, actor["inbox"], undo=follow)
+
+        shared = sum(1 for d in deliveries if d.inbox.split("?")[0] == SHARED_INBOX_PATH)
+        self.metrics["followers"] = len(follows)
+        self.metrics["deliveries_per_activity"] = len(deliveries)
+        self.metrics["shared_inbox_posts"] = shared
+        self.metrics["personal_inbox_posts"] = len(deliveries) - shared
+        if not deliveries:
+            log.error("Activity was not delivered to any synthetic follower")
+            return False
+        if not shared:
+            log.warning("Server delivered to personal inboxes despite a shared inbox")
+        return True
+
+
+class KeyFetchCountTest(ServerRequiredTest):
+    """How often the server fetches a sender's key to verify its deliveries.
+
+    A synthetic actor sends signed activities to local_actor_id's inbox and
+    the local server counts the GETs of that actor's document (and so its
+    keyId). A server that caches keys fetches it once; one that does not
+    fetches it for every message.
+    """
+
+    def skip(self) -> bool:
+        if super().skip():
+            return True
+        if self.ctx.local_server.peer is None:
+            return self._skip("no synthetic peer configured")
+        return False
+
+    def _send(self, inbox: str) -> bool:
+        peer = self.ctx.local_server.peer
+        actor_id = peer.actor_id("prober")
+        note = make_note(actor_id)
+        note["to"] = [self.ctx.local_actor_id]
+        activity = make_create(actor_id, note)
+        activity["id"] = f"{actor_id}/activities/{uuid.uuid4().hex}"
+        activity["to"] = [self.ctx.local_actor_id]
+        try:
+            transport.post(inbox, activity, auth=peer.auth("prober"))
+        except requests.RequestException as exc:
+            log.error("Delivery to %s failed: %s", inbox, exc)
+            return False
+        return True
+
+    def run(self) -> bool:
+        settings = DEFAULTS | self.ctx.perf_settings
+        actor = self._get_actor()
+        if actor is None:
+            return False
+        count = settings["key_fetch_activities"]
+        since = time.monotonic()
+        with ThreadPoolExecutor(settings["concurrency"], thread_name_prefix="perf") as pool:
+            sent = sum(pool.map(trace.bind(lambda _: self._send(actor["inbox"])), range(count)))
+        # Servers often verify deliveries from a background queue
+        time.sleep(settings["settle"])
+        fetches = self.ctx.local_server.fetch_count(
+            self.ctx.local_server.peer.actor_id("prober"), since
+        )
+        self.metrics["activities"] = sent
+        self.metrics["key_fetches"] = fetches
+        if not sent:
+            return False
+        if fetches > 1:
+            log.warning("Server fetched the sender's key %d times for %d activities", fetches, sent)
+        return True
+
+
+class BackpressureTest(SendWithFollowersTest):
+    """The server's retry schedule when the local inbox pushes back.
+
+    The local server fails the first deliveries of an activity addressed to
+    followers (429/503 with Retry-After, a dropped connection or a slow
+    answer) and records when each attempt arrives. The test reports the
+    intervals between attempts and whether retries waited out Retry-After.
+    """
+
+    def run(self) -> bool:
+        settings = DEFAULTS | self.ctx.perf_settings
+        profile = FailureProfile(**settings["backpressure"])
+        server = self.ctx.local_server
+        actor = self._get_actor()
+        if actor is None:
+            return False
+        marker = new_marker()
+        server.inject_failures(marker, profile)
+        if self._send_to_followers(actor["outbox"], marker) is None:
+            return False
+        log.info(
+            "Failing the first %d deliveries (%s); waiting up to %.0fs for a retry to succeed",
+            profile.failures,
+            profile.mode,
+            settings["backpressure_timeout"],
+        )
+        delivered = server.wait_for_marker(marker, settings["backpressure_timeout"])
+        attempts = server.attempts(marker)
+        intervals = [later - earlier for earlier, later in zip(attempts, attempts[1:])]
+        self.metrics["attempts"] = len(attempts)
+        self.metrics["retry_intervals"] = intervals
+        if delivered is None:
+            log.error("Delivery did not succeed after %d attempts", len(attempts))
+            return False
+        if profile.mode != "status" or not profile.retry_after:
+            return True
+        # Only retries that follow a Retry-After answer are expected to wait
+        early = [
+            interval
+            for interval in intervals[: profile.failures]
+            if interval < profile.retry_after - RETRY_AFTER_TOLERANCE
+        ]
+        self.metrics["honours_retry_after"] = not early
+        if early:
+            log.error(
+                "%d retries came sooner than Retry-After: %.0fs",
+                len(early),
+                profile.retry_after,
+            )
+            return False
+        return True
+
+
+class HeadOfLineBlockingTest(ServerRequiredTest):
+    """Whether one slow recipient delays delivery to the others.
+
+    One activity is addressed to the peer's ``slowpoke``, whose inbox stalls
+    before answering, and to several fast peer actors. The test measures
+    when the activity reaches each fast inbox; a delivery that arrives once
+    the slow inbox has answered (less HOL_TOLERANCE seconds) waited for it,
+    so the server's delivery workers are blocked behind the slow recipient.
+    """
+
+    def skip(self) -> bool:
+        if super().skip():
+            return True
+        peer = self.ctx.local_server.peer
+        if peer is None or not peer.members:
+            return self._skip("no synthetic peer actors configured")
+        return False
+
+    def _fast_arrivals(self, marker: str, names: list[str], deadline: float) -> list[float]:
+        """Arrival time at each fast recipient's inbox (or the shared inbox)."""
+        server = self.ctx.local_server
+        inboxes = tuple(f"/users/{name}/inbox" for name in names)
+        if server.peer.shared_inbox:
+            inboxes += (SHARED_INBOX_PATH,)
+        arrivals: list[float] = []
+        while len(arrivals) < len(names):
+            delivery = server.wait_for(
+                {"marker": marker, "inbox": inboxes},
+                timeout=max(deadline - time.monotonic(), 0),
+            )
+            if delivery is None:
+                break
+            if delivery.inbox == SHARED_INBOX_PATH:
+                # One shared inbox delivery reaches every fast recipient
+                return [delivery.received] * len(names)
+            arrivals.append(delivery.received)
+            inboxes = tuple(inbox for inbox in inboxes if inbox != delivery.inbox)
+        return arrivals
+
+    def _post_to_all(self, outbox: str, recipients: list[str], marker: str) -> float | None:
+        actor_id = self.ctx.local_actor_id
+        activity = make_create(actor_id, make_note(actor_id, marker))
+        # The slow recipient comes first, so a FIFO delivery queue meets it first
+        activity["to"] = activity["object"]["to"] = recipients
+        sent = time.monotonic()
+        return sent if self._post_activity(outbox, activity) is not None else None
+
+    def run(self) -> bool:
+        settings = DEFAULTS | self.ctx.perf_settings
+        peer = self.ctx.local_server.peer
+        actor = self._get_actor()
+        if actor is None:
+            return False
+        names = peer.members[: settings["hol_fast_recipients"]]
+        stall = peer.actors["slowpoke"].stall
+        marker = new_marker()
+        recipients = [peer.actor_id("slowpoke")] + [peer.actor_id(name) for name in names]
+        sent = self._post_to_all(actor["outbox"], recipients, marker)
+        if sent is None:
+            return False
+        # Leave time for a blocked server to get past the slow inbox
+        deadline = sent + stall + settings["timeout"]
+        arrivals = self._fast_arrivals(marker, names, deadline)
+        slow = self.ctx.local_server.wait_for(
+            {"marker": marker, "inbox": "/users/slowpoke/inbox"},
+            timeout=max(deadline - time.monotonic(), 0),
+        )
+        self.metrics["fast_latency"] = summarize([at - sent for at in arrivals])
+        self.metrics["lost"] = len(names) - len(arrivals)
+        if slow is not None:
+            self.metrics["slow_latency"] = slow.received - sent
+        if len(arrivals) < len(names):
+            log.error("%d fast recipients did not receive the activity", len(names) - len(arrivals))
+            return False
+        if slow is None:
+            log.warning("The slow inbox never got the activity; blocking can't be measured")
+            return True
+        # The slow inbox answers once it has stalled for `stall` seconds
+        threshold = slow.received + max(stall - HOL_TOLERANCE, 0.0)
+        self.metrics["blocked_after"] = threshold - sent
+        blocked = [at for at in arrivals if at >= threshold]
+        self.metrics["blocked"] = len(blocked)
+        if blocked:
+            log.error(
+                "%d fast deliveries waited for the %.0fs slow inbox to answer", len(blocked), stall
+            )
+            return False
+        return True
+
+
+def _size_label(size: int) -> str:
+    for unit, scale in (("MiB", 1024 * 1024), ("KiB", 1024)):
+        if size >= scale:
+            return f"{size / scale:g}{unit}"
+    return f"{size}B"
+
+
+class _PayloadSizeTest(FederationTest):  # pylint: disable=abstract-method
+    """POSTs objects of increasing size until the server refuses one.
+
+    Reports the latency of each accepted size, the largest size accepted and
+    the smallest refused. An authentication failure after smaller payloads
+    were accepted means the Digest or signature stopped verifying at size.
+    """
+
+    def _target(self) -> str | None:
+        """URL to POST to; None if it can't be found."""
+        raise NotImplementedError
+
+    def _activity(self, size: int, kind: str) -> dict:
+        raise NotImplementedError
+
+    def _post_sized(self, target: str, size: int, kind: str) -> float | int:
+        """Latency of a POST of ``size`` bytes, or the status that refused it."""
+        activity = self._activity(size, kind)
+        start = time.monotonic()
+        try:
+            self._post(target, activity, auth=self.ctx.auth)
+        except requests.HTTPError as exc:
+            return exc.response.status_code
+        except requests.ConnectionError as exc:
+            # Servers may reset the connection rather than read an oversized body
+            log.warning("%s payload: connection failed: %s", _size_label(size), exc)
+            return 0
+        return time.monotonic() - start
+
+    def run(self) -> bool:
+        settings = DEFAULTS | self.ctx.perf_settings
+        target = self._target()
+        if target is None:
+            return False
+        accepted = 0
+        for size in sorted(settings["payload_sizes"]):
+            result = self._post_sized(target, size, settings["payload_type"])
+            if isinstance(result, float):
+                accepted = size
+                self.metrics[_size_label(size)] = result
+                continue
+            self.metrics[_size_label(size)] = f"refused ({result or 'connection reset'})"
+            self.metrics["min_refused_bytes"] = size
+            if result in (401, 403) and accepted:
+                log.error(
+                    "Authentication failed at %s after smaller payloads were accepted; "
+                    "Digest or signature verification does not hold at size",
+                    _size_label(size),
+                )
+                return False
+            break
+        self.metrics["max_accepted_bytes"] = accepted
+        if not accepted:
+            log.error("Server refused even the smallest payload")
+            return False
+        return True
+
+
+class OutboxPayloadSizeTest(_PayloadSizeTest):
+    """Objects of increasing size posted to local_actor_id's outbox."""
+
+    def _target(self) -> str | None:
+        actor = self._get_actor()
+        return actor["outbox"] if actor is not None else None
+
+    def _activity(self, size: int, kind: str) -> dict:
+        actor_id = self.ctx.local_actor_id
+        return make_create(actor_id, make_large_object(actor_id, size, kind=kind))
+
+
+class InboxPayloadSizeTest(_PayloadSizeTest):
+    """Objects of increasing size delivered to actor_id's inbox, signed as
+    local_actor_id."""
+
+    def skip(self) -> bool:
+        if not self.ctx.actor_id:
+            return self._skip("actor_id not configured")
+        return super().skip()
+
+    def _target(self) -> str | None:
+        try:
+            return self._get(self.ctx.actor_id)["inbox"]
+        except (requests.HTTPError, KeyError) as exc:
+            log.error("Failed to resolve remote actor inbox: %s", exc)
+            return None
+
+    def _activity(self, size: int, kind: str) -> dict:
+        actor_id = self.ctx.local_actor_id
+        obj = make_large_object(actor_id, size, kind=kind)
+        obj["to"] = [self.ctx.actor_id]
+        activity = make_create(actor_id, obj)
+        activity["to"] = [self.ctx.actor_id]
+        return activity
+
+
+class OutboxVisibilityTest(FederationTest):
+    """Time from an outbox POST until the activity shows up in the outbox.
+
+    Busy servers publish asynchronously; each sample polls the first pages
+    of the outbox with backoff until the new activity appears. Samples whose
+    POST returns no activity id can't be looked for and are not counted.
+    """
+
+    def __init__(self, ctx: TestContext) -> None:
+        super().__init__(ctx)
+        self._without_id: list[str] = []
+
+    def _sample(self, outbox: str, timeout: float) -> float | None:
+        actor_id = self.ctx.local_actor_id
+        start = time.monotonic()
+        result = self._post_activity(outbox, make_create(actor_id, make_note(actor_id)))
+        if result is None:
+            return None
+        activity_id = result.get("id") if isinstance(result, dict) else None
+        if not activity_id:
+            self._without_id.append(outbox)
+            return None
+        waited = self._wait_visible(
+            outbox, activity_id, PollBackoff(timeout), max_pages=RECENT_PAGES
+        )
+        return None if waited is None else time.monotonic() - start
+
+    def run(self) -> bool:
+        settings = DEFAULTS | self.ctx.perf_settings
+        actor = self._get_actor()
+        if actor is None:
+            return False
+        latencies, missing = _sampled(
+            lambda _: self._sample(actor["outbox"], settings["timeout"]),
+            settings["visibility_samples"],
+            settings["concurrency"],
+        )
+        self.metrics["outbox_visibility"] = summarize(latencies)
+        self.metrics["not_visible"] = missing - len(self._without_id)
+        if self._without_id and not latencies:
+            log.info("Server did not return activity IDs; skipping outbox visibility check")
+            return True
+        if not latencies:
+            log.error("No posted activity showed up in the outbox")
+            return False
+        return True
+
+
+class FollowVisibilityTest(_PeerFollowTest):
+    """Time until a new follow shows up in followers and following.
+
+    Synthetic peer actors follow local_actor_id, which in turn follows other
+    peer actors through its outbox; each sample polls followers_id or
+    following_id with backoff until the new member appears, then undoes
+    the follow.
+    """
+
+    def skip(self) -> bool:
+        if super().skip():
+            return True
+        if not self.ctx.followers_id or not self.ctx.following_id:
+            return self._skip("followers_id or following_id not configured")
+        return False
+
+    def _followers_sample(self, name: str, inbox: str, timeout: float) -> float | None:
+        start = time.monotonic()
+        follow = self._follow(name, inbox)
+        if follow is None:
+            return None
+        try:
+            waited = self._wait_visible(
+                self.ctx.followers_id, follow["actor"], PollBackoff(timeout), RECENT_PAGES
+            )
+            return None if waited is None else time.monotonic() - start
+        finally:
+            self._follow(name, inbox, undo=follow)
+
+    def _following_sample(self, name: str, outbox: str, timeout: float) -> float | None:
+        target = self.ctx.local_server.peer.actor_id(name)
+        follow = make_follow(self.ctx.local_actor_id, target)
+        start = time.monotonic()
+        result = self._post_activity(outbox, follow)
+        if result is None:
+            return None
+        try:
+            waited = self._wait_visible(
+                self.ctx.following_id, target, PollBackoff(timeout), RECENT_PAGES
+            )
+            return None if waited is None else time.monotonic() - start
+        finally:
+            undo = {
+                "@context": AS_CONTEXT,
+                "type": "Undo",
+                "actor": self.ctx.local_actor_id,
+                "object": result.get("id") or follow,
+                "to": [target],
+            }
+            self._post_activity(outbox, undo)
+
+    def run(self) -> bool:
+        settings = DEFAULTS | self.ctx.perf_settings
+        actor = self._get_actor()
+        if actor is None:
+            return False
+        members = self.ctx.local_server.peer.members
+        # Different peer actors for each sample, so samples can overlap
+        count = min(settings["visibility_samples"], len(members) // 2)
+        timeout = settings["timeout"]
+        followers, lost_followers = _sampled(
+            lambda i: self._followers_sample(members[i], actor["inbox"], timeout),
+            count,
+            settings["concurrency"],
+        )
+        following, lost_following = _sampled(
+            lambda i: self._following_sample(members[count + i], actor["outbox"], timeout),
+            count,
+            settings["concurrency"],
+        )
+        self.metrics["followers_visibility"] = summarize(followers)
+        self.metrics["following_visibility"] = summarize(following)
+        self.metrics["not_visible"] = lost_followers + lost_following
+        if not followers and not following:
+            log.error("No new follow showed up in followers or following")
+            return False
+        return True
+
+
+PERF_TESTS = [
+    DeliveryLatencyTest,
+    SharedInboxFanoutTest,
+    KeyFetchCountTest,
+    BackpressureTest,
+    HeadOfLineBlockingTest,
+    OutboxPayloadSizeTest,
+    InboxPayloadSizeTest,
+    OutboxVisibilityTest,
+    FollowVisibilityTest,
+]
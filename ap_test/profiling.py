@@ -0,0 +1,136 @@
+# Copyright (c) 2023 Pat Long
+# SPDX-License-Identifier: MIT
+
+import cProfile
+import logging
+import os
+import pstats
+import sys
+import threading
+import tracemalloc
+from contextlib import contextmanager
+
+log = logging.getLogger(__name__)
+
+# Frames that only show the profiler's own allocations
+_IGNORED_FRAMES = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, cProfile.__file__),
+    tracemalloc.Filter(False, __file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<unknown>"),
+)
+
+# From 3.12 cProfile uses sys.monitoring, which already sees every thread
+# and allows only one profiler at a time
+_PROFILE_THREADS = sys.version_info < (3, 12)
+
+
+class Profiler:
+    """Profiles the suite's own code while each test runs.
+
+    Every test's run() is profiled with cProfile into ``<test>.pstats`` in
+    ``directory``; finish() merges them into ``all.pstats``. Threads started
+    while a test runs, such as the crawler's page prefetch, the perf tests'
+    sender pools and the local server's workers, are profiled too, but only
+    their work up to the end of that test is counted; before Python 3.12,
+    threads started earlier are not profiled. With ``memory``, tracemalloc
+    also records the allocation sites whose memory each test left behind.
+    """
+
+    def __init__(self, directory: str, top: int = 20, memory: bool = False) -> None:
+        self.directory = directory
+        self.top = top
+        self.memory = memory
+        self._paths: list[str] = []
+        # allocation site -> [bytes, blocks] still allocated after a test
+        self._allocations: dict[str, list[int]] = {}
+        self._peaks: dict[str, int] = {}
+
+    def start(self) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        if self.memory:
+            tracemalloc.start()
+
+    @contextmanager
+    def profile(self, name: str):
+        """Profile the block as the test called ``name``."""
+        before = None
+        baseline = 0
+        if self.memory:
+            before = tracemalloc.take_snapshot().filter_traces(_IGNORED_FRAMES)
+            tracemalloc.reset_peak()
+            baseline = tracemalloc.get_traced_memory()[0]
+        profiler = cProfile.Profile()
+        threads: list[cProfile.Profile] = []
+        threads_lock = threading.Lock()
+
+        def profile_thread(*_):
+            # Called on the first event in each new thread; replaces itself
+            thread_profiler = cProfile.Profile()
+            try:
+                thread_profiler.enable()
+            except ValueError as e:
+                # Another profiler owns this thread; never break the thread for it
+                log.debug("Not profiling %s: %s", threading.current_thread().name, e)
+                return
+            with threads_lock:
+                threads.append(thread_profiler)
+
+        if _PROFILE_THREADS:
+            threading.setprofile(profile_thread)
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            if _PROFILE_THREADS:
+                threading.setprofile(None)
+            if before is not None:
+                self._peaks[name] = tracemalloc.get_traced_memory()[1] - baseline
+                self._add_allocations(before)
+            self._dump(name, profiler, threads)
+
+    def _dump(self, name: str, profiler: cProfile.Profile, threads: list) -> None:
+        stats = pstats.Stats(profiler)
+        for thread_profiler in list(threads):
+            try:
+                stats.add(thread_profiler)
+            except TypeError:
+                # The thread made no calls
+                continue
+        path = os.path.join(self.directory, f"{name}.pstats")
+        stats.dump_stats(path)
+        self._paths.append(path)
+
+    def _add_allocations(self, before: tracemalloc.Snapshot) -> None:
+        after = tracemalloc.take_snapshot().filter_traces(_IGNORED_FRAMES)
+        for stat in after.compare_to(before, "lineno"):
+            if stat.size_diff > 0:
+                site = self._allocations.setdefault(str(stat.traceback[0]), [0, 0])
+                site[0] += stat.size_diff
+                site[1] += stat.count_diff
+
+    def finish(self) -> None:
+        """Write the merged profile and print the top functions and allocation sites."""
+        if self.memory:
+            tracemalloc.stop()
+        if not self._paths:
+            return
+        merged = pstats.Stats(*self._paths)
+        merged_path = os.path.join(self.directory, "all.pstats")
+        merged.dump_stats(merged_path)
+
+        print()
+        print("=== PROFILE ===")
+        print(f"{len(self._paths)} profiles in {self.directory}, merged into {merged_path}")
+        merged.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(self.top)
+        if not self.memory:
+            return
+        print("Peak memory allocated while each test ran:")
+        for name, peak in sorted(self._peaks.items(), key=lambda item: -item[1]):
+            print(f"    {name}: {peak / 1024:.1f} KiB")
+        print(f"Top {self.top} allocation sites still holding memory after a test:")
+        sites = sorted(self._allocations.items(), key=lambda item: -item[1][0])
+        for site, (size, count) in sites[: self.top]:
+            print(f"    {site}: {size / 1024:.1f} KiB in {count} blocks")
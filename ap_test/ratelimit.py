@@ -0,0 +1,194 @@
+# Copyright (c) 2023 Pat Long
+# SPDX-License-Identifier: MIT
+
+import logging
+import random
+import threading
+import time
+from datetime import datetime
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+
+log = logging.getLogger(__name__)
+
+# Status codes worth retrying for idempotent requests. POSTs are only retried
+# on 429, which guarantees the request was not processed.
+RETRY_STATUSES = (429, 502, 503, 504)
+
+
+def _parse_reset(value: str, now: float) -> float | None:
+    """Seconds until a rate limit window resets.
+
+    Accepts delta-seconds (RateLimit-Reset), epoch seconds, ISO 8601
+    (Mastodon's X-RateLimit-Reset) and HTTP dates.
+    """
+    try:
+        seconds = float(value)
+        return seconds - now if seconds > 1e9 else seconds
+    except ValueError:
+        pass
+    try:
+        return datetime.fromisoformat(value).timestamp() - now
+    except ValueError:
+        pass
+    try:
+        return parsedate_to_datetime(value).timestamp() - now
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_retry_after(value: str | None) -> float | None:
+    if not value:
+        return None
+    delay = _parse_reset(value.strip(), time.time())
+    return None if delay is None else max(delay, 0.0)
+
+
+def parse_rate_limit(headers) -> tuple[int | None, int | None, float | None]:
+    """Return (limit, remaining, seconds until reset) from rate limit headers."""
+    for prefix in ("RateLimit-", "X-RateLimit-"):
+        remaining = headers.get(prefix + "Remaining")
+        reset = headers.get(prefix + "Reset")
+        if remaining is None or reset is None:
+            continue
+        limit = headers.get(prefix + "Limit")
+        try:
+            # RateLimit-Limit may carry a policy suffix, e.g. "100, 100;w=60"
+            limit = int(limit.split(",")[0].split(";")[0]) if limit else None
+            return limit, int(remaining), _parse_reset(reset, time.time())
+        except ValueError:
+            continue
+    return None, None, None
+
+
+class _HostBucket:
+    """Fixed-window request allowance for one host, as reported by the host.
+
+    Until the host reports its limits, requests are only paced by the
+    optional configured rate and by any Retry-After the host sent. Once the
+    allowance is used up before the next window's reset is known, requests
+    are spaced ``fallback`` seconds apart.
+    """
+
+    def __init__(self, interval: float, fallback: float) -> None:
+        self.interval = interval
+        self.fallback = fallback
+        self.limit: int | None = None
+        self.remaining: int | None = None
+        self.reset_at = float("inf")
+        self.blocked_until = 0.0
+        self.next_slot = 0.0
+        self.inflight = 0
+
+    def reserve(self, now: float) -> float:
+        """Reserve a request slot; returns how long to wait before sending."""
+        start = max(now, self.blocked_until)
+        if self.remaining is not None:
+            if start >= self.reset_at:
+                self.remaining = self.limit
+                self.reset_at = float("inf")
+            elif self.remaining <= 0 and self.reset_at == float("inf"):
+                # No response has reported the new window yet
+                start = self.blocked_until = start + self.fallback
+            elif self.remaining <= 0:
+                # Window exhausted: everyone waits for the reset
+                start = self.blocked_until = self.reset_at
+                self.remaining = self.limit
+                self.reset_at = float("inf")
+        if self.remaining is not None:
+            self.remaining -= 1
+        if self.interval:
+            start = max(start, self.next_slot)
+            self.next_slot = start + self.interval
+        self.inflight += 1
+        return start - now
+
+    def observe(self, now: float, status: int | None, headers) -> None:
+        self.inflight = max(self.inflight - 1, 0)
+        if headers is None:
+            return
+        limit, remaining, reset = parse_rate_limit(headers)
+        if remaining is not None and reset is not None:
+            self.limit = limit if limit is not None else self.limit
+            # The host has not counted requests that are still in flight
+            self.remaining = remaining - self.inflight
+            self.reset_at = now + max(reset, 0.0)
+        if status in (429, 503):
+            retry_after = parse_retry_after(headers.get("Retry-After"))
+            if retry_after is not None:
+                self.blocked_until = max(self.blocked_until, now + retry_after)
+
+
+class RateLimiter:
+    """Per-host request pacing that learns from the host's rate limit headers.
+
+    Hosts that report ``RateLimit-*`` or ``X-RateLimit-*`` headers are sent
+    requests only while their window has allowance left; everyone else
+    queues until the window resets. ``Retry-After`` on 429/503 responses
+    blocks the host for the given time.
+    """
+
+    def __init__(
+        self,
+        requests_per_second: float | None = None,
+        max_retries: int = 3,
+        backoff: float = 0.5,
+        max_backoff: float = 30.0,
+    ) -> None:
+        self.interval = 1.0 / requests_per_second if requests_per_second else 0.0
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self._lock = threading.Lock()
+        self._buckets: dict[str, _HostBucket] = {}
+        self.throttled = 0.0
+        self.retries = 0
+
+    def _bucket(self, iri: str) -> _HostBucket:
+        host = urlparse(iri).netloc
+        if host not in self._buckets:
+            self._buckets[host] = _HostBucket(self.interval, self.interval or self.backoff)
+        return self._buckets[host]
+
+    def _sleep(self, seconds: float) -> None:
+        if seconds <= 0:
+            return
+        with self._lock:
+            self.throttled += seconds
+        time.sleep(seconds)
+
+    def acquire(self, iri: str) -> None:
+        """Block until a request to ``iri``'s host may be sent."""
+        with self._lock:
+            wait = self._bucket(iri).reserve(time.monotonic())
+        if wait > 0:
+            log.info("Throttling %s for %.2fs", urlparse(iri).netloc, wait)
+        self._sleep(wait)
+
+    def observe(self, iri: str, response=None) -> None:
+        """Learn from ``response``; call with None if the request failed."""
+        status = response.status_code if response is not None else None
+        headers = response.headers if response is not None else None
+        with self._lock:
+            self._bucket(iri).observe(time.monotonic(), status, headers)
+
+    @staticmethod
+    def should_retry(method: str, status: int | None) -> bool:
+        """Whether a request that got ``status`` (None: no response) may be resent."""
+        if method == "GET":
+            return status is None or status in RETRY_STATUSES
+        return status == 429
+
+    def wait_before_retry(self, iri: str, attempt: int) -> None:
+        """Back off before retry number ``attempt`` (0-based), with full jitter.
+
+        Any Retry-After from the host is honoured by the next acquire().
+        """
+        with self._lock:
+            self.retries += 1
+        delay = min(self.max_backoff, self.backoff * 2**attempt)
+        log.info("Retrying request to %s (attempt %d)", urlparse(iri).netloc, attempt + 2)
+        self._sleep(random.uniform(0, delay))
+
+    def as_dict(self) -> dict[str, float]:
+        return {"throttled_seconds": self.throttled, "retries": self.retries}
@@ -0,0 +1,185 @@
+# Copyright (c) 2023 Pat Long
+# SPDX-License-Identifier: MIT
+
+import json
+import logging
+import threading
+import time
+import xml.etree.ElementTree as ET
+from datetime import datetime, timezone
+from urllib.parse import parse_qs, urlparse
+
+from .metrics import summarize
+
+log = logging.getLogger(__name__)
+
+# Last path segments that name a well-known kind of endpoint
+_KINDS_BY_SEGMENT = {
+    "outbox": "outbox",
+    "inbox": "inbox",
+    "followers": "collection",
+    "following": "collection",
+    "liked": "collection",
+    "likes": "collection",
+    "shares": "collection",
+    "featured": "collection",
+}
+# Query parameters that select a page of a collection
+_PAGE_PARAMS = ("page", "min_id", "max_id", "since_id", "cursor")
+
+
+def endpoint_kind(url: str) -> str:
+    """Classify a request URL as actor, outbox, inbox, collection,
+    collection page, webfinger or other, from its path alone."""
+    parsed = urlparse(url)
+    if parsed.path.startswith("/.well-known/webfinger"):
+        return "webfinger"
+    segments = [segment for segment in parsed.path.split("/") if segment]
+    if any(param in parse_qs(parsed.query) for param in _PAGE_PARAMS):
+        return "collection page"
+    if segments and segments[-1] in _KINDS_BY_SEGMENT:
+        return _KINDS_BY_SEGMENT[segments[-1]]
+    if len(segments) == 2 and segments[0] in ("users", "actors", "u", "accounts"):
+        return "actor"
+    if len(segments) == 1 and segments[0].startswith("@"):
+        return "actor"
+    return "other"
+
+
+class TestResult:  # pylint: disable=too-few-public-methods
+    """Outcome of one test in a run."""
+
+    def __init__(self, suite: str, test, status: str, duration: float) -> None:
+        self.suite = suite
+        self.name = test.__class__.__name__
+        self.status = status
+        self.skip_reason = test.skip_reason
+        self.duration = duration
+        self.crawl_time = test.crawl_time()
+        self.metrics = dict(test.metrics)
+        self.requests = 0
+        self.bytes_out = 0
+        self.bytes_in = 0
+
+    def as_dict(self) -> dict:
+        return {
+            "suite": self.suite,
+            "name": self.name,
+            "status": self.status,
+            "skip_reason": self.skip_reason,
+            "duration": self.duration,
+            "crawl_time": self.crawl_time,
+            "requests": self.requests,
+            "bytes_out": self.bytes_out,
+            "bytes_in": self.bytes_in,
+            "metrics": self.metrics,
+        }
+
+
+class RunReport:
+    """Results of a run, plus every HTTP exchange made during it.
+
+    Register it with trace.add_sink() to see the exchanges. Request counts
+    and bytes are attributed to the test that made them; latencies are
+    summarized per host and per endpoint kind.
+    """
+
+    def __init__(self) -> None:
+        self.started = time.time()
+        self.results: list[TestResult] = []
+        self._lock = threading.Lock()
+        # test name -> [requests, bytes out, bytes in]
+        self._traffic: dict[str, list[int]] = {}
+        self._by_host: dict[str, list[float]] = {}
+        self._by_kind: dict[str, list[float]] = {}
+
+    def record(self, exchange) -> None:
+        """trace sink: account for one finished exchange."""
+        total = exchange.end - exchange.start
+        with self._lock:
+            traffic = self._traffic.setdefault(exchange.test, [0, 0, 0])
+            traffic[0] += 1
+            traffic[1] += exchange.bytes_out
+            traffic[2] += exchange.bytes_in
+            if exchange.status is not None:
+                self._by_host.setdefault(urlparse(exchange.url).netloc, []).append(total)
+                self._by_kind.setdefault(endpoint_kind(exchange.url), []).append(total)
+
+    def add_result(self, suite: str, test, status: str, duration: float) -> None:
+        result = TestResult(suite, test, status, duration)
+        with self._lock:
+            result.requests, result.bytes_out, result.bytes_in = self._traffic.get(
+                result.name, (0, 0, 0)
+            )
+            self.results.append(result)
+
+    def counts(self) -> dict[str, int]:
+        counts = {"passed": 0, "failed": 0, "skipped": 0}
+        for result in self.results:
+            counts[result.status] += 1
+        return counts
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            return {
+                "started": datetime.fromtimestamp(self.started, timezone.utc).isoformat(),
+                "duration": time.time() - self.started,
+                "counts": self.counts(),
+                "tests": [result.as_dict() for result in self.results],
+                "latency": {
+                    "by_host": {host: summarize(v) for host, v in sorted(self._by_host.items())},
+                    "by_kind": {kind: summarize(v) for kind, v in sorted(self._by_kind.items())},
+                },
+            }
+
+    def write_json(self, path: str) -> None:
+        with open(path, "w", encoding="utf-8") as fh:
+            json.dump(self.as_dict(), fh, indent=2)
+            fh.write("\n")
+
+    def _testcase(self, result: TestResult) -> ET.Element:
+        case = ET.Element(
+            "testcase",
+            classname=f"ap_test.{result.suite.lower()}",
+            name=result.name,
+            time=f"{result.duration:.3f}",
+        )
+        if result.status == "skipped":
+            ET.SubElement(case, "skipped", message=result.skip_reason or "")
+        elif result.status == "failed":
+            ET.SubElement(case, "failure", message=f"{result.name} failed")
+        properties = ET.SubElement(case, "properties")
+        values = {
+            "requests": result.requests,
+            "bytes_out": result.bytes_out,
+            "bytes_in": result.bytes_in,
+        }
+        for name, value in (values | result.metrics).items():
+            # Latency summaries become one property per statistic
+            items = value.items() if isinstance(value, dict) else [("", value)]
+            for stat, stat_value in items:
+                ET.SubElement(
+                    properties,
+                    "property",
+                    name=f"{name}.{stat}" if stat else name,
+                    value=stat_value if isinstance(stat_value, str) else json.dumps(stat_value),
+                )
+        return case
+
+    def write_junit(self, path: str) -> None:
+        """Write the results as JUnit XML, one testsuite per suite."""
+        root = ET.Element("testsuites", name="ap-test")
+        suites: dict[str, ET.Element] = {}
+        with self._lock:
+            for result in self.results:
+                if result.suite not in suites:
+                    suites[result.suite] = ET.SubElement(root, "testsuite", name=result.suite)
+                suites[result.suite].append(self._testcase(result))
+            for name, suite in suites.items():
+                results = [r for r in self.results if r.suite == name]
+                suite.set("tests", str(len(results)))
+                suite.set("failures", str(sum(r.status == "failed" for r in results)))
+                suite.set("skipped", str(sum(r.status == "skipped" for r in results)))
+                suite.set("time", f"{sum(r.duration for r in results):.3f}")
+        ET.indent(root)
+        ET.ElementTree(root).write(path, encoding="utf-8", xml_declaration=True)
@@ -0,0 +1,302 @@
+# Copyright (c) 2023 Pat Long
+# SPDX-License-Identifier: MIT
+
+import asyncio
+import contextlib
+import contextvars
+import heapq
+import logging
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from . import trace
+from .metrics import format_summary
+from .profiling import Profiler
+from .report import RunReport
+from .tests import BaseTest
+
+log = logging.getLogger(__name__)
+
+# Output buffer of the test running in the current task/thread, if any
+_output: contextvars.ContextVar[list | None] = contextvars.ContextVar(
+    "ap_test_output", default=None
+)
+
+
+def _log(msg, barrier="#"):
+    print(f"{barrier * 4} {msg} {barrier * 4}")
+
+
+class _BufferingHandler(logging.Handler):
+    """Holds back log records emitted by a running test until it is reported."""
+
+    def __init__(self, handlers: list[logging.Handler]) -> None:
+        super().__init__()
+        self._handlers = handlers or [logging.lastResort]
+
+    def emit(self, record):
+        buf = _output.get()
+        if buf is None:
+            self.forward(record)
+        else:
+            buf.append(record)
+
+    def forward(self, record):
+        for handler in self._handlers:
+            if handler is not None and record.levelno >= handler.level:
+                handler.handle(record)
+
+
+@contextmanager
+def _buffered_logging():
+    root = logging.getLogger()
+    handlers = root.handlers[:]
+    buffering = _BufferingHandler(handlers)
+    root.handlers = [buffering]
+    try:
+        yield buffering
+    finally:
+        root.handlers = handlers
+
+
+def build_graph(tests: list[BaseTest]) -> dict[BaseTest, list[BaseTest]]:
+    """Map each test to the tests that must finish before it starts.
+
+    A test depends on every test that produces a context field it consumes,
+    and on every test whose class it lists in ``depends_on``.
+    """
+    producers: dict[str, list[BaseTest]] = {}
+    by_class: dict[type, BaseTest] = {}
+    for test in tests:
+        by_class[type(test)] = test
+        for field in test.produces:
+            producers.setdefault(field, []).append(test)
+
+    graph = {}
+    for test in tests:
+        deps = [p for field in test.consumes for p in producers.get(field, []) if p is not test]
+        deps += [by_class[cls] for cls in test.depends_on if cls in by_class]
+        graph[test] = list(dict.fromkeys(deps))
+    return graph
+
+
+def _critical_path(graph: dict[BaseTest, list[BaseTest]]) -> dict[BaseTest, int]:
+    """Length of the longest chain of tests that starts at each test."""
+    dependents: dict[BaseTest, list[BaseTest]] = {test: [] for test in graph}
+    pending = {test: len(deps) for test, deps in graph.items()}
+    for test, deps in graph.items():
+        for dep in deps:
+            dependents[dep].append(test)
+
+    order = [test for test, count in pending.items() if count == 0]
+    for test in order:
+        for child in dependents[test]:
+            pending[child] -= 1
+            if pending[child] == 0:
+                order.append(child)
+    if len(order) != len(graph):
+        cycle = sorted(type(t).__name__ for t, count in pending.items() if count)
+        raise ValueError(f"Dependency cycle between tests: {', '.join(cycle)}")
+
+    length: dict[BaseTest, int] = {}
+    for test in reversed(order):
+        length[test] = 1 + max((length[child] for child in dependents[test]), default=0)
+    return length
+
+
+class _PriorityLimiter:
+    """Semaphore that hands free slots to the waiter with the highest priority."""
+
+    def __init__(self, slots: int) -> None:
+        self._slots = slots
+        self._waiters: list[tuple[int, int, asyncio.Future]] = []
+        self._seq = 0
+
+    async def acquire(self, priority: int) -> None:
+        if self._slots > 0 and not self._waiters:
+            self._slots -= 1
+            return
+        fut = asyncio.get_running_loop().create_future()
+        self._seq += 1
+        heapq.heappush(self._waiters, (-priority, self._seq, fut))
+        await fut
+
+    def release(self) -> None:
+        while self._waiters:
+            _, _, fut = heapq.heappop(self._waiters)
+            if not fut.done():
+                fut.set_result(None)
+                return
+        self._slots += 1
+
+
+def _print_metrics(test: BaseTest) -> None:
+    """Print a test's metrics; durations are floats (or lists of them) in seconds,
+    counts are ints."""
+    for name, value in test.metrics.items():
+        if isinstance(value, dict):
+            print(f"    {name}: {format_summary(value)}")
+        elif isinstance(value, float):
+            print(f"    {name}: {value:.3f}s")
+        elif isinstance(value, list):
+            print(f"    {name}: {', '.join(f'{v:.3f}s' for v in value) or '-'}")
+        else:
+            print(f"    {name}: {value}")
+
+
+def _report(test: BaseTest, status: str, records: list, output: _BufferingHandler):
+    test_name = test.__class__.__name__
+    if status == "skipped":
+        for record in records:
+            output.forward(record)
+        _log(f"Skipping {test_name}", barrier="*")
+        return
+
+    _log(f"Running {test_name}")
+    sys.stdout.flush()
+    for record in records:
+        output.forward(record)
+    _log(f"Test {test_name} {status}")
+    _print_metrics(test)
+
+
+def _run_serial(
+    suites: list[tuple[str, list[BaseTest]]],
+    failfast: bool,
+    report: RunReport | None,
+    profiler: Profiler | None,
+) -> bool:
+    for i, (suite, tests) in enumerate(suites):
+        _suite_header(suite, first=i == 0)
+        for test in tests:
+            test_name = test.__class__.__name__
+            if test.skip():
+                _log(f"Skipping {test_name}", barrier="*")
+                if report is not None:
+                    report.add_result(suite, test, "skipped", 0.0)
+                continue
+
+            _log(f"Running {test_name}")
+            token = trace.current_test.set(test_name)
+            start = time.perf_counter()
+            try:
+                with profiler.profile(test_name) if profiler else contextlib.nullcontext():
+                    passed = test.run()
+            finally:
+                trace.current_test.reset(token)
+            status = "passed" if passed else "failed"
+            _log(f"Test {test_name} {status}")
+            _print_metrics(test)
+            if report is not None:
+                report.add_result(suite, test, status, time.perf_counter() - start)
+            if failfast and not passed:
+                return False
+
+    return True
+
+
+async def _run_one(
+    test: BaseTest, after: list[asyncio.Task], limit: _PriorityLimiter, priority: int
+):
+    """Run ``test`` once every task in ``after`` is done.
+
+    Returns the test's status, the log records it emitted and how long it ran.
+    """
+    if after:
+        await asyncio.wait(after)
+    records: list[logging.LogRecord] = []
+    _output.set(records)
+    trace.current_test.set(test.__class__.__name__)
+    await limit.acquire(priority)
+    try:
+        if test.skip():
+            return "skipped", records, 0.0
+        start = time.perf_counter()
+        passed = await test.arun()
+    finally:
+        limit.release()
+    return ("passed" if passed else "failed"), records, time.perf_counter() - start
+
+
+def _schedule(tests: list[BaseTest], concurrency: int) -> list[asyncio.Task]:
+    """Start a task per test that waits for the test's dependencies.
+
+    When more tests are ready than there are workers, the ones heading the
+    longest chains of dependent tests go first.
+    """
+    graph = build_graph(tests)
+    priority = _critical_path(graph)
+    limit = _PriorityLimiter(concurrency)
+    tasks: dict[BaseTest, asyncio.Task] = {}
+    # Tests are listed in an order that satisfies their dependencies, but a
+    # dependency may still come later when suites are combined.
+    remaining = list(tests)
+    while remaining:
+        for test in list(remaining):
+            if all(dep in tasks for dep in graph[test]):
+                after = [tasks[dep] for dep in graph[test]]
+                tasks[test] = asyncio.create_task(_run_one(test, after, limit, priority[test]))
+                remaining.remove(test)
+    return [tasks[test] for test in tests]
+
+
+async def _run_concurrent(
+    suites: list[tuple[str, list[BaseTest]]],
+    failfast: bool,
+    concurrency: int,
+    output: _BufferingHandler,
+    report: RunReport | None,
+) -> bool:
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=concurrency))
+    tasks = _schedule([test for _, suite_tests in suites for test in suite_tests], concurrency)
+
+    # Report in list order, regardless of the order in which tests finish.
+    results = iter(tasks)
+    for i, (suite, suite_tests) in enumerate(suites):
+        _suite_header(suite, first=i == 0)
+        for test in suite_tests:
+            status, records, duration = await next(results)
+            _report(test, status, records, output)
+            if report is not None:
+                report.add_result(suite, test, status, duration)
+            if failfast and status == "failed":
+                for pending in tasks:
+                    pending.cancel()
+                return False
+
+    return True
+
+
+def _suite_header(suite: str, first: bool) -> None:
+    if not first:
+        print()
+    print(f"=== RUNNING {suite} TESTS ===")
+
+
+def run_suites(
+    suites: list[tuple[str, list[BaseTest]]],
+    failfast: bool = False,
+    concurrency: int = 1,
+    report: RunReport | None = None,
+    profiler: Profiler | None = None,
+) -> bool:
+    """Run every test in ``suites``, up to ``concurrency`` at a time.
+
+    With a concurrency above one, tests from all suites are scheduled as a
+    single dependency graph and start as soon as the tests they depend on have
+    finished. Output is always printed in list order; log records emitted
+    while a test runs concurrently are held back until that test is reported.
+    Each test's result is added to ``report``, if given.
+
+    With a ``profiler``, tests always run one at a time so that each
+    profile only covers the test it is named after.
+    """
+    if profiler is not None and concurrency > 1:
+        log.warning("Profiling; running tests one at a time")
+        concurrency = 1
+    if concurrency <= 1:
+        return _run_serial(suites, failfast, report, profiler)
+    with _buffered_logging() as output:
+        return asyncio.run(_run_concurrent(suites, failfast, concurrency, output, report))
@@ -4,43 +4,317 @@
 import http.server
 import json
 import logging
-import queue
 import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+from urllib.parse import urlparse
+
+from .activity import MARKER_RE
+from .auth import SignatureError
+from .inbox import ActivityIndex, Delivery
+from .peer import Peer
+from .signatures import KeyCache, SignatureVerifier
 
 log = logging.getLogger(__name__)
 
 
+class ServerLimits:  # pylint: disable=too-few-public-methods
+    """Capacity of the local server.
+
+    ``workers`` connections are served at once; further connections wait in
+    the listen ``backlog``. Keep-alive connections idle for ``idle_timeout``
+    seconds are closed to free their worker.
+    """
+
+    def __init__(
+        self,
+        workers: int = 32,
+        backlog: int = 128,
+        max_body_bytes: int = 1024 * 1024,
+        idle_timeout: float = 5.0,
+    ) -> None:
+        self.workers = workers
+        self.backlog = backlog
+        self.max_body_bytes = max_body_bytes
+        self.idle_timeout = idle_timeout
+
+
+class FailureProfile:  # pylint: disable=too-few-public-methods
+    """How the local server fails the first ``failures`` attempts to deliver
+    an activity.
+
+    ``mode`` is "status" (answer ``status``, with Retry-After if
+    ``retry_after`` is set), "drop" (close the connection without an
+    answer) or "delay" (answer normally after ``delay`` seconds).
+    """
+
+    MODES = ("status", "drop", "delay")
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        mode: str = "status",
+        failures: int = 3,
+        status: int = 503,
+        retry_after: float | None = None,
+        delay: float = 30.0,
+    ) -> None:
+        if mode not in self.MODES:
+            raise ValueError(f"Unknown failure mode {mode!r}")
+        self.mode = mode
+        self.failures = failures
+        self.status = status
+        self.retry_after = retry_after
+        self.delay = delay
+
+
+class _InboxHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        self.timeout = self.server.limits.idle_timeout
+        super().setup()
+
+    def _respond(self, status: int, headers: dict | None = None) -> None:
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_GET(self):
+        doc = self.server.serve(self.path)
+        if doc is None:
+            self._respond(404)
+            return
+        body = json.dumps(doc).encode("utf-8")
+        webfinger = self.path.startswith("/.well-known/webfinger")
+        self.send_response(200)
+        self.send_header(
+            "Content-Type", "application/jrd+json" if webfinger else "application/activity+json"
+        )
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        received = time.monotonic()
+        try:
+            length = int(self.headers["Content-Length"])
+        except (TypeError, ValueError):
+            self.close_connection = True
+            self._respond(411)
+            return
+        if length > self.server.limits.max_body_bytes:
+            # Don't read the body; the connection can't be reused
+            self.close_connection = True
+            self._respond(413)
+            return
+        body = self.rfile.read(length)
+        response = self.server.receive(self.path, self.headers, body, received)
+        if response is None:
+            # Drop the connection without answering
+            self.close_connection = True
+            return
+        self._respond(*response)
+
+    def log_request(self, code="-", size="-"):
+        if log.isEnabledFor(logging.DEBUG):
+            super().log_request(code, size)
+
+    def log_message(self, fmt, *args):  # pylint: disable=arguments-differ
+        log.debug("InboxServer: " + fmt, *args)
+
+
+class _PooledHTTPServer(http.server.HTTPServer):
+    """HTTPServer that serves each connection on a bounded pool of threads.
+
+    A connection is only accepted once a worker is free to serve it, so
+    under load further connections wait in the listen backlog.
+    """
+
+    def __init__(self, address, limits: ServerLimits, receive, serve) -> None:
+        self.limits = limits
+        self.receive = receive
+        self.serve = serve
+        self.request_queue_size = limits.backlog
+        self._pool = ThreadPoolExecutor(limits.workers, thread_name_prefix="inbox")
+        self._slots = threading.Semaphore(limits.workers)
+        self._closing = False
+        super().__init__(address, _InboxHandler)
+
+    def get_request(self):
+        while not self._slots.acquire(timeout=0.5):  # pylint: disable=consider-using-with
+            if self._closing:
+                raise OSError("server is shutting down")
+        try:
+            return super().get_request()
+        except OSError:
+            self._slots.release()
+            raise
+
+    def process_request(self, request, client_address):
+        try:
+            self._pool.submit(self._process, request, client_address)
+        except RuntimeError:
+            # The pool is shut down
+            self._slots.release()
+            raise
+
+    def _process(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:  # pylint: disable=broad-exception-caught
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self._slots.release()
+
+    def shutdown(self):
+        self._closing = True
+        super().shutdown()
+
+    def server_close(self):
+        super().server_close()
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
 class InboxServer:
-    def __init__(self, port: int = 0, public_url: str | None = None, auth=None) -> None:
+    """Local server that receives deliveries from the server under test.
+
+    Deliveries must carry a valid HTTP Signature and Digest unless
+    ``verify_signatures`` is off; the signer's keys are fetched with
+    ``auth`` and kept for ``key_ttl`` seconds. Deliveries to ``public_url``
+    are checked against its path, whatever local path a reverse proxy
+    forwards them to. With a ``peer``, the server also hosts that peer's
+    synthetic actors.
+    """
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        port: int = 0,
+        public_url: str | None = None,
+        auth=None,
+        limits: ServerLimits | None = None,
+        *,
+        verify_signatures: bool = True,
+        key_ttl: float = 3600.0,
+        peer: Peer | None = None,
+    ) -> None:
         self._port = port
         self._public_url = public_url
         self._auth = auth
-        self._queue: queue.Queue = queue.Queue()
+        self.limits = limits or ServerLimits()
+        self.peer = peer
+        # (time.monotonic(), path) of every GET served
+        self.fetches: list[tuple[float, str]] = []
+        self._fetches_lock = threading.Lock()
+        if peer is not None:
+            peer.base_url = self.base_url
+        self.verifier = None
+        if verify_signatures:
+            self.verifier = SignatureVerifier(KeyCache(auth, ttl=key_ttl))
+        self.received = ActivityIndex()
+        # Failure profiles by correlation marker, and the arrival times of
+        # every attempt to deliver those activities
+        self._faults: dict[str, FailureProfile] = {}
+        self._attempts: dict[str, list[float]] = {}
+        self._faults_lock = threading.Lock()
+        # Sequence number of the last delivery returned by wait_for_activity()
+        self._cursor = -1
+        self._cursor_lock = threading.Lock()
         self._httpd: http.server.HTTPServer | None = None
         self._thread: threading.Thread | None = None
 
+    def inject_failures(self, marker: str, profile: FailureProfile) -> None:
+        """Fail deliveries of the activity carrying ``marker`` as ``profile`` says."""
+        with self._faults_lock:
+            self._faults[marker] = profile
+            self._attempts[marker] = []
+
+    def attempts(self, marker: str) -> list[float]:
+        """time.monotonic() of each attempt to deliver an activity with failures injected."""
+        with self._faults_lock:
+            return list(self._attempts.get(marker, ()))
+
+    def _fault(self, text: str, received: float) -> FailureProfile | None:
+        with self._faults_lock:
+            for marker in MARKER_RE.findall(text):
+                profile = self._faults.get(marker)
+                if profile is not None:
+                    self._attempts[marker].append(received)
+                    return profile if len(self._attempts[marker]) <= profile.failures else None
+        return None
+
+    def _receive(self, path: str, headers, body: bytes, received: float):
+        """Handle a delivery; returns the response status and headers, or
+        None to drop the connection."""
+        text = body.decode("utf-8", "replace")
+        fault = self._fault(text, received) if self._faults else None
+        if fault is not None and fault.mode == "drop":
+            return None
+        if fault is not None and fault.mode == "status":
+            retry = {"Retry-After": f"{fault.retry_after:.0f}"} if fault.retry_after else {}
+            return fault.status, retry
+        if fault is not None:
+            time.sleep(fault.delay)
+        return self._accept(path, headers, body, text, received), {}
+
+    def _accept(self, path: str, headers, body: bytes, text: str, received: float) -> int:
+        if self.verifier is not None:
+            try:
+                self.verifier.verify("POST", self._signed_path(path), headers, body)
+            except SignatureError as exc:
+                log.warning("Rejecting delivery to %s: %s", path, exc)
+                return 401
+        try:
+            activity = json.loads(body)
+        except json.JSONDecodeError:
+            return 400
+        if not isinstance(activity, dict):
+            return 400
+        self.received.add(activity, received, text, inbox=path)
+        if self.peer is not None:
+            self.peer.deliver(path, activity)
+            stall = self.peer.stall(path)
+            if stall:
+                # Hold the sender's connection like an overloaded server would
+                time.sleep(stall)
+        return 202
+
+    def _signed_path(self, path: str) -> str:
+        """The path senders put in (request-target) for a delivery to ``path``."""
+        if not self._public_url or (self.peer is not None and self.peer.is_inbox(path)):
+            return path
+        return urlparse(self._public_url).path or "/"
+
+    def _serve(self, path: str) -> dict | None:
+        log.debug("InboxServer: GET %s", path)
+        with self._fetches_lock:
+            self.fetches.append((time.monotonic(), path))
+        return self.peer.document(path) if self.peer is not None else None
+
+    def fetch_count(self, iri: str, since: float = 0.0) -> int:
+        """Number of GETs of the document at ``iri`` served at or after ``since``.
+
+        Fragments are never sent, so a keyId counts fetches of its actor.
+        """
+        path = urlparse(iri).path
+        with self._fetches_lock:
+            return sum(
+                1
+                for at, fetched in self.fetches
+                if at >= since and urlparse(fetched).path == path
+            )
+
     def start(self) -> None:
-        activity_queue = self._queue
-
-        class Handler(http.server.BaseHTTPRequestHandler):
-            def do_POST(self):
-                length = int(self.headers.get("Content-Length", 0))
-                body = self.rfile.read(length)
-                try:
-                    activity = json.loads(body)
-                except json.JSONDecodeError:
-                    self.send_response(400)
-                    self.end_headers()
-                    return
-                activity_queue.put(activity)
-                self.send_response(202)
-                self.end_headers()
-
-            def log_message(self, fmt, *args):  # pylint: disable=arguments-differ
-                log.debug("InboxServer: " + fmt, *args)
-
-        self._httpd = http.server.HTTPServer(("", self._port), Handler)
+        self._httpd = _PooledHTTPServer(
+            ("", self._port), self.limits, self._receive, self._serve
+        )
         self._port = self._httpd.socket.getsockname()[1]
+        if self.peer is not None:
+            self.peer.base_url = self.base_url
         self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
         self._thread.start()
         log.info("InboxServer started on port %d", self._port)
@@ -50,8 +324,11 @@ class InboxServer:
             self._httpd.shutdown()
             if self._thread:
                 self._thread.join(timeout=5.0)
+            self._httpd.server_close()
             self._httpd = None
             self._thread = None
+        if self.peer is not None:
+            self.peer.close()
 
     def __enter__(self):
         self.start()
@@ -60,12 +337,38 @@ class InboxServer:
     def __exit__(self, *_):
         self.stop()
 
+    @property
+    def base_url(self) -> str:
+        """Origin the server is reachable at, e.g. for actor IDs."""
+        if self._public_url:
+            parsed = urlparse(self._public_url)
+            return f"{parsed.scheme}://{parsed.netloc}"
+        return f"http://localhost:{self._port}"
+
     @property
     def inbox_url(self) -> str:
         return self._public_url or f"http://localhost:{self._port}/inbox"
 
+    def wait_for(
+        self,
+        match: dict | Callable[[dict], bool],
+        timeout: float = 30.0,
+        since: float = 0.0,
+    ) -> Delivery | None:
+        """Wait for a delivery matching a spec or predicate; see ActivityIndex.wait_for."""
+        return self.received.wait_for(match, timeout, since)
+
     def wait_for_activity(self, timeout: float = 30.0) -> dict | None:
-        try:
-            return self._queue.get(timeout=timeout)
-        except queue.Empty:
-            return None
+        """Return the next delivery not yet returned by this method, in arrival order."""
+        with self._cursor_lock:
+            delivery = self.received.next_after(self._cursor, timeout)
+            if delivery is None:
+                return None
+            self._cursor = delivery.seq
+            return delivery.activity
+
+    def wait_for_marker(self, marker: str, timeout: float = 30.0) -> float | None:
+        """Return the time.monotonic() at which an activity carrying ``marker``
+        arrived, waiting up to ``timeout`` seconds for it."""
+        delivery = self.received.wait_for({"marker": marker}, timeout)
+        return delivery.received if delivery is not None else None
@@ -0,0 +1,149 @@
+# Copyright (c) 2023 Pat Long
+# SPDX-License-Identifier: MIT
+
+import logging
+import threading
+import time
+from concurrent.futures import Future
+
+import requests
+from cryptography.hazmat.primitives import serialization
+
+from . import transport
+from .auth import (
+    BaseAuth,
+    SignatureError,
+    SignatureMismatch,
+    parse_signature,
+    verify_digest,
+    verify_signature,
+)
+from .metrics import summarize
+
+log = logging.getLogger(__name__)
+
+
+def _find_key(doc: dict, key_id: str) -> str:
+    """PEM of ``key_id`` in an actor document or a standalone key document."""
+    if "publicKeyPem" in doc:
+        return doc["publicKeyPem"]
+    keys = doc.get("publicKey")
+    keys = keys if isinstance(keys, list) else [keys]
+    keys = [key for key in keys if isinstance(key, dict) and "publicKeyPem" in key]
+    if not keys:
+        raise SignatureError(f"no public key found at {key_id}")
+    return next((key for key in keys if key.get("id") == key_id), keys[0])["publicKeyPem"]
+
+
+class KeyCache:  # pylint: disable=too-few-public-methods
+    """Parsed public keys by keyId, kept for ``ttl`` seconds.
+
+    Concurrent lookups of the same keyId share a single fetch. A key that
+    failed to verify a signature may be refetched to pick up key rotation,
+    but at most once every ``refetch_interval`` seconds, so a burst of bad
+    signatures does not refetch the actor for every message.
+    """
+
+    def __init__(
+        self,
+        auth: BaseAuth | None = None,
+        ttl: float = 3600.0,
+        refetch_interval: float = 30.0,
+    ) -> None:
+        self.auth = auth
+        self.ttl = ttl
+        self.refetch_interval = refetch_interval
+        self._lock = threading.Lock()
+        # keyId -> (public key, fetched at)
+        self._keys: dict[str, tuple[object, float]] = {}
+        self._inflight: dict[str, Future] = {}
+        self.stats = {"hits": 0, "fetches": 0, "shared": 0}
+
+    def _fetch(self, key_id: str):
+        doc = transport.get(key_id.split("#", 1)[0], auth=self.auth, fresh=True)
+        pem = _find_key(doc, key_id)
+        try:
+            return serialization.load_pem_public_key(pem.encode())
+        except ValueError as exc:
+            raise SignatureError(f"unreadable public key {key_id}") from exc
+
+    def get(self, key_id: str, refetch: bool = False):
+        """Public key for ``key_id``; ``refetch`` asks for a newer copy."""
+        now = time.monotonic()
+        with self._lock:
+            cached = self._keys.get(key_id)
+            if cached is not None:
+                age = now - cached[1]
+                if age < self.ttl and not (refetch and age >= self.refetch_interval):
+                    self.stats["hits"] += 1
+                    return cached[0]
+            flight = self._inflight.get(key_id)
+            leading = flight is None
+            if leading:
+                flight = self._inflight[key_id] = Future()
+                self.stats["fetches"] += 1
+            else:
+                self.stats["shared"] += 1
+        if not leading:
+            return flight.result()
+
+        try:
+            key = self._fetch(key_id)
+            with self._lock:
+                self._keys[key_id] = (key, time.monotonic())
+            flight.set_result(key)
+            return key
+        except Exception as exc:  # pylint: disable=broad-exception-caught
+            flight.set_exception(exc)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key_id)
+
+
+class SignatureVerifier:
+    """Verifies the Digest and HTTP Signature of inbound deliveries."""
+
+    def __init__(self, keys: KeyCache) -> None:
+        self.keys = keys
+        self._lock = threading.Lock()
+        self.durations: list[float] = []
+        self.rejected = 0
+
+    def _verify(self, method: str, path: str, headers, body: bytes) -> str:
+        params = parse_signature(headers.get("Signature"))
+        if body:
+            verify_digest(headers, body)
+        key_id = params["keyid"]
+        try:
+            verify_signature(method, path, headers, params, self.keys.get(key_id))
+        except SignatureMismatch:
+            # The sender may have rotated its key since we fetched it
+            verify_signature(method, path, headers, params, self.keys.get(key_id, refetch=True))
+        return key_id
+
+    def verify(self, method: str, path: str, headers, body: bytes) -> str:
+        """Return the keyId that signed the request; raises SignatureError."""
+        start = time.perf_counter()
+        try:
+            return self._verify(method, path, headers, body)
+        except requests.RequestException as exc:
+            with self._lock:
+                self.rejected += 1
+            raise SignatureError(f"failed to fetch signing key: {exc}") from exc
+        except SignatureError:
+            with self._lock:
+                self.rejected += 1
+            raise
+        finally:
+            with self._lock:
+                self.durations.append(time.perf_counter() - start)
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            return {
+                "verified": len(self.durations) - self.rejected,
+                "rejected": self.rejected,
+                "duration": summarize(self.durations),
+                "keys": dict(self.keys.stats),
+            }
@@ -0,0 +1,139 @@
+# Copyright (c) 2023 Pat Long
+# SPDX-License-Identifier: MIT
+
+import json
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+from . import transport
+from .auth import BaseAuth
+
+log = logging.getLogger(__name__)
+
+
+class ObjectStore:
+    """In-run map of IRI to parsed document.
+
+    Documents are kept in least-recently-used order and evicted once their
+    serialized size exceeds ``max_bytes``. Concurrent requests for the same
+    document share a single fetch. Returned documents are shared between
+    callers and must be treated as read-only.
+    """
+
+    def __init__(self, max_bytes: int = 32 * 1024 * 1024) -> None:
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[tuple, tuple[dict, int]] = OrderedDict()
+        self._keys_by_iri: dict[str, set[tuple]] = {}
+        self._inflight: dict[tuple, Future] = {}
+        # Bumped by invalidate(), so fetches started earlier aren't stored
+        self._generations: dict[str, int] = {}
+        self.stats = {"hits": 0, "misses": 0, "shared": 0, "evictions": 0}
+
+    @staticmethod
+    def _key(iri: str, with_profile: bool, auth: BaseAuth | None) -> tuple:
+        return (iri, with_profile, auth.identity if auth is not None else "")
+
+    def get(
+        self,
+        iri: str,
+        with_profile: bool = False,
+        auth: BaseAuth | None = None,
+        fresh: bool = False,
+    ) -> dict:
+        """Return the document at ``iri``, fetching it at most once at a time.
+
+        ``fresh=True`` skips the stored copy (and the HTTP cache) and replaces
+        it with the server's current document.
+        """
+        key = self._key(iri, with_profile, auth)
+        with self._lock:
+            if not fresh and key in self._entries:
+                self._entries.move_to_end(key)
+                self.stats["hits"] += 1
+                return self._entries[key][0]
+            inflight = None if fresh else self._inflight.get(key)
+            generation = self._generations.get(iri, 0)
+            if inflight is None:
+                leader = Future()
+                if not fresh:
+                    self._inflight[key] = leader
+                self.stats["misses"] += 1
+            else:
+                self.stats["shared"] += 1
+
+        if inflight is not None:
+            return inflight.result()
+
+        try:
+            doc = transport.get(iri, with_profile, auth, fresh=fresh)
+        except BaseException as exc:
+            with self._lock:
+                self._finish(key, leader)
+            leader.set_exception(exc)
+            raise
+        self._put(key, doc, leader, generation)
+        leader.set_result(doc)
+        return doc
+
+    def _finish(self, key: tuple, leader: Future) -> None:
+        if self._inflight.get(key) is leader:
+            del self._inflight[key]
+
+    def _put(self, key: tuple, doc: dict, leader: Future, generation: int) -> None:
+        """Store a fetched document, unless its IRI was invalidated since the
+        fetch started, and end the fetch."""
+        size = len(json.dumps(doc))
+        with self._lock:
+            self._finish(key, leader)
+            if self._generations.get(key[0], 0) != generation:
+                return
+            self._drop(key)
+            if size > self.max_bytes:
+                return
+            self._entries[key] = (doc, size)
+            self._keys_by_iri.setdefault(key[0], set()).add(key)
+            self.size += size
+            while self.size > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._drop(oldest)
+                self.stats["evictions"] += 1
+
+    def _drop(self, key: tuple) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        self.size -= entry[1]
+        keys = self._keys_by_iri.get(key[0])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._keys_by_iri[key[0]]
+
+    def invalidate(self, *iris: str | None) -> None:
+        """Forget every stored copy of ``iris``, whatever profile or credentials.
+
+        Fetches of ``iris`` already in flight still return their documents to
+        the callers waiting on them, but don't store them.
+        """
+        with self._lock:
+            for iri in iris:
+                if iri is None:
+                    continue
+                self._generations[iri] = self._generations.get(iri, 0) + 1
+                # Later callers start a new fetch instead of sharing the old one
+                for key in [key for key in self._inflight if key[0] == iri]:
+                    del self._inflight[key]
+                for key in list(self._keys_by_iri.get(iri, ())):
+                    self._drop(key)
+
+    def __contains__(self, iri: str) -> bool:
+        with self._lock:
+            return iri in self._keys_by_iri
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
@@ -1,71 +1,127 @@
 # Copyright (c) 2023 Pat Long
 # SPDX-License-Identifier: MIT
 
+import asyncio
 import json
 import logging
 
 import requests
 
+from .collection import CollectionCrawler, CrawlLimits, PollBackoff, wait_until_visible
 from .helper import TestContext
 from . import transport
 
 log = logging.getLogger(__name__)
 
-AS_PUBLIC = "https://www.w3.org/ns/activitystreams#Public"
-
-
-def find_in_collection(iri: str, target_id: str) -> bool:
-    """Return True if target_id appears anywhere in a (possibly paginated) AP collection."""
-    visited = set()
-    current = iri
-    while current and current not in visited:
-        visited.add(current)
-        try:
-            col = transport.get(current)
-        except requests.HTTPError:
-            return False
-        items = col.get("orderedItems") or col.get("items") or []
-        for item in items:
-            item_id = item.get("id") if isinstance(item, dict) else item
-            if item_id == target_id:
-                return True
-        current = col.get("next")
-    return False
+# Activities whose delivery changes followers/following membership
+FOLLOW_STATE_TYPES = ("Follow", "Accept", "Reject", "Undo", "Block")
 
 
 class BaseTest:
+    # Context fields this test fills in and reads, and tests that must run first.
+    # The runner orders tests by these when running them concurrently.
+    produces: tuple[str, ...] = ()
+    consumes: tuple[str, ...] = ()
+    depends_on: tuple[type["BaseTest"], ...] = ()
+
     def __init__(self, ctx: TestContext) -> None:
         self.ctx = ctx
+        # Measurements reported alongside the test's result, by name
+        self.metrics: dict[str, int | float | str | list | dict] = {}
+        # Why skip() returned True, if it said
+        self.skip_reason: str | None = None
+        self._crawlers: list[CollectionCrawler] = []
 
     def skip(self) -> bool:
         return False
 
+    def crawl_time(self) -> float:
+        """Seconds spent fetching collection pages through _crawl()."""
+        return sum(crawler.elapsed for crawler in self._crawlers)
+
+    def _skip(self, reason: str) -> bool:
+        """Log why the test is skipped and keep the reason for the report."""
+        self.skip_reason = reason
+        logging.getLogger(type(self).__module__).info("Skipping; %s", reason)
+        return True
+
     def run(self) -> bool:
         raise NotImplementedError
 
+    async def arun(self) -> bool:
+        """Async flavour of run(); defaults to running run() in a worker thread."""
+        return await asyncio.to_thread(self.run)
+
+    def _get(self, iri: str, with_profile: bool = False, auth=None, fresh: bool = False):
+        """Dereference ``iri`` through the run's object store."""
+        return self.ctx.db.get(iri, with_profile, auth, fresh=fresh)
+
+    def _crawl(self, iri: str, auth=None, max_pages: int | None = None) -> CollectionCrawler:
+        """Stream the current items of a collection, within the run's crawl limits."""
+        limits = self.ctx.crawl_limits
+        if max_pages is not None:
+            limits = CrawlLimits(max_pages, limits.max_items, limits.timeout)
+        crawler = CollectionCrawler(
+            iri, lambda url: transport.get(url, auth=auth, fresh=True), limits
+        )
+        self._crawlers.append(crawler)
+        return crawler
+
+    def _wait_visible(
+        self,
+        iri: str,
+        target_id: str,
+        backoff: PollBackoff | None = None,
+        max_pages: int | None = None,
+    ) -> float | None:
+        """Seconds until ``target_id`` shows up in the collection at ``iri``,
+        polling with backoff; None if it never does."""
+        crawler = self._crawl(iri, auth=self.ctx.auth, max_pages=max_pages)
+        return wait_until_visible(iri, target_id, crawler.fetch, crawler.limits, backoff)
+
+    def _post(self, iri: str, activity: dict, auth=None):
+        """POST ``activity`` and forget stored documents it may have changed."""
+        result = transport.post(iri, activity, auth=auth)
+        obj = activity.get("object")
+        self.ctx.db.invalidate(
+            iri,
+            activity.get("id"),
+            obj.get("id") if isinstance(obj, dict) else obj,
+        )
+        if activity.get("type") in FOLLOW_STATE_TYPES:
+            self.ctx.collections.invalidate(self.ctx.followers_id, self.ctx.following_id)
+        return result
+
+    def _in_collection(self, iri: str, member_id: str) -> bool | None:
+        """Membership check answered from the run's shared collection index;
+        None if the collection is too large to tell."""
+        try:
+            return self.ctx.collections.contains(iri, member_id)
+        except requests.HTTPError as exc:
+            log.error("Failed to crawl collection %s: %s", iri, exc)
+            return False
+
 
 class FederationTest(BaseTest):  # pylint: disable=abstract-method
     """Skips if local_actor_id or auth not configured."""
 
     def skip(self) -> bool:
         if not self.ctx.local_actor_id:
-            log.info("Skipping; local_actor_id not configured")
-            return True
+            return self._skip("local_actor_id not configured")
         if not self.ctx.auth:
-            log.info("Skipping; auth not configured")
-            return True
+            return self._skip("auth not configured")
         return False
 
     def _get_actor(self) -> dict | None:
         try:
-            return transport.get(self.ctx.local_actor_id, auth=self.ctx.auth)
+            return self._get(self.ctx.local_actor_id, auth=self.ctx.auth)
         except requests.HTTPError as exc:
             log.error("Failed to fetch local actor: %s", exc)
             return None
 
     def _post_activity(self, outbox_url: str, activity: dict) -> dict | None:
         try:
-            return transport.post(outbox_url, activity, auth=self.ctx.auth)
+            return self._post(outbox_url, activity, auth=self.ctx.auth)
         except requests.HTTPError as exc:
             log.error("POST to outbox failed: %s", exc)
             return None
@@ -78,8 +134,7 @@ class ServerRequiredTest(FederationTest):  # pylint: disable=abstract-method
         if super().skip():
             return True
         if not self.ctx.has_local_server:
-            log.info("Skipping; local_server not configured")
-            return True
+            return self._skip("local_server not configured")
         return False
 
 
@@ -88,12 +143,14 @@ class ActorTest(BaseTest):
 
     Side effects:
     - Adds remote actor to the local database
+    - Selects object_id/invalid_object_id from the outbox if not configured
     """
 
+    produces = ("object_id", "invalid_object_id")
+
     def skip(self) -> bool:
         if not self.ctx.actor_id:
-            log.info("Skipping; Actor ID not configured")
-            return True
+            return self._skip("Actor ID not configured")
         return False
 
     def _maybe_select_object(self, outboxItems: list[dict]):
@@ -117,7 +174,7 @@ class ActorTest(BaseTest):
             "referenced page type"
         )
         try:
-            outbox_page = transport.get(outbox_page_iri)
+            outbox_page = self._get(outbox_page_iri)
         except requests.HTTPError:
             log.error("Failed to get actor outbox page %s", outbox_page_iri)
             return False
@@ -136,7 +193,7 @@ class ActorTest(BaseTest):
     def _check_outbox(self, outbox_iri: str) -> bool:
         try:
             log.info("Dereference Actor outbox")
-            outbox = transport.get(outbox_iri)
+            outbox = self._get(outbox_iri)
         except requests.HTTPError:
             log.error("Failed to get actor outbox %s", outbox_iri)
             return False
@@ -161,7 +218,7 @@ class ActorTest(BaseTest):
     def run(self) -> bool:
         try:
             log.info("Dereference Actor")
-            actor = transport.get(self.ctx.actor_id)
+            actor = self._get(self.ctx.actor_id)
         except requests.HTTPError:
             log.error("Failed to get actor %s", self.ctx.actor_id)
             return False
@@ -174,23 +231,24 @@ class ActorTest(BaseTest):
 
 
 class ObjectTest(BaseTest):
+    consumes = ("object_id",)
+
     def skip(self) -> bool:
         if not self.ctx.object_id:
-            log.info("Skipping; Object ID not configured")
-            return True
+            return self._skip("Object ID not configured")
         return False
 
     def run(self) -> bool:
         try:
             log.info("Dereference object (accept=activity+json)")
-            transport.get(self.ctx.object_id)
+            self._get(self.ctx.object_id)
         except requests.HTTPError as e:
             log.error("Get with activity+json failed: %s", e)
             return False
 
         try:
             log.info("Dereference object (accept=ld+json, profile specified)")
-            transport.get(self.ctx.object_id, True)
+            self._get(self.ctx.object_id, True)
         except requests.HTTPError as e:
             log.error("Get with ld+json profile failed: %s", e)
             return False
@@ -203,14 +261,13 @@ class InboxTest(BaseTest):
 
     def skip(self) -> bool:
         if not self.ctx.actor_id:
-            log.info("Skipping; Actor ID not configured")
-            return True
+            return self._skip("Actor ID not configured")
         return False
 
     def run(self) -> bool:
         try:
             log.info("Dereference Actor for inbox IRI")
-            actor = transport.get(self.ctx.actor_id)
+            actor = self._get(self.ctx.actor_id)
         except requests.HTTPError:
             log.error("Failed to get actor %s", self.ctx.actor_id)
             return False
@@ -222,7 +279,7 @@ class InboxTest(BaseTest):
 
         try:
             log.info("Dereference Actor inbox")
-            inbox = transport.get(inbox_iri)
+            inbox = self._get(inbox_iri)
         except requests.HTTPError:
             log.error("Failed to dereference actor inbox %s", inbox_iri)
             return False
@@ -238,8 +295,7 @@ class InboxTest(BaseTest):
 class DeletedObject(BaseTest):
     def skip(self) -> bool:
         if not self.ctx.deleted_object_id:
-            log.info("Skipping; Deleted Object ID not configured")
-            return True
+            return self._skip("Deleted Object ID not configured")
         return False
 
     def run(self) -> bool:
@@ -250,7 +306,7 @@ class DeletedObject(BaseTest):
         )
         try:
             log.info("Dereference deleted object")
-            transport.get(self.ctx.deleted_object_id)
+            self._get(self.ctx.deleted_object_id)
             log.error(
                 "Successfully fetched the object. "
                 "Are you sure you specified the correct object id?"
@@ -279,16 +335,17 @@ class DeletedObject(BaseTest):
 
 
 class InvalidObject(BaseTest):
+    consumes = ("invalid_object_id",)
+
     def skip(self) -> bool:
         if not self.ctx.invalid_object_id:
-            log.info("Skipping; Invalid Object ID not configured")
-            return True
+            return self._skip("Invalid Object ID not configured")
         return False
 
     def run(self) -> bool:
         try:
             log.info("Dereference invalid object")
-            transport.get(self.ctx.invalid_object_id)
+            self._get(self.ctx.invalid_object_id)
             log.error(
                 "Successfully fetched the object. "
                 "Are you sure you specified the correct object id?"
@@ -310,8 +367,7 @@ class InvalidObject(BaseTest):
 class PrivateObject(BaseTest):
     def skip(self) -> bool:
         if not self.ctx.private_object_id:
-            log.info("Skipping; Private Object ID not configured")
-            return True
+            return self._skip("Private Object ID not configured")
         return False
 
     def run(self) -> bool:
@@ -322,7 +378,7 @@ class PrivateObject(BaseTest):
         )
         try:
             log.info("Dereference private object")
-            transport.get(self.ctx.private_object_id)
+            self._get(self.ctx.private_object_id)
             log.error(
                 "Successfully fetched the object. "
                 "Are you sure you specified the correct object id?"
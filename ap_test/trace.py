@@ -0,0 +1,217 @@
+# Copyright (c) 2023 Pat Long
+# SPDX-License-Identifier: MIT
+
+import contextvars
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+log = logging.getLogger(__name__)
+
+# Name of the test running in the current task/thread, if any
+current_test: contextvars.ContextVar[str | None] = contextvars.ContextVar(
+    "ap_test_current_test", default=None
+)
+
+# Phases of an exchange, in the order they happen
+PHASES = ("sign", "throttle", "dns", "connect", "tls", "ttfb")
+
+
+class Exchange:  # pylint: disable=too-few-public-methods
+    """Timings of one HTTP request/response.
+
+    Phases are (start, end) pairs of time.perf_counter(); a phase that did
+    not happen, such as connecting on a reused connection, is absent.
+    """
+
+    def __init__(self, method: str, url: str, attempt: int) -> None:
+        self.test = current_test.get() or threading.current_thread().name
+        self.method = method
+        self.url = url
+        self.attempt = attempt
+        self.timestamp = time.time()
+        self.start = time.perf_counter()
+        self.end = self.start
+        self.phases: dict[str, tuple[float, float]] = {}
+        self.status: int | None = None
+        self.bytes_out = 0
+        self.bytes_in = 0
+        self.error: str | None = None
+
+    def as_dict(self) -> dict:
+        """JSON-lines record; durations are in seconds."""
+        record = {
+            "test": self.test,
+            "method": self.method,
+            "url": self.url,
+            "attempt": self.attempt,
+            "timestamp": self.timestamp,
+            "status": self.status,
+            "bytes_out": self.bytes_out,
+            "bytes_in": self.bytes_in,
+        }
+        for phase in PHASES:
+            start, end = self.phases.get(phase, (None, None))
+            record[phase] = None if start is None else end - start
+        record["total"] = self.end - self.start
+        if self.error:
+            record["error"] = self.error
+        return record
+
+
+class Tracer:
+    """Streams exchanges to a JSON-lines file and/or a Chrome trace-event file.
+
+    The trace-event file can be opened in chrome://tracing or Perfetto; each
+    request is a slice on the thread that sent it, with its phases nested
+    inside.
+    """
+
+    def __init__(self, jsonl_path: str | None = None, chrome_path: str | None = None) -> None:
+        self._lock = threading.Lock()
+        # pylint: disable=consider-using-with
+        self._jsonl = open(jsonl_path, "w", encoding="utf-8") if jsonl_path else None
+        self._chrome = open(chrome_path, "w", encoding="utf-8") if chrome_path else None
+        self._threads: set[int] = set()
+        if self._chrome is not None:
+            self._chrome.write("[\n")
+
+    def _chrome_events(self, exchange: Exchange) -> list[dict]:
+        tid = threading.get_ident()
+        events = []
+        if tid not in self._threads:
+            self._threads.add(tid)
+            events.append(
+                {
+                    "ph": "M",
+                    "name": "thread_name",
+                    "pid": 1,
+                    "tid": tid,
+                    "args": {"name": threading.current_thread().name},
+                }
+            )
+        slices = [(f"{exchange.method} {exchange.url}", exchange.start, exchange.end)]
+        slices += [(phase, *exchange.phases[phase]) for phase in PHASES if phase in exchange.phases]
+        for name, start, end in slices:
+            events.append(
+                {
+                    "ph": "X",
+                    "name": name,
+                    "cat": exchange.test,
+                    "pid": 1,
+                    "tid": tid,
+                    "ts": start * 1e6,
+                    "dur": (end - start) * 1e6,
+                }
+            )
+        events[-len(slices)]["args"] = exchange.as_dict()
+        return events
+
+    def record(self, exchange: Exchange) -> None:
+        with self._lock:
+            if self._jsonl is not None:
+                self._jsonl.write(json.dumps(exchange.as_dict()) + "\n")
+            if self._chrome is not None:
+                for event in self._chrome_events(exchange):
+                    self._chrome.write(json.dumps(event) + ",\n")
+
+    def close(self) -> None:
+        with self._lock:
+            if self._jsonl is not None:
+                self._jsonl.close()
+            if self._chrome is not None:
+                # Every event is followed by a comma, so end with one more
+                # to keep the array valid JSON
+                process = {"ph": "M", "name": "process_name", "pid": 1, "args": {"name": "ap-test"}}
+                self._chrome.write(json.dumps(process) + "\n]\n")
+                self._chrome.close()
+
+
+# Receivers of every finished exchange: the Tracer, if tracing to files,
+# and anything else registered with add_sink()
+_sinks: list = []
+_tracer: Tracer | None = None
+_local = threading.local()
+
+
+def bind(fn):
+    """Wrap ``fn`` to run in a copy of the caller's context, so exchanges
+    made on pool threads are attributed to the caller's test."""
+    context = contextvars.copy_context()
+    return lambda *args: context.copy().run(fn, *args)
+
+
+def add_sink(sink) -> None:
+    """Pass every exchange from now on to ``sink.record()``."""
+    _sinks.append(sink)
+
+
+def remove_sink(sink) -> None:
+    if sink in _sinks:
+        _sinks.remove(sink)
+
+
+def enable(jsonl_path: str | None = None, chrome_path: str | None = None) -> None:
+    """Trace every HTTP exchange made through transport to files from now on."""
+    global _tracer  # pylint: disable=global-statement
+    disable()
+    _tracer = Tracer(jsonl_path, chrome_path)
+    add_sink(_tracer)
+
+
+def disable() -> None:
+    global _tracer  # pylint: disable=global-statement
+    if _tracer is not None:
+        remove_sink(_tracer)
+        _tracer.close()
+        _tracer = None
+
+
+def active() -> bool:
+    return bool(_sinks)
+
+
+@contextmanager
+def traced(method: str, url: str, attempt: int = 0):
+    """Trace the request sent within the block, if anything is listening."""
+    sinks = list(_sinks)
+    if not sinks:
+        yield None
+        return
+    current = Exchange(method, url, attempt)
+    outer = getattr(_local, "exchange", None)
+    _local.exchange = current
+    try:
+        yield current
+    except Exception as exc:
+        current.error = f"{type(exc).__name__}: {exc}"
+        raise
+    finally:
+        current.end = time.perf_counter()
+        _local.exchange = outer
+        for sink in sinks:
+            sink.record(current)
+
+
+def mark(phase: str, start: float, end: float) -> None:
+    """Record that ``phase`` of the current thread's exchange ran from
+    ``start`` to ``end`` (time.perf_counter())."""
+    current = getattr(_local, "exchange", None)
+    if current is not None:
+        current.phases[phase] = (start, end)
+
+
+def record_response(response) -> None:
+    """Record the status and sizes of a ``requests`` response."""
+    current = getattr(_local, "exchange", None)
+    if current is None:
+        return
+    current.status = response.status_code
+    current.bytes_in = len(response.content)
+    body = response.request.body
+    if isinstance(body, (bytes, str)):
+        current.bytes_out = len(body)
+    else:
+        current.bytes_out = int(response.request.headers.get("Content-Length") or 0)
@@ -1,20 +1,311 @@
 # Copyright (c) 2023 Pat Long
 # SPDX-License-Identifier: MIT
 
+import asyncio
+import base64
+import hashlib
+import io
 import json
 import logging
+import queue
+import socket
+import ssl
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
 from datetime import datetime, timezone
+from typing import BinaryIO
+from urllib.parse import urljoin, urlparse
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import ConnectTimeoutError, NameResolutionError, NewConnectionError
+from urllib3.util import connection
 
+from . import trace
 from .auth import BaseAuth
+from .cache import HttpCache
+from .ratelimit import RateLimiter
 
 log = logging.getLogger(__name__)
 
+# Request bodies larger than this are written to a temporary file while they
+# are encoded
+SPOOL_MAX_BYTES = 1024 * 1024
+
 PROFILE_TYPE = 'application/ld+json; profile="https://www.w3.org/ns/activitystreams"'
 ACTIVITY_TYPE = "application/activity+json"
 
 
+class TransportStats:
+    """Counters shared by every pooled session."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.connections = 0
+        self.tls_handshakes = 0
+        self.tls_resumed = 0
+
+    def incr(self, counter: str, value: int = 1) -> None:
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + value)
+
+    @property
+    def reused(self) -> int:
+        return max(self.requests - self.connections, 0)
+
+    def as_dict(self) -> dict[str, int]:
+        return {
+            "requests": self.requests,
+            "connections": self.connections,
+            "reused": self.reused,
+            "tls_handshakes": self.tls_handshakes,
+            "tls_resumed": self.tls_resumed,
+        }
+
+
+stats = TransportStats()
+
+
+class _ResumingSSLContext(ssl.SSLContext):
+    """SSLContext that offers the last TLS session seen for a host on reconnect."""
+
+    def __new__(cls, *args, **kwargs):
+        ctx = super().__new__(cls, ssl.PROTOCOL_TLS_CLIENT)
+        ctx.tls_sessions = {}
+        return ctx
+
+    def wrap_socket(self, sock, *args, server_hostname=None, session=None, **kwargs):
+        # pylint: disable=arguments-differ
+        session = session or self.tls_sessions.get(server_hostname)  # pylint: disable=no-member
+        return super().wrap_socket(
+            sock, *args, server_hostname=server_hostname, session=session, **kwargs
+        )
+
+
+class _TracedConnection:
+    """Reports DNS, connect and time-to-first-byte timings to the tracer.
+
+    While tracing, the host is resolved separately from connecting so the
+    two can be timed apart.
+    """
+
+    _connected_at = 0.0
+    _sent_at = 0.0
+
+    def _new_conn(self) -> socket.socket:
+        # pylint: disable=no-member
+        if not trace.active():
+            return super()._new_conn()
+        started = time.perf_counter()
+        try:
+            addresses = socket.getaddrinfo(self._dns_host, self.port, 0, socket.SOCK_STREAM)
+        except socket.gaierror as exc:
+            raise NameResolutionError(self.host, self, exc) from exc
+        resolved = time.perf_counter()
+        trace.mark("dns", started, resolved)
+        error: OSError | None = None
+        for *_, address in addresses:
+            try:
+                sock = connection.create_connection(
+                    address[:2],
+                    self.timeout,
+                    source_address=self.source_address,
+                    socket_options=self.socket_options,
+                )
+            except OSError as exc:
+                error = exc
+                continue
+            self._connected_at = time.perf_counter()
+            trace.mark("connect", resolved, self._connected_at)
+            return sock
+        if isinstance(error, TimeoutError):
+            raise ConnectTimeoutError(self, f"Connection to {self.host} timed out") from error
+        raise NewConnectionError(self, f"Failed to establish a new connection: {error}")
+
+    def request(self, *args, **kwargs):
+        super().request(*args, **kwargs)  # pylint: disable=no-member
+        self._sent_at = time.perf_counter()
+
+    def getresponse(self, *args, **kwargs):
+        response = super().getresponse(*args, **kwargs)  # pylint: disable=no-member
+        trace.mark("ttfb", self._sent_at, time.perf_counter())
+        return response
+
+
+class _HTTPConnection(_TracedConnection, HTTPConnection):
+    def connect(self):
+        stats.incr("connections")
+        super().connect()
+
+
+class _HTTPSConnection(_TracedConnection, HTTPSConnection):
+    # pylint: disable=no-member
+    def connect(self):
+        stats.incr("connections")
+        super().connect()
+        if trace.active():
+            trace.mark("tls", self._connected_at, time.perf_counter())
+        stats.incr("tls_handshakes")
+        if self.sock.session_reused:
+            stats.incr("tls_resumed")
+
+    def getresponse(self, *args, **kwargs):  # pylint: disable=signature-differs
+        response = super().getresponse(*args, **kwargs)
+        # TLS 1.3 tickets arrive after the handshake, so the session is only
+        # worth remembering once the server has started answering.
+        if isinstance(self.ssl_context, _ResumingSSLContext) and self.sock is not None:
+            self.ssl_context.tls_sessions[self.host] = self.sock.session
+        return response
+
+
+class _HTTPPool(HTTPConnectionPool):
+    ConnectionCls = _HTTPConnection
+
+
+class _HTTPSPool(HTTPSConnectionPool):
+    ConnectionCls = _HTTPSConnection
+
+
+class _PooledAdapter(HTTPAdapter):
+    def __init__(self, ssl_context: ssl.SSLContext | None = None, **kwargs) -> None:
+        # init_poolmanager() is called from HTTPAdapter.__init__
+        self._ssl_context = ssl_context
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        if self._ssl_context is not None:
+            kwargs["ssl_context"] = self._ssl_context
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {"http": _HTTPPool, "https": _HTTPSPool}
+
+
+class SessionPool:
+    """Pool of keep-alive ``requests`` sessions, partitioned by host.
+
+    Each session is checked out by one caller at a time, so the pool size also
+    bounds the number of concurrent connections to a host. Sessions for a host
+    share one SSL context, which lets new connections resume the TLS session of
+    an earlier one.
+    """
+
+    def __init__(
+        self, pool_size: int = 10, keep_alive: bool = True, tls_session_reuse: bool = True
+    ) -> None:
+        self.pool_size = pool_size
+        self.keep_alive = keep_alive
+        self.tls_session_reuse = tls_session_reuse
+        self._lock = threading.Lock()
+        self._idle: dict[str, queue.LifoQueue] = {}
+        self._created: dict[str, int] = {}
+        self._ssl_contexts: dict[str, ssl.SSLContext] = {}
+
+    @staticmethod
+    def _host_key(iri: str) -> str:
+        parsed = urlparse(iri)
+        return f"{parsed.scheme}://{parsed.netloc}"
+
+    def _new_session(self, host: str) -> requests.Session:
+        ssl_context = None
+        if self.tls_session_reuse and host.startswith("https:"):
+            ssl_context = self._ssl_contexts.setdefault(host, _ResumingSSLContext())
+        adapter = _PooledAdapter(ssl_context, pool_connections=1, pool_maxsize=1)
+        session = requests.Session()
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        if not self.keep_alive:
+            session.headers["Connection"] = "close"
+        return session
+
+    def _checkout(self, host: str) -> requests.Session:
+        with self._lock:
+            idle = self._idle.setdefault(host, queue.LifoQueue())
+            try:
+                return idle.get_nowait()
+            except queue.Empty:
+                pass
+            if self._created.get(host, 0) < self.pool_size:
+                self._created[host] = self._created.get(host, 0) + 1
+                return self._new_session(host)
+        # Every session for this host is busy; wait for one to be returned.
+        return idle.get()
+
+    @contextmanager
+    def session(self, iri: str):
+        host = self._host_key(iri)
+        session = self._checkout(host)
+        try:
+            yield session
+        finally:
+            stats.incr("requests")
+            self._idle.setdefault(host, queue.LifoQueue()).put(session)
+
+    def close(self) -> None:
+        with self._lock:
+            for idle in self._idle.values():
+                while not idle.empty():
+                    idle.get_nowait().close()
+            self._idle.clear()
+            self._created.clear()
+
+
+_pool = SessionPool()
+_timeout = 30.0
+_cache: HttpCache | None = None
+_limiter = RateLimiter()
+
+
+def configure(config: dict) -> None:
+    """Apply the ``[test_config.transport]`` section."""
+    global _pool, _timeout, _limiter  # pylint: disable=global-statement
+    _pool.close()
+    _pool = SessionPool(
+        pool_size=config.get("pool_size", 10),
+        keep_alive=config.get("keep_alive", True),
+        tls_session_reuse=config.get("tls_session_reuse", True),
+    )
+    _timeout = config.get("timeout", 30.0)
+    _limiter = RateLimiter(
+        requests_per_second=config.get("requests_per_second"),
+        max_retries=config.get("max_retries", 3),
+        backoff=config.get("backoff", 0.5),
+        max_backoff=config.get("max_backoff", 30.0),
+    )
+    if config.get("cache_dir"):
+        enable_cache(config["cache_dir"])
+
+
+def enable_cache(directory: str) -> None:
+    """Cache GET responses on disk in ``directory``."""
+    global _cache  # pylint: disable=global-statement
+    _cache = HttpCache(directory)
+
+
+def session_pool(pool_size: int) -> SessionPool:
+    """A separate SessionPool of ``pool_size`` sessions per host, set up like the shared one."""
+    return SessionPool(
+        pool_size=pool_size,
+        keep_alive=_pool.keep_alive,
+        tls_session_reuse=_pool.tls_session_reuse,
+    )
+
+
+def cache_stats() -> dict[str, int] | None:
+    return _cache.as_dict() if _cache is not None else None
+
+
+def throttle_stats() -> dict[str, float]:
+    return _limiter.as_dict()
+
+
+def close() -> None:
+    _pool.close()
+
+
 def default_headers() -> dict[str, str]:
     return {
         "Accept-Charset": "utf-8",
@@ -33,28 +324,183 @@ def post_headers() -> dict[str, str]:
     return default_headers() | {"Content-Type": PROFILE_TYPE}
 
 
-def get(iri: str, with_profile: bool = False, auth: BaseAuth | None = None):
+def encode_body(body: dict) -> tuple[bytes | BinaryIO, dict[str, str]]:
+    """Serialize ``body`` as JSON, hashing it as it is encoded.
+
+    Returns the body and its Content-Length and Digest headers. Bodies of up
+    to SPOOL_MAX_BYTES are returned as bytes; larger ones are written to a
+    temporary file, returned rewound, so they are never held in memory as
+    one bytes object. The caller closes the file.
+    """
+    buf = io.BytesIO()
+    out: BinaryIO = buf
+    digest = hashlib.sha256()
+    for chunk in json.JSONEncoder().iterencode(body):
+        data = chunk.encode("utf-8")
+        digest.update(data)
+        out.write(data)
+        if out is buf and buf.tell() > SPOOL_MAX_BYTES:
+            out = tempfile.TemporaryFile()  # pylint: disable=consider-using-with
+            out.write(buf.getbuffer())
+            buf = None
+    headers = {
+        "Content-Length": str(out.tell()),
+        "Digest": "SHA-256=" + base64.b64encode(digest.digest()).decode(),
+    }
+    if out is buf:
+        return buf.getvalue(), headers
+    out.seek(0)
+    return out, headers
+
+
+def _send(  # pylint: disable=too-many-arguments
+    method: str,
+    iri: str,
+    headers: dict,
+    auth: BaseAuth | None,
+    body=None,
+    *,
+    retry: bool = True,
+    pool: SessionPool | None = None,
+) -> requests.Response:
+    """Send a request on a pooled session, pacing and retrying as the host requires.
+
+    ``body`` is bytes or a file from encode_body(), which is rewound for each
+    attempt. Requests are signed again on every attempt so that retries
+    carry a current Date. ``retry=False`` sends exactly once. Requests on a
+    caller's own ``pool`` bypass the rate limiter entirely.
+    """
+    if pool is not None:
+        return _attempt(method, iri, headers, auth, body, attempt=0, pool=pool)
+    max_retries = _limiter.max_retries if retry else 0
+    attempt = 0
+    while True:
+        try:
+            r = _attempt(method, iri, headers, auth, body, attempt=attempt)
+        except (requests.ConnectionError, requests.Timeout):
+            _limiter.observe(iri, None)
+            if attempt >= max_retries or not _limiter.should_retry(method, None):
+                raise
+        else:
+            _limiter.observe(iri, r)
+            if attempt >= max_retries or not _limiter.should_retry(method, r.status_code):
+                return r
+        _limiter.wait_before_retry(iri, attempt)
+        attempt += 1
+
+
+def _attempt(  # pylint: disable=too-many-arguments
+    method: str,
+    iri: str,
+    headers: dict,
+    auth: BaseAuth | None,
+    body,
+    *,
+    attempt: int,
+    pool: SessionPool | None = None,
+) -> requests.Response:
+    """Sign and send one attempt at a request, tracing it if tracing is on.
+
+    Without a ``pool`` the request is paced by the rate limiter and sent on
+    the shared pool.
+    """
+    with trace.traced(method, iri, attempt):
+        signed = headers
+        if auth is not None:
+            started = time.perf_counter()
+            signed = headers | auth.sign_request(method, iri, headers, body)
+            trace.mark("sign", started, time.perf_counter())
+        if hasattr(body, "seek"):
+            body.seek(0)
+        if pool is None:
+            started = time.perf_counter()
+            _limiter.acquire(iri)
+            trace.mark("throttle", started, time.perf_counter())
+        with (pool or _pool).session(iri) as session:
+            r = session.request(method, iri, data=body, headers=signed, timeout=_timeout)
+        trace.record_response(r)
+        return r
+
+
+def _cache_lookup(iri: str, headers: dict, auth: BaseAuth | None, fresh: bool):
+    """Return the cache key and any stored entry for a GET."""
+    identity = auth.identity if auth is not None else ""
+    key = _cache.key(iri, headers["Accept"], identity)
+    return key, (None if fresh else _cache.lookup(key))
+
+
+def get(iri: str, with_profile: bool = False, auth: BaseAuth | None = None, fresh: bool = False):
+    """GET ``iri`` and return the decoded JSON body.
+
+    With the HTTP cache enabled, fresh cached documents are returned without
+    a request and stale ones are revalidated. Pass ``fresh=True`` to bypass
+    the cache for documents that must reflect the server's current state.
+    """
     log.info("GET %s", iri)
     headers = get_headers(with_profile)
-    if auth is not None:
-        headers = headers | auth.sign_request("GET", iri, headers, None)
-    r = requests.get(iri, headers=headers, timeout=30.0)
+    cache_key, entry = None, None
+    if _cache is not None:
+        cache_key, entry = _cache_lookup(iri, headers, auth, fresh)
+        if entry is not None and _cache.is_fresh(entry):
+            _cache.incr("hits")
+            return entry["body"]
+        if entry is not None:
+            headers |= _cache.conditional_headers(entry)
+    r = _send("GET", iri, headers, auth)
+    if entry is not None and r.status_code == requests.codes.not_modified:  # pylint: disable=no-member
+        _cache.incr("revalidated")
+        _cache.refresh(cache_key, entry, r.headers)
+        return entry["body"]
     r.raise_for_status()
     try:
-        return r.json()
+        body = r.json()
     except (requests.exceptions.JSONDecodeError, ValueError):
         log.warning(
             "Non-JSON response from %s (Content-Type: %s)", iri, r.headers.get("Content-Type")
         )
         raise
+    if _cache is not None:
+        _cache.incr("misses")
+        _cache.store(cache_key, iri, r.headers, body)
+    return body
+
 
+def post(
+    iri: str,
+    body: dict,
+    auth: BaseAuth | None = None,
+    retry: bool = True,
+    pool: SessionPool | None = None,
+):
+    """POST ``body`` as JSON and return the decoded response, if any.
 
-def post(iri: str, body: dict, auth: BaseAuth | None = None):
+    A 201 without a body returns ``{"id": <Location>}``, since C2S servers
+    may only give the new activity's id in the Location header. With a
+    ``pool`` from session_pool() the request is sent once on it, without
+    rate limiting.
+    """
     log.info("POST %s", iri)
-    body_bytes = json.dumps(body).encode("utf-8")
-    headers = post_headers()
-    if auth is not None:
-        headers = headers | auth.sign_request("POST", iri, headers, body_bytes)
-    r = requests.post(iri, data=body_bytes, headers=headers, timeout=30.0)
+    data, body_headers = encode_body(body)
+    try:
+        r = _send("POST", iri, post_headers() | body_headers, auth, data, retry=retry, pool=pool)
+    finally:
+        if not isinstance(data, bytes):
+            data.close()
     r.raise_for_status()
-    return r.json() if r.content else {}
+    if r.content:
+        return r.json()
+    if r.status_code == requests.codes.created and r.headers.get("Location"):  # pylint: disable=no-member
+        return {"id": urljoin(iri, r.headers["Location"])}
+    return {}
+
+
+async def aget(
+    iri: str, with_profile: bool = False, auth: BaseAuth | None = None, fresh: bool = False
+):
+    """Async flavour of get(); runs on the pooled sessions in a worker thread."""
+    return await asyncio.to_thread(get, iri, with_profile, auth, fresh)
+
+
+async def apost(iri: str, body: dict, auth: BaseAuth | None = None):
+    """Async flavour of post(); runs on the pooled sessions in a worker thread."""
+    return await asyncio.to_thread(post, iri, body, auth)
@@ -0,0 +1,18 @@
+# Copyright (c) 2023 Pat Long
+# SPDX-License-Identifier: MIT
+
+"""Benchmarks of ap-test's own components; none of them need the network.
+
+Run them with ``python -m benchmarks``.
+"""
+
+from . import collection, ingest, signing, startup, transport
+
+# Benchmark name -> run(quick) returning JSON-serializable results
+BENCHMARKS = {
+    "signing": signing.run,
+    "transport": transport.run,
+    "ingest": ingest.run,
+    "collection": collection.run,
+    "startup": startup.run,
+}
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+# Copyright (c) 2023 Pat Long
+# SPDX-License-Identifier: MIT
+
+import argparse as ap
+import json
+import logging
+import platform
+import sys
+import time
+from datetime import datetime, timezone
+from importlib import metadata
+
+from benchmarks import BENCHMARKS
+
+
+def _version() -> str | None:
+    try:
+        return metadata.version("ap-testsuite")
+    except metadata.PackageNotFoundError:
+        return None
+
+
+def main():
+    parser = ap.ArgumentParser("python -m benchmarks")
+    parser.add_argument(
+        "names", nargs="*", metavar="NAME",
+        help=f"benchmarks to run (default: all of {', '.join(BENCHMARKS)})",
+    )
+    parser.add_argument(
+        "--output", "-o", default="benchmark-results.json", help="JSON file to write results to"
+    )
+    parser.add_argument("--quick", action="store_true", help="fewer iterations and smaller inputs")
+    parser.add_argument("--verbose", "-v", action="store_true", help="log at INFO level")
+    opt = parser.parse_args()
+    unknown = [name for name in opt.names if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"unknown benchmark {', '.join(unknown)}; choose from {', '.join(BENCHMARKS)}")
+    logging.basicConfig(
+        level=logging.INFO if opt.verbose else logging.WARNING,
+        format="%(name)-24s: %(levelname)-8s %(message)s",
+    )
+
+    results = {
+        "started": datetime.now(timezone.utc).isoformat(),
+        "version": _version(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "quick": opt.quick,
+        "benchmarks": {},
+    }
+    for name in opt.names or BENCHMARKS:
+        print(f"#### Running {name} ####")
+        sys.stdout.flush()
+        start = time.perf_counter()
+        results["benchmarks"][name] = BENCHMARKS[name](opt.quick)
+        print(f"#### Benchmark {name} took {time.perf_counter() - start:.1f}s ####")
+
+    with open(opt.output, "w", encoding="utf-8") as fh:
+        json.dump(results, fh, indent=2)
+        fh.write("\n")
+    print(f"Results written to {opt.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+# Copyright (c) 2023 Pat Long
+# SPDX-License-Identifier: MIT
+
+import logging
+
+from ap_test.collection import CrawlLimits, find_in_collection
+
+from .harness import throughput, timed
+
+log = logging.getLogger(__name__)
+
+BASE = "https://bench.invalid/users/bench/followers"
+PAGE_SIZE = 100
+
+
+def member(index: int) -> str:
+    return f"https://peer.invalid/users/u{index}"
+
+
+def synthetic_collection(total: int, page_size: int = PAGE_SIZE) -> dict[str, dict]:
+    """Pages of an OrderedCollection of ``total`` actor IDs, by IRI."""
+    pages = {
+        BASE: {
+            "id": BASE,
+            "type": "OrderedCollection",
+            "totalItems": total,
+            "first": f"{BASE}?page=1",
+        }
+    }
+    count = (total + page_size - 1) // page_size
+    for number in range(1, count + 1):
+        iri = f"{BASE}?page={number}"
+        first = (number - 1) * page_size
+        pages[iri] = {
+            "id": iri,
+            "type": "OrderedCollectionPage",
+            "partOf": BASE,
+            "orderedItems": [member(i) for i in range(first, min(first + page_size, total))],
+        }
+        if number < count:
+            pages[iri]["next"] = f"{BASE}?page={number + 1}"
+    return pages
+
+
+def _bench_size(total: int, iterations: int) -> dict:
+    pages = synthetic_collection(total)
+    last = member(total - 1)
+    limits = CrawlLimits(max_pages=None, max_items=None, timeout=None)
+    if not find_in_collection(BASE, last, pages.get, limits):
+        raise RuntimeError(f"last item of the {total}-item collection was not found")
+    summary = throughput(
+        timed(lambda: find_in_collection(BASE, last, pages.get, limits), iterations)
+    )
+    summary["items_per_second"] = total * summary["per_second"]
+    return {"pages": len(pages), "crawl": summary}
+
+
+def run(quick: bool = False) -> dict:
+    """Time find_in_collection() to reach the last item of in-memory
+    collections, so only the crawler's own overhead is measured."""
+    largest = 10**5 if quick else 10**6
+    sizes = [10**exponent for exponent in range(3, 7) if 10**exponent <= largest]
+    # Fewer repeats of the larger collections keep each size to about a second
+    return {f"items_{total}": _bench_size(total, max(3, largest // total)) for total in sizes}
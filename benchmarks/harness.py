@@ -0,0 +1,77 @@
+# Copyright (c) 2023 Pat Long
+# SPDX-License-Identifier: MIT
+
+import http.server
+import json
+import logging
+import threading
+import time
+from typing import Callable
+
+from ap_test.metrics import summarize
+
+log = logging.getLogger(__name__)
+
+
+def timed(fn: Callable[[], object], iterations: int) -> list[float]:
+    """Seconds taken by each of ``iterations`` calls of ``fn``."""
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def throughput(samples: list[float]) -> dict[str, float]:
+    """Summary of per-operation durations plus the operations per second."""
+    summary = summarize(samples)
+    total = sum(samples)
+    summary["per_second"] = len(samples) / total if total else 0.0
+    return summary
+
+
+class _StandInHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        body = self.server.document
+        self.send_response(200)
+        self.send_header("Content-Type", "application/activity+json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        self.send_response(202)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, fmt, *args):  # pylint: disable=arguments-differ
+        log.debug("StandInServer: " + fmt, *args)
+
+
+class StandInServer:
+    """Local HTTP server that answers every GET with ``document`` and every
+    POST with 202, standing in for the server under test."""
+
+    def __init__(self, document: dict) -> None:
+        self._httpd = http.server.ThreadingHTTPServer(("127.0.0.1", 0), _StandInHandler)
+        self._httpd.daemon_threads = True
+        self._httpd.document = json.dumps(document).encode("utf-8")
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self._httpd.socket.getsockname()[1]}"
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *_):
+        self._httpd.shutdown()
+        self._thread.join(timeout=5.0)
+        self._httpd.server_close()
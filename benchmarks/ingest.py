@@ -0,0 +1,54 @@
+# Copyright (c) 2023 Pat Long
+# SPDX-License-Identifier: MIT
+
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from ap_test import transport
+from ap_test.activity import make_create, make_note
+from ap_test.metrics import summarize
+from ap_test.peer import Peer
+from ap_test.server import InboxServer, ServerLimits
+
+log = logging.getLogger(__name__)
+
+
+def _send(server: InboxServer, peer: Peer, senders: int, count: int) -> dict:
+    actor_id = peer.actor_id("prober")
+    auth = peer.auth("prober")
+
+    def deliver(_) -> float:
+        start = time.perf_counter()
+        transport.post(server.inbox_url, make_create(actor_id, make_note(actor_id)), auth=auth)
+        return time.perf_counter() - start
+
+    # One more session for the server's own fetch of the sender's key
+    transport.configure({"pool_size": senders + 1})
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=senders) as pool:
+        latencies = list(pool.map(deliver, range(count)))
+    elapsed = time.perf_counter() - start
+    transport.close()
+    return {
+        "deliveries": count,
+        "seconds": elapsed,
+        "per_second": count / elapsed,
+        "latency": summarize(latencies),
+    }
+
+
+def run(quick: bool = False) -> dict:
+    """Signed deliveries per second that InboxServer verifies and indexes,
+    from 1, 4 and 16 concurrent senders."""
+    per_sender = 25 if quick else 200
+    peer = Peer()
+    server = InboxServer(peer=peer, limits=ServerLimits(workers=32))
+    results = {}
+    with server:
+        # Fetch and cache the sender's key before timing
+        _send(server, peer, 1, 1)
+        for senders in (1, 4, 16):
+            results[f"senders_{senders}"] = _send(server, peer, senders, senders * per_sender)
+    transport.configure({})
+    return results
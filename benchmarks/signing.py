@@ -0,0 +1,43 @@
+# Copyright (c) 2023 Pat Long
+# SPDX-License-Identifier: MIT
+
+import json
+import logging
+
+from cryptography.hazmat.primitives.asymmetric import rsa
+from requests.structures import CaseInsensitiveDict
+
+from ap_test.activity import make_note
+from ap_test.auth import HttpSignatureAuth, parse_signature, verify_signature
+
+from .harness import throughput, timed
+
+log = logging.getLogger(__name__)
+
+ACTOR_ID = "https://bench.invalid/users/bench"
+INBOX = "https://bench.invalid/inbox"
+
+
+def _bench_key(key_size: int, iterations: int) -> dict:
+    key = rsa.generate_private_key(public_exponent=65537, key_size=key_size)
+    auth = HttpSignatureAuth(ACTOR_ID, key)
+    body = json.dumps(make_note(ACTOR_ID)).encode("utf-8")
+    headers = CaseInsensitiveDict(
+        auth.sign_request("POST", INBOX, {}, body) | {"Host": "bench.invalid"}
+    )
+    params = parse_signature(headers["Signature"])
+    public_key = key.public_key()
+
+    def verify():
+        verify_signature("POST", "/inbox", headers, params, public_key)
+
+    return {
+        "sign": throughput(timed(lambda: auth.sign_request("POST", INBOX, {}, body), iterations)),
+        "verify": throughput(timed(verify, iterations)),
+    }
+
+
+def run(quick: bool = False) -> dict:
+    """RSA-SHA256 signing and verification of an inbox POST with HttpSignatureAuth."""
+    iterations = 50 if quick else 500
+    return {f"rsa{size}": _bench_key(size, iterations) for size in (2048, 4096)}
@@ -0,0 +1,60 @@
+# Copyright (c) 2023 Pat Long
+# SPDX-License-Identifier: MIT
+
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+
+from ap_test.helper import TestContext
+from ap_test.metrics import summarize
+
+from .harness import timed
+
+log = logging.getLogger(__name__)
+
+# Checkout the subprocesses import ap_test from
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# A federation setup with a local server and peer, without any lookups
+# that would need the network
+CONFIG = """
+[test_config]
+server = 'https://bench.invalid'
+
+[test_config.resources]
+local_actor_id = 'users/bench'
+actor_id = 'users/bench'
+object_id = 'users/bench/statuses/1'
+inbox_id = 'users/bench/inbox'
+followers_id = 'users/bench/followers'
+following_id = 'users/bench/following'
+
+[test_config.local_server]
+port = 0
+
+[test_config.peer]
+count = 100
+"""
+
+
+def _subprocess(*args: str) -> None:
+    subprocess.run([sys.executable, *args], check=True, capture_output=True, cwd=ROOT)
+
+
+def run(quick: bool = False) -> dict:
+    """Interpreter start-up plus import of ap_test, `ap-test --help`, and
+    loading a federation config."""
+    iterations = 3 if quick else 10
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "bench.toml")
+        with open(path, "w", encoding="utf-8") as fh:
+            fh.write(CONFIG)
+        load_config = summarize(timed(lambda: TestContext().load_config(path), iterations))
+    imports = timed(lambda: _subprocess("-c", "import ap_test.__main__"), iterations)
+    return {
+        "import": summarize(imports),
+        "help": summarize(timed(lambda: _subprocess("-m", "ap_test", "--help"), iterations)),
+        "load_config": load_config,
+    }
@@ -0,0 +1,53 @@
+# Copyright (c) 2023 Pat Long
+# SPDX-License-Identifier: MIT
+
+import json
+import logging
+
+import requests
+
+from ap_test import transport
+from ap_test.activity import make_note
+
+from .harness import StandInServer, throughput, timed
+
+log = logging.getLogger(__name__)
+
+ACTOR_ID = "https://bench.invalid/users/bench"
+
+
+def _compare(direct: list[float], through: list[float]) -> dict:
+    direct_summary = throughput(direct)
+    through_summary = throughput(through)
+    return {
+        "requests": direct_summary,
+        "transport": through_summary,
+        "overhead_p50": through_summary["p50"] - direct_summary["p50"],
+    }
+
+
+def run(quick: bool = False) -> dict:
+    """Cost of transport.get()/post() over a bare requests.Session, against a
+    local stand-in server so only client-side work differs."""
+    iterations = 200 if quick else 2000
+    note = make_note(ACTOR_ID)
+    transport.configure({})
+    with StandInServer(note) as server, requests.Session() as session:
+        url = f"{server.base_url}/users/bench/statuses/1"
+        inbox = f"{server.base_url}/inbox"
+        body = json.dumps(note).encode("utf-8")
+        # Open the keep-alive connections before timing
+        session.get(url).json()
+        transport.get(url, fresh=True)
+        results = {
+            "get": _compare(
+                timed(lambda: session.get(url).json(), iterations),
+                timed(lambda: transport.get(url, fresh=True), iterations),
+            ),
+            "post": _compare(
+                timed(lambda: session.post(inbox, data=body), iterations),
+                timed(lambda: transport.post(inbox, note), iterations),
+            ),
+        }
+    transport.close()
+    return results
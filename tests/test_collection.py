@@ -0,0 +1,58 @@
+# Copyright (c) 2023 Pat Long
+# SPDX-License-Identifier: MIT
+
+import pytest
+import requests
+
+from ap_test.collection import CollectionIndex, CrawlLimits
+
+BASE = "https://example.invalid/followers"
+
+
+def _member(index: int) -> str:
+    return f"https://example.invalid/u{index}"
+
+
+def _pages(total: int, page_size: int = 10) -> dict[str, dict]:
+    pages = {BASE: {"id": BASE, "totalItems": total, "first": f"{BASE}?page=0"}}
+    for number in range(0, total // page_size):
+        first = number * page_size
+        pages[f"{BASE}?page={number}"] = {
+            "orderedItems": [_member(i) for i in range(first, first + page_size)],
+            "next": f"{BASE}?page={number + 1}" if first + page_size < total else None,
+        }
+    return pages
+
+
+def test_truncated_index_searches_past_the_limits():
+    index = CollectionIndex(CrawlLimits(max_pages=3), fetch=_pages(100).get)
+    assert index.contains(BASE, _member(5)) is True
+    assert index.contains(BASE, _member(99)) is True
+    assert index.contains(BASE, "https://example.invalid/missing") is False
+
+
+def test_complete_index_answers_misses_from_the_index():
+    pages = _pages(20)
+    fetches = []
+
+    def fetch(iri):
+        fetches.append(iri)
+        return pages[iri]
+
+    index = CollectionIndex(CrawlLimits(max_pages=10), fetch=fetch)
+    assert index.contains(BASE, "https://example.invalid/missing") is False
+    assert index.contains(BASE, "https://example.invalid/other") is False
+    assert len(fetches) == 3
+
+
+def test_failed_confirmation_crawl_raises():
+    pages = _pages(20)
+    index = CollectionIndex(CrawlLimits(max_pages=10), fetch=pages.get, exact_limit=5)
+    assert index.contains(BASE, _member(3)) is True
+
+    def fail(iri):
+        raise requests.HTTPError(f"500 for {iri}")
+
+    index.fetch = fail
+    with pytest.raises(requests.HTTPError):
+        index.contains(BASE, _member(3))
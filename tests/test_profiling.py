@@ -0,0 +1,22 @@
+# Copyright (c) 2023 Pat Long
+# SPDX-License-Identifier: MIT
+
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from ap_test.profiling import Profiler
+
+
+def test_threads_started_while_profiling_run(tmp_path):
+    profiler = Profiler(str(tmp_path))
+    profiler.start()
+    ran = threading.Event()
+    with profiler.profile("threads"):
+        thread = threading.Thread(target=ran.set)
+        thread.start()
+        thread.join(5)
+        with ThreadPoolExecutor(2) as pool:
+            assert list(pool.map(abs, [-1, -2], timeout=5)) == [1, 2]
+    assert ran.is_set()
+    assert os.path.exists(tmp_path / "threads.pstats")
@@ -0,0 +1,28 @@
+# Copyright (c) 2023 Pat Long
+# SPDX-License-Identifier: MIT
+
+import math
+
+from ap_test.ratelimit import RateLimiter, _HostBucket
+
+HEADERS = {"RateLimit-Limit": "2", "RateLimit-Remaining": "0", "RateLimit-Reset": "1"}
+
+
+def test_exhausted_window_waits_for_reset():
+    bucket = _HostBucket(interval=0.0, fallback=0.5)
+    bucket.observe(0.0, 200, HEADERS)
+    assert [bucket.reserve(0.0) for _ in range(2)] == [1.0, 1.0]
+
+
+def test_unknown_reset_falls_back_to_backoff():
+    bucket = _HostBucket(interval=0.0, fallback=0.5)
+    bucket.observe(0.0, 200, HEADERS)
+    waits = [bucket.reserve(0.0) for _ in range(4)]
+    assert waits == [1.0, 1.0, 1.5, 2.0]
+    assert all(math.isfinite(wait) for wait in waits)
+
+
+def test_unknown_reset_falls_back_to_configured_rate():
+    limiter = RateLimiter(requests_per_second=10, backoff=5.0)
+    bucket = limiter._bucket("https://example.invalid/")  # pylint: disable=protected-access
+    assert bucket.fallback == 0.1
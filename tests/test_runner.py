@@ -0,0 +1,37 @@
+# Copyright (c) 2023 Pat Long
+# SPDX-License-Identifier: MIT
+
+from ap_test import federation
+from ap_test.runner import build_graph
+
+# Tests that follow, block or accept actor_id, or check that it follows
+FOLLOW_STATE_TESTS = [
+    federation.DeliversFollowTest,
+    federation.DeliversBlockTest,
+    federation.DeliversUndoTest,
+    federation.NoDeliverBlocksTest,
+    federation.SendFollowAcceptanceTest,
+    federation.AcceptFollowTest,
+    federation.RejectFollowTest,
+    federation.ReceiveAcceptFollowTest,
+    federation.GetFollowersAfterAcceptTest,
+]
+
+
+def _ancestors(graph, test) -> set:
+    found = set()
+    pending = list(graph[test])
+    while pending:
+        dep = pending.pop()
+        if dep not in found:
+            found.add(dep)
+            pending.extend(graph[dep])
+    return found
+
+
+def test_follow_state_tests_run_in_list_order():
+    tests = [cls(None) for cls in federation.FEDERATION_TESTS]
+    graph = build_graph(tests)
+    by_class = {type(test): test for test in tests}
+    for earlier, later in zip(FOLLOW_STATE_TESTS, FOLLOW_STATE_TESTS[1:]):
+        assert by_class[earlier] in _ancestors(graph, by_class[later])
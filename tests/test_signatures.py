@@ -0,0 +1,68 @@
+# Copyright (c) 2023 Pat Long
+# SPDX-License-Identifier: MIT
+
+import pytest
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from requests.structures import CaseInsensitiveDict
+
+from ap_test import transport
+from ap_test.auth import HttpSignatureAuth, SignatureError
+from ap_test.server import InboxServer
+from ap_test.signatures import KeyCache, SignatureVerifier
+
+ACTOR_ID = "https://example.invalid/users/a"
+INBOX = "https://local.invalid/inbox"
+BODY = b'{"type": "Note"}'
+
+
+def _key():
+    return rsa.generate_private_key(public_exponent=65537, key_size=2048)
+
+
+def _actor(key) -> dict:
+    pem = key.public_key().public_bytes(
+        serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo
+    )
+    key_doc = {"id": f"{ACTOR_ID}#main-key", "publicKeyPem": pem.decode()}
+    return {"id": ACTOR_ID, "publicKey": key_doc}
+
+
+def _signed(key) -> CaseInsensitiveDict:
+    signed = HttpSignatureAuth(ACTOR_ID, key).sign_request("POST", INBOX, {}, BODY)
+    return CaseInsensitiveDict(signed | {"Host": "local.invalid"})
+
+
+@pytest.fixture(name="signer")
+def _signer(monkeypatch):
+    """The sender's key, served as its actor document."""
+    key = _key()
+    monkeypatch.setattr(transport, "get", lambda *args, **kwargs: _actor(key))
+    return key
+
+
+def test_malformed_request_does_not_refetch_key(signer):
+    verifier = SignatureVerifier(KeyCache(refetch_interval=0.0))
+    verifier.verify("POST", "/inbox", _signed(signer), BODY)
+    headers = _signed(signer)
+    headers["Date"] = "Mon, 01 Jan 2001 00:00:00 GMT"
+    with pytest.raises(SignatureError):
+        verifier.verify("POST", "/inbox", headers, BODY)
+    assert verifier.keys.stats["fetches"] == 1
+
+
+def test_signature_mismatch_refetches_key(signer):
+    verifier = SignatureVerifier(KeyCache(refetch_interval=0.0))
+    verifier.verify("POST", "/inbox", _signed(signer), BODY)
+    with pytest.raises(SignatureError):
+        verifier.verify("POST", "/inbox", _signed(_key()), BODY)
+    assert verifier.keys.stats["fetches"] == 2
+
+
+def test_proxied_delivery_is_checked_against_public_path(signer):
+    public_url = "https://proxy.invalid/ap/inbox"
+    signed = HttpSignatureAuth(ACTOR_ID, signer).sign_request("POST", public_url, {}, BODY)
+    headers = CaseInsensitiveDict(signed | {"Host": "proxy.invalid"})
+    server = InboxServer(public_url=public_url)
+    # The proxy forwards /ap/inbox to the local server's /inbox
+    assert server._accept("/inbox", headers, BODY, BODY.decode(), 0.0) == 202  # pylint: disable=protected-access
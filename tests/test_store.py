@@ -0,0 +1,65 @@
+# Copyright (c) 2023 Pat Long
+# SPDX-License-Identifier: MIT
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from ap_test import transport
+from ap_test.store import ObjectStore
+
+IRI = "https://example.invalid/users/a"
+
+
+class _SlowGet:  # pylint: disable=too-few-public-methods
+    """Stands in for transport.get; each call blocks until released."""
+
+    def __init__(self, result) -> None:
+        self.result = result
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.calls = 0
+
+    def __call__(self, iri, with_profile=False, auth=None, fresh=False):
+        self.calls += 1
+        self.started.set()
+        self.release.wait(5)
+        if isinstance(self.result, BaseException):
+            raise self.result
+        return dict(self.result)
+
+
+def test_invalidate_during_fetch_is_not_lost(monkeypatch):
+    get = _SlowGet({"id": IRI, "followers": 1})
+    monkeypatch.setattr(transport, "get", get)
+    store = ObjectStore()
+    with ThreadPoolExecutor(1) as pool:
+        fetch = pool.submit(store.get, IRI)
+        get.started.wait(5)
+        store.invalidate(IRI)
+        get.release.set()
+        assert fetch.result()["followers"] == 1
+    assert IRI not in store
+    store.get(IRI)
+    assert get.calls == 2
+
+
+def test_waiters_see_base_exceptions(monkeypatch):
+    get = _SlowGet(KeyboardInterrupt())
+    monkeypatch.setattr(transport, "get", get)
+    store = ObjectStore()
+    with ThreadPoolExecutor(2) as pool:
+        leader = pool.submit(store.get, IRI)
+        get.started.wait(5)
+        waiter = pool.submit(store.get, IRI)
+        deadline = time.monotonic() + 5
+        while store.stats["shared"] == 0 and time.monotonic() < deadline:
+            time.sleep(0.001)
+        assert store.stats["shared"] == 1
+        get.release.set()
+        with pytest.raises(KeyboardInterrupt):
+            leader.result(5)
+        with pytest.raises(KeyboardInterrupt):
+            waiter.result(5)
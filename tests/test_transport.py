@@ -0,0 +1,64 @@
+# Copyright (c) 2023 Pat Long
+# SPDX-License-Identifier: MIT
+
+import json
+from contextlib import contextmanager
+from types import SimpleNamespace
+
+import requests
+
+from ap_test import transport
+from ap_test.activity import make_large_object
+from ap_test.auth import body_digest
+
+
+def test_small_bodies_stay_in_memory():
+    body = {"type": "Note", "content": "hello"}
+    data, headers = transport.encode_body(body)
+    assert data == json.dumps(body).encode("utf-8")
+    assert headers["Content-Length"] == str(len(data))
+    assert headers["Digest"] == body_digest(data)
+
+
+def test_large_bodies_go_to_a_file():
+    body = make_large_object("https://example.invalid/users/a", 2 * transport.SPOOL_MAX_BYTES)
+    data, headers = transport.encode_body(body)
+    with data:
+        encoded = data.read()
+    assert encoded == json.dumps(body).encode("utf-8")
+    assert headers["Content-Length"] == str(len(encoded))
+    assert headers["Digest"] == body_digest(encoded)
+
+
+class _Pool:  # pylint: disable=too-few-public-methods
+    """Stands in for a SessionPool; answers every request with an empty body."""
+
+    def __init__(self, status: int = 202, headers: dict | None = None) -> None:
+        self.status = status
+        self.headers = headers or {}
+        self.sent = 0
+
+    @contextmanager
+    def session(self, _iri):
+        self.sent += 1
+        response = requests.Response()
+        response.status_code = self.status
+        response.headers.update(self.headers)
+        response._content = b""  # pylint: disable=protected-access
+        yield SimpleNamespace(request=lambda *args, **kwargs: response)
+
+
+def test_posts_on_own_pool_skip_the_rate_limiter(monkeypatch):
+    def acquire(iri):
+        raise AssertionError(f"paced {iri}")
+
+    monkeypatch.setattr(transport._limiter, "acquire", acquire)  # pylint: disable=protected-access
+    pool = _Pool()
+    assert transport.post("https://example.invalid/outbox", {"type": "Note"}, pool=pool) == {}
+    assert pool.sent == 1
+
+
+def test_created_without_body_returns_location_as_id():
+    pool = _Pool(201, {"Location": "/activities/1"})
+    result = transport.post("https://example.invalid/outbox", {"type": "Note"}, pool=pool)
+    assert result == {"id": "https://example.invalid/activities/1"}